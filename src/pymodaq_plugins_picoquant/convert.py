@@ -0,0 +1,236 @@
+"""
+Batch conversion of T3 acquisitions into TOF histograms, FLIM cubes and intensity images
+
+    th260-convert FOLDER [-o OUTPUT] [-j WORKERS] [--nbins 1024] [--nx NX --ny NY --marker 65 --channel 0]
+
+The inputs found in the folder are the FIFO captures (folders holding a records.bin file, see
+hardware.picoquant.replay), the PTU files (TimeHarp 260 and HydraHarp T3 records) and the h5 photon files saved by the
+TH260 plugin in T3 mode. Each input is processed by a worker of a process pool and gives a {name}_processed.h5 file
+(PyMoDAQ format) in the output folder. Inputs whose output already exists are skipped unless --overwrite is given.
+
+The FLIM cubes are saved by tiles of --tile-x lines in a chunked {name}_flim.h5 (or {name}_flim.zarr) file, only the
+lines being scanned being held in memory, as sparse CSR arrays in {name}_flim.h5 with --flim-store sparse (low photon
+counts), or within the processed file with --flim-store memory.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Iterator, List, Tuple, Union
+
+import numpy as np
+from phconvert import pqreader
+
+from pymodaq_data.data import Axis, DataToExport, DataCalculated
+from pymodaq_data.h5modules.saving import H5SaverLowLevel
+from pymodaq_data.h5modules.data_saving import DataToExportSaver
+
+from pymodaq_plugins_picoquant.processing.chunks import PhotonChunk, T3Decoder
+from pymodaq_plugins_picoquant.processing.flim import (FlimAccumulator, FlimStore, TiledFlimAccumulator,
+                                                        SparseFlimAccumulator)
+from pymodaq_plugins_picoquant.processing.offline import RAW_RECORDS, open_records
+from pymodaq_plugins_picoquant.processing.photons import T3PhotonFile, nanotime_histograms
+
+
+OUTPUT_SUFFIX = '_processed'
+FLIM_SUFFIX = '_flim'
+FLIM_STORES = ('h5', 'zarr', 'sparse', 'memory')
+PTU_T3_RECORDS = ('rtHydraHarp2T3', 'rtTimeHarp260NT3', 'rtTimeHarp260PT3')  # same layout as the TH260 FIFO
+
+
+def find_inputs(folder: Union[str, Path]) -> List[Path]:
+    """The capture folders, PTU and h5 photon files of a folder (not recursive), sorted by name"""
+    inputs = []
+    for path in sorted(Path(folder).iterdir()):
+        if path.name.startswith('.'):  # hidden, such as the outputs being written
+            continue
+        elif path.is_dir() and path.joinpath(RAW_RECORDS).is_file():
+            inputs.append(path)
+        elif path.suffix.lower() == '.ptu' or (path.suffix.lower() == '.h5' and
+                                               not path.stem.endswith((OUTPUT_SUFFIX, FLIM_SUFFIX))):
+            inputs.append(path)
+    return inputs
+
+
+def output_path(path: Path, output_folder: Union[str, Path]) -> Path:
+    return Path(output_folder).joinpath(f'{path.stem}{OUTPUT_SUFFIX}.h5')
+
+
+def _iter_records(records: np.ndarray, chunk_size: int) -> Iterator[PhotonChunk]:
+    decoder = T3Decoder(chunk_size, pool_size=1)
+    for start in range(0, records.size, chunk_size):
+        chunk = decoder.decode(records[start:start + chunk_size])
+        yield chunk
+        chunk.release()
+
+
+def _iter_photon_file(path: Path, chunk_size: int) -> Iterator[PhotonChunk]:
+    with T3PhotonFile(path) as photons:
+        for detectors, timestamps, nanotimes in photons.iter_chunks(chunk_size):
+            yield PhotonChunk(detectors, timestamps, nanotimes)
+
+
+def open_photons(path: Path, chunk_size: int = 2 ** 20) -> Tuple[Iterator[PhotonChunk], float, int]:
+    """Decoded records of an input, chunk by chunk
+
+    Returns
+    -------
+    Iterator[PhotonChunk]: the chunks, released once the next one is requested
+    float: the nanotime resolution in ns (None if unknown)
+    int: the size of the input in bytes
+    """
+    if path.is_dir():
+        header = json.loads(path.joinpath('header.json').read_text())
+        records_path = path.joinpath(RAW_RECORDS)
+        records = open_records(records_path) if records_path.stat().st_size > 0 else np.zeros((0,), np.uint32)
+        return _iter_records(records, chunk_size), header['resolution'] / 1000, records_path.stat().st_size
+    elif path.suffix.lower() == '.ptu':
+        records, spec, tags = pqreader.ptu_reader(str(path))  # the whole file is read at once by phconvert
+        if spec.get('record_type', None) not in PTU_T3_RECORDS:
+            raise ValueError(f'{path.name} does not hold TimeHarp 260/HydraHarp T3 records')
+        return _iter_records(records, chunk_size), tags['MeasDesc_Resolution']['value'] * 1e9, path.stat().st_size
+    else:
+        return _iter_photon_file(path, chunk_size), None, path.stat().st_size
+
+
+def save_results(path: Path, histograms: np.ndarray, flim: FlimAccumulator = None, resolution: float = None,
+                 source: str = ''):
+    """Save the TOF histograms and the FLIM cube (if held in memory) and intensity image (if any) in a PyMoDAQ h5
+    file"""
+    nbins = histograms.shape[-1]
+    time_axis = dict(label='Time', units='ns', data=np.arange(nbins) * resolution) if resolution is not None else \
+        dict(label='Time', units='bin', data=np.arange(nbins, dtype=float))
+    dte = DataToExport('processed', data=[
+        DataCalculated('TOF', data=[histogram.astype(np.float64) for histogram in histograms],
+                       labels=[f'CH{ind:02d}' for ind in range(histograms.shape[0])],
+                       axes=[Axis(**time_axis, index=0)])])
+    if flim is not None and not isinstance(flim, (TiledFlimAccumulator, SparseFlimAccumulator)):
+        dte.append(DataCalculated('FLIM', data=[flim.cube.astype(np.float64)], nav_indexes=(0, 1),
+                                  axes=[Axis('x', 'pixel', data=np.arange(flim.Nx, dtype=float), index=0),
+                                        Axis('y', 'pixel', data=np.arange(flim.Ny, dtype=float), index=1),
+                                        Axis(**time_axis, index=2)]))
+    if flim is not None:
+        dte.append(DataCalculated('Intensity', data=[flim.intensity.astype(np.float64)],
+                                  axes=[Axis('x', 'pixel', data=np.arange(flim.Nx, dtype=float), index=0),
+                                        Axis('y', 'pixel', data=np.arange(flim.Ny, dtype=float), index=1)]))
+    h5saver = H5SaverLowLevel(save_type='detector')
+    h5saver.init_file(file_name=path, new_file=True, metadata=dict(source=source))
+    try:
+        DataToExportSaver(h5saver).add_data(h5saver.get_set_group(h5saver.raw_group, 'processed'), dte)
+    finally:
+        h5saver.close_file()
+
+
+def convert_file(path: Union[str, Path], output: Union[str, Path], nbins: int = 1024, Nx: int = 0, Ny: int = 0,
+                 marker: int = 65, channel: int = 0, Nchannels: int = 2, chunk_size: int = 2 ** 20,
+                 flim_store: str = 'h5', tile_x: int = 16, flim_dtype: str = 'uint32') -> dict:
+    """Process a single input (in a worker process), see find_inputs
+
+    Parameters
+    ----------
+    path: (str or Path) the input
+    output: (str or Path) the h5 file to create, written as a hidden file renamed once complete
+    nbins: (int) number of nanotime bins of the histograms
+    Nx: (int) number of pixels along x of the FLIM cube, no FLIM cube if 0
+    Ny: (int) number of pixels along y of the FLIM cube
+    marker: (int) detector code of the marker starting a new pixel
+    channel: (int) channel of the FLIM cube
+    Nchannels: (int) number of input channels
+    chunk_size: (int) number of records processed at once
+    flim_store: (str) one of FLIM_STORES, the FLIM cube is saved next to the output in a chunked h5 file or zarr
+                directory, as sparse arrays in an h5 file, or within the output (held in memory)
+    tile_x: (int) number of lines of the tiles of the FLIM store
+    flim_dtype: (str) uint16 or uint32, the counts of the FLIM store
+
+    Returns
+    -------
+    dict: path, output, Nrecords, nbytes (size of the input) and duration (in s)
+    """
+    start = time.perf_counter()
+    path, output = Path(path), Path(output)
+    chunks, resolution, nbytes = open_photons(path, chunk_size)
+    histograms = np.zeros((Nchannels, nbins), dtype=np.int64)
+    flim = None
+    if Nx > 0 and Ny > 0:
+        if flim_store == 'memory':
+            flim = FlimAccumulator(Nx, Ny, nbins, marker, channel)
+        elif flim_store == 'sparse':
+            flim = SparseFlimAccumulator(Nx, Ny, nbins, marker, channel)
+        else:
+            store = FlimStore(output.with_name(f'{path.stem}{FLIM_SUFFIX}.{flim_store}'), Nx, Ny, nbins,
+                              tile=(tile_x, None), dtype=flim_dtype)
+            flim = TiledFlimAccumulator(store, marker, channel)
+    Nrecords = 0
+    for chunk in chunks:
+        Nrecords += len(chunk)
+        histograms += nanotime_histograms(chunk.detectors, chunk.nanotimes, nbins, Nchannels)
+        if flim is not None:
+            flim.add(chunk.detectors, chunk.nanotimes)
+    if isinstance(flim, TiledFlimAccumulator):
+        try:
+            flim.close()
+        finally:
+            flim.store.close()
+    elif isinstance(flim, SparseFlimAccumulator):
+        flim_path = output.with_name(f'{path.stem}{FLIM_SUFFIX}.h5')
+        flim_path.unlink(missing_ok=True)
+        flim.save(flim_path)
+
+    partial_output = output.with_name(f'.{output.name}')
+    save_results(partial_output, histograms, flim, resolution, source=str(path))
+    os.replace(partial_output, output)
+    return dict(path=path, output=output, Nrecords=Nrecords, nbytes=nbytes, duration=time.perf_counter() - start)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog='th260-convert', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('folder', help='folder holding the captures, PTU and h5 photon files')
+    parser.add_argument('-o', '--output', help='output folder, default to the input folder')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--nbins', type=int, default=1024, help='number of nanotime bins')
+    parser.add_argument('--nx', type=int, default=0, help='FLIM pixels along x, no FLIM cube if 0')
+    parser.add_argument('--ny', type=int, default=0, help='FLIM pixels along y')
+    parser.add_argument('--marker', type=int, default=65, help='detector code of the pixel marker (65: Marker 1)')
+    parser.add_argument('--channel', type=int, default=0, help='channel of the FLIM cube')
+    parser.add_argument('--flim-store', choices=FLIM_STORES, default='h5', help='storage of the FLIM cubes')
+    parser.add_argument('--tile-x', type=int, default=16, help='number of lines of the FLIM tiles')
+    parser.add_argument('--flim-dtype', choices=('uint16', 'uint32'), default='uint32', help='FLIM counts dtype')
+    parser.add_argument('--overwrite', action='store_true', help='process the inputs already processed')
+    args = parser.parse_args(argv)
+
+    output_folder = Path(args.output) if args.output is not None else Path(args.folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+    inputs = find_inputs(args.folder)
+    todo = [path for path in inputs if args.overwrite or not output_path(path, output_folder).is_file()]
+    print(f'{len(inputs)} inputs, {len(inputs) - len(todo)} already processed')
+
+    start = time.perf_counter()
+    results, failed = [], []
+    with ProcessPoolExecutor(max(1, min(args.workers, len(todo)))) as executor:
+        futures = {executor.submit(convert_file, path, output_path(path, output_folder), args.nbins, args.nx,
+                                   args.ny, args.marker, args.channel, flim_store=args.flim_store,
+                                   tile_x=args.tile_x, flim_dtype=args.flim_dtype): path for path in todo}
+        for ind, future in enumerate(as_completed(futures)):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed.append(path)
+                print(f'[{ind + 1}/{len(todo)}] {path.name}: failed ({e})')
+                continue
+            results.append(result)
+            print(f"[{ind + 1}/{len(todo)}] {path.name}: {result['Nrecords']} records in {result['duration']:.2f} s")
+
+    duration = time.perf_counter() - start
+    Nrecords = sum([result['Nrecords'] for result in results])
+    nbytes = sum([result['nbytes'] for result in results])
+    print(f'{len(results)} processed, {len(inputs) - len(todo)} skipped, {len(failed)} failed in {duration:.2f} s: '
+          f'{Nrecords / max(duration, 1e-9) / 1e6:.2f} Mrecords/s, {nbytes / max(duration, 1e-9) / 1e6:.2f} MB/s')
+    return 1 if len(failed) != 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
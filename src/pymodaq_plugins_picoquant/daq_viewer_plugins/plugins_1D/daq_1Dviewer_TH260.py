@@ -10,35 +10,57 @@ import numpy as np
 from typing import List
 from pathlib import Path
 import tempfile
+import shutil
 
 from pymodaq.control_modules.viewer_utility_classes import DAQ_Viewer_base, main
 from easydict import EasyDict as edict
 from collections import OrderedDict
 
 from pymodaq_utils.utils import ThreadCommand, getLineInfo, zeros_aligned, get_new_file_name
-from pymodaq.utils.data import DataFromPlugins, Axis, DataToExport, DataRaw, DataCalculated
+from pymodaq.utils.data import DataFromPlugins, Axis, DataToExport, DataRaw, DataCalculated, DataWithAxes
 
 from pymodaq_gui.h5modules.saving import H5Saver
 
 from pymodaq_gui.parameter import utils as putils
-from pymodaq_data.h5modules.data_saving import DataToExportEnlargeableSaver
+from pymodaq_data.h5modules.data_saving import DataToExportEnlargeableSaver, DataLoader
 from enum import IntEnum
 import ctypes
 from pymodaq.control_modules.viewer_utility_classes import comon_parameters
-from pymodaq_plugins_picoquant.hardware.picoquant import timeharp260
+try:
+    from pymodaq_plugins_picoquant.hardware.picoquant import timeharp260
+except (ImportError, OSError):  # the TH260 library is only available on windows, the replay backend can still be used
+    timeharp260 = None
+from pymodaq_plugins_picoquant.hardware.picoquant.replay import FifoRecorder, Th260Replay
+from pymodaq_plugins_picoquant.hardware.picoquant.capabilities import CapabilityCache, binning_code, NBINS
+from pymodaq_plugins_picoquant.hardware.picoquant.engine import FifoReader, TH260Engine
 from pymodaq_utils.config import get_set_local_dir
 
 local_path = get_set_local_dir()
 import tables
-from phconvert import pqreader
 
 import time
 import datetime
 from fast_histogram import histogram1d
 from pymodaq_plugins_picoquant.utils import Config
+from pymodaq_plugins_picoquant.processing.metrics import AcquisitionMetrics
+from pymodaq_plugins_picoquant.processing.profiling import StageProfiler, PROFILERS
+from pymodaq_plugins_picoquant.processing.filters import PhotonFilter, parse_gates
+from pymodaq_plugins_picoquant.processing.trace import IntensityTrace
+from pymodaq_plugins_picoquant.processing.bursts import BurstSearch, BURST_DTYPE
+from pymodaq_plugins_picoquant.processing.corrections import correct_pileup, pileup_ratio, PILEUP_METHODS
+from pymodaq_plugins_picoquant.processing.photons import T3PhotonFile, STEP_FIELDS, MAX_POSITIONS
+from pymodaq_plugins_picoquant.processing.rebinning import Rebinner
+from pymodaq_plugins_picoquant.processing.sharing import SharedPublisher, PHOTON_DTYPE
+from pymodaq_plugins_picoquant.processing.chunks import T3Decoder, T3_WRAPAROUND
+from pymodaq_plugins_picoquant.processing.streaming import StreamServer
+from pymodaq_plugins_picoquant.processing.arrow import ParquetPhotonWriter
 
 plugin_config = Config()
 
+SERIES_CONTROLS = ['Software', 'C1 gated', 'C1 start, CTC stop']  # index is the TH260_SetMeasControl code
+EDGES = ['Falling', 'Rising']  # index is the edge code
+MAX_ACQ_TIME = 360000000  # in ms, maximum acquisition time of TH260_StartMeas
+
 
 class DAQ_1DViewer_TH260(DAQ_Viewer_base):
     """
@@ -56,6 +78,17 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
 
     params = comon_parameters+[
             {'title': 'Device index:', 'name': 'device', 'type': 'int', 'value': 0, 'max': 3, 'min': 0},
+            {'title': 'Record/Replay:', 'name': 'replay', 'type': 'group', 'expanded': False, 'children': [
+                {'title': 'Backend:', 'name': 'backend', 'type': 'list', 'value': 'Hardware',
+                 'limits': ['Hardware', 'Replay']},
+                {'title': 'Replay capture:', 'name': 'replay_path', 'type': 'browsepath', 'value': '',
+                 'filetype': False},
+                {'title': 'Replay speed:', 'name': 'replay_speed', 'type': 'float', 'value': 1., 'min': 0.,
+                 'tip': 'Speed factor with respect to the recorded timing, 0 to replay as fast as possible'},
+                {'title': 'Record FIFO?:', 'name': 'record_fifo', 'type': 'bool', 'value': False},
+                {'title': 'Captures folder:', 'name': 'captures_folder', 'type': 'browsepath', 'filetype': False,
+                 'value': str(local_path.joinpath('picoquant_captures'))},
+            ]},
             {'title': 'Get Warnings?:', 'name': 'getwarnings', 'type': 'bool', 'value': False},
             {'title': 'Infos:', 'name': 'infos', 'type': 'str', 'value': "", 'readonly': True},
             {'title': 'Line Settings:', 'name': 'line_settings', 'type': 'group', 'expanded': False, 'children': [
@@ -75,11 +108,19 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
              ]},
             {'title': 'Acquisition:', 'name': 'acquisition', 'type': 'group', 'expanded': True, 'children': [
                  {'title': 'Acq. type:', 'name': 'acq_type', 'type': 'list',
-                                'value': 'Histo', 'limits': ['Counting', 'Histo', 'T3']},
+                                'value': 'Histo', 'limits': ['Counting', 'Histo', 'Series', 'T3']},
                  {'title': 'Acq. time (s):', 'name': 'acq_time', 'type': 'float', 'value': 1, 'min': 0.1,
                                     'max': 360000},
                  {'title': 'Elapsed time (s):', 'name': 'elapsed_time', 'type': 'float', 'value': 0, 'min': 0,
                                     'readonly': True},
+                 {'title': 'Live update (ms):', 'name': 'live_period', 'type': 'int', 'value': 500, 'min': 10,
+                  'tip': 'Period of the display updates while a histogram is acquired'},
+                 {'title': 'Back to back?:', 'name': 'back_to_back', 'type': 'bool', 'value': False,
+                  'tip': 'Histo mode: start the next measurement as soon as the current one is read out. The next '
+                         'histogram then also integrates while the scan moves to its next position'},
+                 {'title': 'Continuous?:', 'name': 'continuous', 'type': 'bool', 'value': False,
+                  'tip': 'Histo mode: the measurement is never stopped, each histogram is the difference of two '
+                         'consecutive readings. In live mode no count is lost between two histograms'},
 
                  {'title': 'Timings:', 'name': 'timings', 'type': 'group', 'expanded': True, 'children': [
                      {'title': 'Mode:', 'name': 'timing_mode', 'type': 'list', 'value': 'Hires',
@@ -90,13 +131,89 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
                      {'title': 'Time window (s):', 'name': 'window', 'type': 'float', 'value': 100, 'min': 0,
                                     'readonly': True, 'enabled': False, 'siPrefix': True},
                      {'title': 'Nbins:', 'name': 'nbins', 'type': 'list', 'value': 1024,
-                                'limits': [1024*(2**lencode) for lencode in range(6)]},
+                                'limits': NBINS},
                      {'title': 'Offset (ns):', 'name': 'offset', 'type': 'int', 'value': 0, 'max': 100000000, 'min': 0},
                  ]},
                 {'title': 'FLIM histograms:', 'name': 'flim_histo', 'type': 'group', 'expanded': True, 'children': [
                     {'title': 'FLIM Nbins:', 'name': 'nbins_flim', 'type': 'list', 'value': 512,
                      'limits': [256 * (2 ** lencode) for lencode in range(6)]},
                     {'title': 'FLIM Time Window (ns):', 'name': 'time_window_flim', 'type': 'float', 'value': 200,}
+                ]},
+                {'title': 'Pile-up correction:', 'name': 'pileup', 'type': 'group', 'expanded': False, 'children': [
+                    {'title': 'Enabled?:', 'name': 'pileup_enabled', 'type': 'bool', 'value': False},
+                    {'title': 'Method:', 'name': 'pileup_method', 'type': 'list', 'value': 'Dead-time',
+                     'limits': PILEUP_METHODS,
+                     'tip': 'Coates: one photon per sync period, Dead-time: uses the deadtime of each channel'},
+                    {'title': 'Photons/sync (%):', 'name': 'pileup_ratio', 'type': 'float', 'value': 0.,
+                     'readonly': True},
+                ]},
+                {'title': 'Rebinning:', 'name': 'rebinning', 'type': 'group', 'expanded': False, 'children': [
+                    {'title': 'Enabled?:', 'name': 'rebin_enabled', 'type': 'bool', 'value': False},
+                    {'title': 'ROI start (ns):', 'name': 'roi_start', 'type': 'float', 'value': 0., 'min': 0.},
+                    {'title': 'ROI stop (ns):', 'name': 'roi_stop', 'type': 'float', 'value': 0., 'min': 0.,
+                     'tip': '0 for the end of the histograms'},
+                    {'title': 'Factor:', 'name': 'factor', 'type': 'list', 'value': 1,
+                     'limits': [2 ** ind for ind in range(8)]},
+                    {'title': 'Log. bins:', 'name': 'log_bins', 'type': 'int', 'value': 0, 'min': 0,
+                     'tip': 'Number of logarithmic bins (counts per original bin), 0 for linear bins'},
+                    {'title': 'Rebin saved data?:', 'name': 'rebin_storage', 'type': 'bool', 'value': False,
+                     'tip': 'If False the full resolution histograms are saved and only the display is rebinned'},
+                ]},
+                {'title': 'Histogram series:', 'name': 'series', 'type': 'group', 'expanded': False, 'children': [
+                    {'title': 'Nframes:', 'name': 'Nframes', 'type': 'int', 'value': 100, 'min': 1},
+                    {'title': 'Frame time (ms):', 'name': 'frame_time', 'type': 'int', 'value': 100, 'min': 1,
+                     'max': 360000000, 'tip': 'Acquisition time of each frame (maximum duration if C1 gated)'},
+                    {'title': 'Control:', 'name': 'meas_control', 'type': 'list', 'value': 'Software',
+                     'limits': SERIES_CONTROLS,
+                     'tip': 'Software: frames one after the other, C1 gated: each frame is acquired while the C1 '
+                            'input is active, C1 start, CTC stop: each frame starts on a C1 edge'},
+                    {'title': 'Start edge:', 'name': 'start_edge', 'type': 'list', 'value': 'Rising',
+                     'limits': EDGES},
+                    {'title': 'Stop edge:', 'name': 'stop_edge', 'type': 'list', 'value': 'Falling',
+                     'limits': EDGES},
+                    {'title': 'Frames done:', 'name': 'frames_done', 'type': 'int', 'value': 0, 'readonly': True},
+                ]},
+                {'title': 'Photon filter:', 'name': 'photon_filter', 'type': 'group', 'expanded': False, 'children': [
+                    {'title': 'Enabled?:', 'name': 'filter_enabled', 'type': 'bool', 'value': False},
+                    {'title': 'Keep CH1?:', 'name': 'keep_ch1', 'type': 'bool', 'value': True},
+                    {'title': 'Keep CH2?:', 'name': 'keep_ch2', 'type': 'bool', 'value': True},
+                    {'title': 'Gates (ns):', 'name': 'gates', 'type': 'str', 'value': '',
+                     'tip': 'nanotime windows such as 0-10, 20-30. Leave empty to keep all nanotimes'},
+                    {'title': 'Pass markers?:', 'name': 'pass_markers', 'type': 'bool', 'value': True},
+                    {'title': 'Drop overflows?:', 'name': 'drop_overflows', 'type': 'bool', 'value': True},
+                    {'title': 'Kept records (%):', 'name': 'kept_ratio', 'type': 'float', 'value': 100.,
+                     'readonly': True},
+                ]},
+                {'title': 'Intensity trace:', 'name': 'trace', 'type': 'group', 'expanded': False, 'children': [
+                    {'title': 'Enabled?:', 'name': 'trace_enabled', 'type': 'bool', 'value': False},
+                    {'title': 'Bin width (ms):', 'name': 'trace_bin', 'type': 'float', 'value': 1., 'min': 0.001},
+                    {'title': 'Display length:', 'name': 'trace_length', 'type': 'int', 'value': 2000, 'min': 10},
+                    {'title': 'Save trace?:', 'name': 'save_trace', 'type': 'bool', 'value': True},
+                ]},
+                {'title': 'Burst search:', 'name': 'bursts', 'type': 'group', 'expanded': False, 'children': [
+                    {'title': 'Enabled?:', 'name': 'burst_enabled', 'type': 'bool', 'value': False},
+                    {'title': 'Window (photons):', 'name': 'burst_m', 'type': 'int', 'value': 10, 'min': 2},
+                    {'title': 'Rate threshold (kcts/s):', 'name': 'burst_rate', 'type': 'float', 'value': 50.,
+                     'min': 0.001},
+                    {'title': 'Min. size (photons):', 'name': 'burst_min_size', 'type': 'int', 'value': 30, 'min': 2},
+                    {'title': 'Donor channel:', 'name': 'donor_channel', 'type': 'list', 'value': 'CH1',
+                     'limits': ['CH1', 'CH2']},
+                    {'title': 'PIE split (ns):', 'name': 'pie_split', 'type': 'float', 'value': 0., 'min': 0.,
+                     'tip': 'Photons detected after this nanotime are from the acceptor excitation, 0 if no PIE'},
+                    {'title': 'Save photons?:', 'name': 'save_photons', 'type': 'bool', 'value': True,
+                     'tip': 'If False, only the burst table is saved'},
+                    {'title': 'Nbursts:', 'name': 'Nbursts', 'type': 'int', 'value': 0, 'readonly': True},
+                ]},
+                {'title': 'T3 export:', 'name': 't3_export', 'type': 'group', 'expanded': False, 'children': [
+                    {'title': 'Photons folder:', 'name': 'photons_folder', 'type': 'browsepath', 'filetype': False,
+                     'value': str(local_path.joinpath('picoquant_photons'))},
+                    {'title': 'Keep session?:', 'name': 'persistent_session', 'type': 'bool', 'value': False,
+                     'tip': 'Save the photons of consecutive acquisitions (such as the steps of a scan) in a single '
+                            'file, closed when stopping or changing the acquisition settings'},
+                    {'title': 'Parquet export?:', 'name': 'parquet_export', 'type': 'bool', 'value': False,
+                     'tip': 'Also save the photons as a Parquet file (one row group per FIFO chunk) next to the h5 '
+                            'file, needs pyarrow'},
+                    {'title': 'Last file:', 'name': 'photons_file', 'type': 'str', 'value': '', 'readonly': True},
                 ]},
                  {'title': 'Rates:', 'name': 'rates', 'type': 'group', 'expanded': True, 'children': [
                      {'title': 'Show large display?', 'name': 'large_display', 'type': 'bool', 'value': True},
@@ -106,11 +223,59 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
                      {'title': 'Nrecords:', 'name': 'records', 'type': 'int', 'value': 0, 'min': 0, 'readonly': True,  'siPrefix': True},
                  ]},
              ]},
+            {'title': 'Metrics:', 'name': 'metrics', 'type': 'group', 'expanded': False, 'children': [
+                {'title': 'GIL probe?:', 'name': 'gil_probe', 'type': 'bool', 'value': False},
+                {'title': 'Dump format:', 'name': 'dump_format', 'type': 'list', 'value': 'None',
+                 'limits': ['None', 'JSON', 'Prometheus']},
+                {'title': 'Dump folder:', 'name': 'dump_folder', 'type': 'browsepath', 'value': '', 'filetype': False},
+                {'title': 'Records/s:', 'name': 'records_rate', 'type': 'float', 'value': 0, 'readonly': True,
+                 'siPrefix': True},
+                {'title': 'Bytes written:', 'name': 'bytes_written', 'type': 'int', 'value': 0, 'readonly': True,
+                 'siPrefix': True},
+                {'title': 'Mean FIFO read:', 'name': 'fifo_read_size', 'type': 'float', 'value': 0, 'readonly': True},
+                {'title': 'Queue depth:', 'name': 'queue_depth', 'type': 'int', 'value': 0, 'readonly': True},
+                {'title': 'Dropped chunks:', 'name': 'dropped_chunks', 'type': 'int', 'value': 0, 'readonly': True},
+                {'title': 'FIFO read (ms):', 'name': 'fifo_read', 'type': 'str', 'value': '', 'readonly': True},
+                {'title': 'Decode (ms):', 'name': 'decode', 'type': 'str', 'value': '', 'readonly': True},
+                {'title': 'Write (ms):', 'name': 'write', 'type': 'str', 'value': '', 'readonly': True},
+                {'title': 'Histogram (ms):', 'name': 'histogram', 'type': 'str', 'value': '', 'readonly': True},
+                {'title': 'GIL wait (ms):', 'name': 'gil_wait', 'type': 'str', 'value': '', 'readonly': True},
+            ]},
+            {'title': 'Profiling:', 'name': 'profiling', 'type': 'group', 'expanded': False, 'children': [
+                {'title': 'Enabled?:', 'name': 'profiling_enabled', 'type': 'bool',
+                 'value': plugin_config('profiling', 'enabled')},
+                {'title': 'Profiler:', 'name': 'profiler', 'type': 'list',
+                 'value': plugin_config('profiling', 'profiler'), 'limits': PROFILERS},
+                {'title': 'Profiles folder:', 'name': 'profiles_folder', 'type': 'browsepath', 'filetype': False,
+                 'value': plugin_config('profiling', 'folder') if plugin_config('profiling', 'folder') != '' else
+                 str(local_path.joinpath('picoquant_profiles'))},
+            ]},
+            {'title': 'Shared memory:', 'name': 'sharing', 'type': 'group', 'expanded': False, 'children': [
+                {'title': 'Publish?:', 'name': 'sharing_enabled', 'type': 'bool', 'value': False,
+                 'tip': 'Publish the live histograms and the decoded photon chunks in shared memory segments, '
+                        'only the last chunk is kept: the sequence number tells the consumers if some were missed'},
+                {'title': 'Prefix:', 'name': 'shm_prefix', 'type': 'str', 'value': 'th260_',
+                 'tip': 'The segments are named prefix + device index + _histograms, _t3_histograms or _photons'},
+                {'title': 'Segments:', 'name': 'segments', 'type': 'str', 'value': '', 'readonly': True},
+            ]},
+            {'title': 'Streaming:', 'name': 'streaming', 'type': 'group', 'expanded': False, 'children': [
+                {'title': 'Stream?:', 'name': 'streaming_enabled', 'type': 'bool', 'value': False,
+                 'tip': 'Stream the live histograms and the decoded photon chunks to TCP clients'},
+                {'title': 'Host:', 'name': 'stream_host', 'type': 'str', 'value': '127.0.0.1',
+                 'tip': '127.0.0.1 for local clients only, 0.0.0.0 for any network interface'},
+                {'title': 'Port:', 'name': 'stream_port', 'type': 'int', 'value': 5560, 'min': 0, 'max': 65535},
+                {'title': 'Queue length:', 'name': 'stream_queue', 'type': 'int', 'value': 16, 'min': 1,
+                 'tip': 'Maximum number of frames waiting for a client, the oldest ones are dropped'},
+                {'title': 'Clients:', 'name': 'stream_clients', 'type': 'int', 'value': 0, 'readonly': True},
+                {'title': 'Dropped frames:', 'name': 'stream_dropped', 'type': 'int', 'value': 0, 'readonly': True},
+            ]},
 
             ]
 
     hardware_averaging = False
     stop_tttr = Signal()
+    start_tttr = Signal(int)  # acquisition time in ms
+    final_poll_interval = 2  # in ms, polling period of the completion once the acquisition time is elapsed
 
     def ini_attributes(self):
 
@@ -118,9 +283,12 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
 
         self.device = None
         self.x_axis = None
+        self._x_axis_key = None  # (resolution, Nbins) of the current x_axis
         self.controller = None
+        self.engine: TH260Engine = None  # configures and starts/stops the measurements of the controller
+        self.capability_cache: CapabilityCache = None
+        self.capabilities: dict = None
         self.data: List[np.ndarray] = None #list of numpy arrays, see set_acq_mode
-        self.data_pointers = None #list of ctypes pointers pointing to self.data array elements, see set_acq_mode
         self.acq_done = False
         self.Nchannels = 0
         self.channels_enabled = {'CH1': {'enabled': True, 'index': 0}, 'CH2': {'enabled': False, 'index': 1}}
@@ -129,12 +297,53 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
         self.detector_thread = None
         self.time_t3 = 0
         self.time_t3_rate = 0
+        self.t3_elapsed_time = 0.  # in s, last elapsed time of the T3 measurement read from the device
+        self.time_live = 0
+        self.time_acq_ms = 0  # acquisition time of the running histogram
+        self.prestarted_time_acq: int = None  # acquisition time of a histogram started back to back, None if none
+        self.continuous_running = False  # a continuous measurement is running, see start_continuous
+        self.snapshots: List[np.ndarray] = None  # two alternating readings of the running histograms
+        self.ind_snapshot = 0  # index of the snapshot of the last interval end
+        self.snapshot_elapsed = 0.  # measurement time (ms) of this snapshot
+        self.interval: np.ndarray = None  # histograms of the current interval
+        self.interval_time = 0.  # duration (s) of the current interval
         self.ind_reading = 0
         self.ind_offset = 0
 
         self.h5temp: H5Saver = None
         self.temp_path: Path = None
         self.saver: DataToExportEnlargeableSaver = None
+        self.trace_saver: DataToExportEnlargeableSaver = None
+        self._loader: DataLoader = None
+        self.decoder = T3Decoder(T3Reader.buffer_size)  # carries the overflow correction between FIFO chunks
+        self.sync_period = 1.  # in s
+        self.metrics = AcquisitionMetrics()
+        self.profiler = StageProfiler()
+        self.fifo_recorder: FifoRecorder = None
+        self.photon_filter: PhotonFilter = None
+        self.intensity_trace: IntensityTrace = None
+        self.burst_search: BurstSearch = None
+        self.burst_saver: DataToExportEnlargeableSaver = None
+        self.save_photons = True
+        self.t3_histograms: np.ndarray = None  # nanotime histograms accumulated chunk after chunk
+        self.photons: T3PhotonFile = None  # photons of the last T3 acquisition
+        self.t3_reader: T3Reader = None  # kept with its thread from one acquisition to the next
+        self.t3_thread: QThread = None
+        self.t3_session = False  # the photons file is kept open for the next acquisitions, see end_t3_session
+        self.session_path: Path = None  # final path of the photons file of the session
+        self.step_saver: DataToExportEnlargeableSaver = None
+        self.step_index = 0  # index of the acquisition within the photons file
+        self.step_first_photon = 0  # index of the first photon of the current acquisition
+        self.step_start_macrotime = 0
+        self.step_stop_macrotime = 0  # macrotime of the last saved photon
+        self.step_positions = np.full((MAX_POSITIONS,), np.nan)  # scan coordinates of the current acquisition
+        self.Nphotons_saved = 0
+        self.series: np.ndarray = None  # histograms of the series, shape (Nframes, Nchannels, Nbins)
+        self.series_reader: SeriesReader = None
+        self.series_saver: DataToExportEnlargeableSaver = None
+        self.publisher: SharedPublisher = None
+        self.parquet_writer: ParquetPhotonWriter = None
+        self.stream_server: StreamServer = None
 
     @classmethod
     def extract_TTTR_histo_every_pixels(cls, nanotimes, markers, marker=65, Nx=1, Ny=1, Ntime=512, time_window=None,
@@ -208,6 +417,20 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
 
         """
         try:
+            if self.t3_session and (
+                    param.name() in ('acq_type', 'persistent_session', 'photons_folder', 'parquet_export',
+                                     'trace_enabled',
+                                     'save_trace', 'burst_enabled') or
+                    param.name() in putils.iter_children(self.settings.child('line_settings'), []) or
+                    param.name() in putils.iter_children(self.settings.child('acquisition', 'timings'), [])):
+                self.end_t3_session()
+
+            if (self.prestarted_time_acq is not None or self.continuous_running) and (
+                    param.name() in ('acq_type', 'back_to_back', 'continuous') or
+                    param.name() in putils.iter_children(self.settings.child('line_settings'), []) or
+                    param.name() in putils.iter_children(self.settings.child('acquisition', 'timings'), [])):
+                self.stop_prestarted_histogram()
+
             if param.name() == 'acq_type':
                 self.set_acq_mode(param.value())
                 self.set_get_resolution(wintype='both')
@@ -233,6 +456,19 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
                 else:
                     self.general_timer.stop()
 
+            elif param.name() == 'gil_probe':
+                self.metrics.use_gil_probe = param.value()
+
+            elif param.name() == 'replay_speed' and isinstance(self.controller, Th260Replay):
+                self.controller.speed = param.value()
+
+            elif param.name() in putils.iter_children(self.settings.child('sharing'), []):
+                if param.name() != 'segments':
+                    self.set_publisher()
+
+            elif param.name() in ('streaming_enabled', 'stream_host', 'stream_port', 'stream_queue'):
+                self.set_stream_server()
+
         except Exception as e:
             self.emit_status(ThreadCommand('Update_Status', [getLineInfo() + str(e), 'log']))
 
@@ -244,19 +480,54 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
             if mode == 'Counting':
                 self.dte_signal.emit(DataToExport('rates', data=[self._format_rates()]))
             elif mode == 'Histo':
-                self.dte_signal.emit(DataToExport('Histogram', data=[self._format_histograms()]))
+                dwa = self._format_histograms()
+                if self.settings['acquisition', 'back_to_back'] or self.continuous_running:
+                    dwa = dwa.deepcopy()  # the histogram buffers will be filled by the next measurement
+                self.dte_signal.emit(DataToExport('Histogram', data=self.rebin_data(dwa, final=True)))
             elif mode == 'T3':
-                node = self._loader.get_node('/RawData/myphotons/DataND/CH00/EnlData00')
-                dwa: DataRaw = self._loader.load_data(node, load_all=True)
-                dwa.sort_data(0)
-                dwa.add_extra_attribute(save=True, plot=False)
-
-                dwa_tof = self.compute_histogram(dwa)
-                dwa_tof.add_extra_attribute(save=False, plot=True)
-
-                dte = DataToExport('T3Mode', data=[dwa, dwa_tof])
-
-                self.dte_signal_temp.emit(dte)
+                # photons are not loaded back: the summary histograms are already computed and the photons stay
+                # on disk, available through self.photons
+                dte = DataToExport('T3Mode')
+                if self.burst_search is not None:
+                    self.save_bursts(self.burst_search.flush())
+                    dte.append(self._format_bursts(save=True))
+                if self.intensity_trace is not None:
+                    self.save_trace(*self.intensity_trace.flush())
+                    dte.append(self._format_trace())
+                dwa_tofs = self.rebin_data(self.compute_histogram(self.t3_elapsed_time), final=True)
+
+                self.save_step()
+                if self.t3_session:
+                    self.h5temp.flush()
+                    path = self.session_path
+                else:
+                    self.photons = T3PhotonFile(self.finalize_h5file())
+                    path = self.photons.path
+                    self.emit_log(f'T3 photons saved in {path}')
+                for dwa_tof in dwa_tofs:
+                    dwa_tof.add_extra_attribute(photons_file=str(path), photons_step=self.step_index)
+                dte.append(dwa_tofs)
+                self.step_index += 1
+
+                self.dte_signal.emit(dte)
+            elif mode == 'Series':
+                if self.series_reader.Nframes > 0:
+                    self.dte_signal.emit(DataToExport('Series', data=[self._format_series()]))
+
+            if self.fifo_recorder is not None:
+                self.emit_log(f'FIFO stream recorded in {self.fifo_recorder.close()}')
+                self.fifo_recorder = None
+
+            if mode != 'Counting':
+                self.metrics.stop()
+                self.update_metrics()
+                self.dump_metrics()
+                if self.profiler.enabled:
+                    self.stop_profiling()
+
+            if mode == 'Histo' and self.settings['acquisition', 'back_to_back'] and not self.continuous_running:
+                self.prestarted_time_acq = int(self.settings['acquisition', 'acq_time'] * 1000)
+                self.start_histogram(self.prestarted_time_acq)
 
             self.settings.child('getwarnings').setOpts(enabled=True)
             if self.settings['getwarnings']:
@@ -275,19 +546,171 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
     def _format_histograms(self) -> DataFromPlugins:
         channels_index = [self.channels_enabled[k]['index'] for k in self.channels_enabled if
                           self.channels_enabled[k]['enabled']]
-        for ind, channel in enumerate(channels_index):
-            self.controller.TH260_GetHistogram(self.device, self.data_pointers[ind], channel=channel, clear=False)
-        records = np.sum(np.array([np.sum(data) for data in self.data]))
+        if self.continuous_running:  # already read, see read_snapshot
+            data = [histogram for histogram in self.interval]
+            acq_time = self.interval_time
+        else:
+            with self.metrics.time('histogram'):
+                self.engine.histogram(out=self.data, channels=channels_index)
+            data = self.data
+            acq_time = None
+        records = np.sum(np.array([np.sum(histogram) for histogram in data]))
         self.settings.child('acquisition', 'rates', 'records').setValue(records)
-        return DataFromPlugins(name='TH260', data=self.data, dim='Data1D',
+        self.publish('histograms', np.stack(data))
+        if self.settings['acquisition', 'pileup', 'pileup_enabled']:
+            self.get_rates()
+            if acq_time is None:
+                acq_time = self.controller.TH260_GetElapsedMeasTime(self.device) / 1000  # in s
+            data = [self.correct_histogram(data[ind], channel, acq_time)
+                    for ind, channel in enumerate(channels_index)]
+        return DataFromPlugins(name='TH260', data=data, dim='Data1D',
                                axes=[self.x_axis])
 
-    def compute_histogram(self, dwa: DataRaw) -> DataCalculated:
-        time_of_flight, time_array = np.histogram(dwa.axes[0].get_data(),
-                                                  bins=self.settings['acquisition', 'timings', 'nbins'],
-                                                  )
-        return DataCalculated('TOF', data=[time_of_flight],
-                              axes=[Axis('Time', 's', time_array[:-1])])
+    def get_rebinner(self) -> Rebinner:
+        """Build the rebinner from the Rebinning settings, None if disabled or if its region of interest is empty"""
+        if not self.settings['acquisition', 'rebinning', 'rebin_enabled']:
+            return None
+        resolution = self.settings['acquisition', 'timings', 'resolution']
+        stop = self.settings['acquisition', 'rebinning', 'roi_stop']
+        rebinner = Rebinner(start=int(self.settings['acquisition', 'rebinning', 'roi_start'] / resolution),
+                            stop=int(np.ceil(stop / resolution)) if stop > 0 else None,
+                            factor=self.settings['acquisition', 'rebinning', 'factor'],
+                            log_bins=self.settings['acquisition', 'rebinning', 'log_bins'])
+        if not rebinner.valid(self.settings['acquisition', 'timings', 'nbins']):
+            return None
+        return rebinner if rebinner.active else None
+
+    def rebin_data(self, dwa: DataWithAxes, final=False) -> List[DataWithAxes]:
+        """Rebin histograms for display and, if requested, for storage
+
+        Parameters
+        ----------
+        dwa: (DataWithAxes) the full resolution histograms
+        final: (bool) if True (final data of an acquisition), the full resolution histograms are also returned, to
+               be saved but not plotted (do_plot extra attribute), except if only the rebinned ones should be saved
+
+        Returns
+        -------
+        list of DataWithAxes
+        """
+        rebinner = self.get_rebinner()
+        if rebinner is None:
+            return [dwa]
+        data, axis = rebinner(np.stack(dwa.data), dwa.axes[0].get_data())
+        dwa_rebinned = DataCalculated(f'{dwa.name}_rebinned', data=[array for array in data], labels=dwa.labels,
+                                      axes=[Axis(dwa.axes[0].label, dwa.axes[0].units, axis)])
+        if not final:
+            return [dwa_rebinned]
+        if self.settings['acquisition', 'rebinning', 'rebin_storage']:
+            return [dwa_rebinned]
+        dwa.add_extra_attribute(do_plot=False)
+        return [dwa, dwa_rebinned]
+
+    def correct_histogram(self, histogram: np.ndarray, channel: int, acq_time: float) -> np.ndarray:
+        """Pile-up corrected histogram of a given channel, using the last sync rate fetched by get_rates
+
+        Parameters
+        ----------
+        histogram: (ndarray) the measured histogram
+        channel: (int) the channel index (0 for CH1)
+        acq_time: (float) the integration time of the histogram in s
+        """
+        sync_rate = self.settings['acquisition', 'rates', 'syncrate']
+        if sync_rate <= 0:
+            return histogram
+        deadtime = None
+        if self.settings['acquisition', 'pileup', 'pileup_method'] == 'Dead-time':
+            deadtime = self.settings['line_settings', f'ch{channel + 1}_settings', 'deadtime'] * 1e-9
+        return correct_pileup(histogram, sync_rate * acq_time,
+                              self.settings['acquisition', 'timings', 'resolution'] * 1e-9, 1 / sync_rate,
+                              deadtime)
+
+    def _format_trace(self) -> DataCalculated:
+        bin_indexes, counts = self.intensity_trace.trace()
+        labels = [f'CH{ind + 1}' for ind in range(self.intensity_trace.Nchannels)]
+        return DataCalculated('Trace', data=[counts[ind] for ind in range(counts.shape[0])], labels=labels,
+                              axes=[Axis('Time', 's', bin_indexes * self.intensity_trace.bin_width * self.sync_period)])
+
+    def save_trace(self, bin_indexes: np.ndarray, counts: np.ndarray):
+        """Append the completed bins of the intensity trace to the temporary h5 file"""
+        if self.trace_saver is None or bin_indexes.size == 0:
+            return
+        times = bin_indexes * self.intensity_trace.bin_width * self.sync_period
+        data = DataToExport('trace', data=[
+            DataRaw('trace', data=[counts[ind] for ind in range(counts.shape[0])],
+                    labels=[f'CH{ind + 1}' for ind in range(counts.shape[0])],
+                    nav_indexes=(0, ),
+                    axes=[Axis('time', 's', data=times, index=0)])])
+        self.trace_saver.add_data('/RawData/mytrace', axis_value=times, data=data)
+
+    def save_bursts(self, bursts: np.ndarray):
+        """Append completed bursts to the burst table of the temporary h5 file"""
+        if bursts.size == 0:
+            return
+        start = bursts['start'] * self.sync_period
+        fields = BURST_DTYPE.names[1:]
+        data = DataToExport('bursts', data=[
+            DataRaw('bursts', data=[bursts[field].astype(np.float64) for field in fields],
+                    labels=list(fields),
+                    nav_indexes=(0, ),
+                    axes=[Axis('start', 's', data=start, index=0)])])
+        self.burst_saver.add_data('/RawData/mybursts', axis_value=start, data=data)
+        self.settings.child('acquisition', 'bursts', 'Nbursts').setValue(self.burst_search.Nbursts)
+
+    def _format_bursts(self, save=False) -> List[DataWithAxes]:
+        """The burst table (if save is True) and the histograms of the FRET efficiency and stoichiometry"""
+        if self.burst_search.Nbursts == 0:
+            return []
+        node = self._loader.get_node('/RawData/mybursts/DataND/CH00/EnlData00')
+        dwa: DataRaw = self._loader.load_data(node, load_all=True)
+        if dwa.size > self.burst_search.Nbursts:  # bursts of the previous acquisitions of the session
+            dwa = dwa.inav[dwa.size - self.burst_search.Nbursts:]
+        labels = dwa.labels
+        bins = np.linspace(0, 1, 51)
+        histograms = [np.histogram(dwa.data[labels.index(name)], bins=bins)[0] for name in ('E', 'S')]
+        dwa_fret = DataCalculated('FRET', data=histograms, labels=['E', 'S'],
+                                  axes=[Axis('E, S', '', (bins[:-1] + bins[1:]) / 2)])
+        if not save:
+            return [dwa_fret]
+        dwa.add_extra_attribute(do_plot=False)  # saved but not plotted
+        return [dwa, dwa_fret]
+
+    def compute_histogram(self, acq_time: float) -> DataCalculated:
+        """Nanotime histogram of each enabled channel from the histograms accumulated during the acquisition
+
+        Parameters
+        ----------
+        acq_time: (float) the elapsed time of the measurement in s, used by the pile-up correction
+        """
+        nbins = self.t3_histograms.shape[1]
+        self.publish('t3_histograms', self.t3_histograms)
+        channels = [self.channels_enabled[k]['index'] for k in self.channels_enabled if
+                    self.channels_enabled[k]['enabled']]
+        time_of_flight = []
+        for channel in channels:
+            histogram = self.t3_histograms[channel]
+            if self.settings['acquisition', 'pileup', 'pileup_enabled']:
+                histogram = self.correct_histogram(histogram, channel, acq_time)
+            time_of_flight.append(histogram)
+        return DataCalculated('TOF', data=time_of_flight, labels=[f'CH{channel + 1}' for channel in channels],
+                              axes=[Axis('Time', 's',
+                                         np.arange(nbins) * self.settings['acquisition', 'timings', 'resolution']
+                                         * 1e-9)])
+
+    def _format_frame(self, frame: int) -> DataFromPlugins:
+        """Histograms of a single frame of the series"""
+        return DataFromPlugins(name='TH260', data=[histogram for histogram in self.series[frame]], dim='Data1D',
+                               labels=self.series_reader.labels, axes=[self.x_axis])
+
+    def _format_series(self) -> DataFromPlugins:
+        """Completed frames of the series, as a 2D array (frames, time) per channel"""
+        Nframes = self.series_reader.Nframes
+        dwa = DataFromPlugins(name='TH260_series', data=[self.series[:Nframes, ind]
+                                                         for ind in range(self.series.shape[1])],
+                              dim='Data2D', labels=self.series_reader.labels,
+                              axes=[Axis('Frame time', 's', self.series_reader.times[:Nframes], index=0),
+                                    Axis(self.x_axis.label, self.x_axis.units, self.x_axis.get_data(), index=1)])
+        return dwa
 
     def emit_data_tmp(self):
         """
@@ -297,16 +720,134 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
             if mode == 'Counting':
                 self.dte_signal_temp.emit(DataToExport('Rates', data=[self._format_rates()]))
             elif mode == 'Histo':
-                self.dte_signal_temp.emit(DataToExport('Histogram', data=[self._format_histograms()]))
+                self.dte_signal_temp.emit(DataToExport('Histogram', data=self.rebin_data(self._format_histograms())))
+            elif mode == 'Series':
+                if self.series_reader.Nframes > 0:
+                    self.dte_signal_temp.emit(DataToExport('Series', data=self.rebin_data(
+                        self._format_frame(self.series_reader.Nframes - 1))))
             elif mode == 'T3':
-                node = self._loader.get_node('/RawData/myphotons/DataND/CH00/EnlData00')
-                dwa = self._loader.load_data(node, load_all=True)
-                dwa_tof = self.compute_histogram(dwa)
-                self.dte_signal_temp.emit(DataToExport('T3Mode', data=[dwa_tof]))
+                dte = DataToExport('T3Mode', data=self.rebin_data(self.compute_histogram(self.t3_elapsed_time)))
+                if self.burst_search is not None:
+                    dte.append(self._format_bursts())
+                self.dte_signal_temp.emit(dte)
 
         except Exception as e:
             self.emit_status(ThreadCommand('Update_Status', [getLineInfo()+ str(e), 'log']))
 
+    def update_metrics(self):
+        """Display the current acquisition metrics within the Metrics settings group"""
+        metrics = self.metrics.to_dict()
+        counters = metrics['counters']
+        self.settings.child('metrics', 'records_rate').setValue(metrics['records_per_s'])
+        self.settings.child('metrics', 'bytes_written').setValue(counters.get('bytes_written', 0))
+        self.settings.child('metrics', 'fifo_read_size').setValue(metrics['fifo_read_sizes']['mean'])
+        self.settings.child('metrics', 'queue_depth').setValue(metrics['gauges'].get('queue_depth', 0))
+        self.settings.child('metrics', 'dropped_chunks').setValue(counters.get('dropped_chunks', 0))
+        if self.stream_server is not None:
+            self.settings.child('streaming', 'stream_clients').setValue(self.stream_server.Nclients)
+            self.settings.child('streaming', 'stream_dropped').setValue(self.stream_server.dropped)
+        for stage in ('fifo_read', 'decode', 'write', 'histogram', 'gil_wait'):
+            if stage in metrics['latencies']:
+                latency = metrics['latencies'][stage]
+                self.settings.child('metrics', stage).setValue(
+                    f"mean: {latency['mean'] * 1000:.3f}, p99: {latency['p99'] * 1000:.3f},"
+                    f" max: {latency['max'] * 1000:.3f}")
+
+    def dump_metrics(self):
+        """Dump the metrics of the last acquisition in the selected folder and format"""
+        dump_format = self.settings['metrics', 'dump_format']
+        if dump_format == 'None' or self.settings['metrics', 'dump_folder'] == '':
+            return
+        file_name = f"th260_metrics_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        path = Path(self.settings['metrics', 'dump_folder'])
+        if dump_format == 'JSON':
+            self.metrics.to_json(path.joinpath(f'{file_name}.json'),
+                                 mode=self.settings['acquisition', 'acq_type'],
+                                 resolution=self.settings['acquisition', 'timings', 'resolution'],
+                                 nbins=self.settings['acquisition', 'timings', 'nbins'])
+        else:
+            self.metrics.to_prometheus(path.joinpath(f'{file_name}.prom'))
+
+    def start_profiling(self):
+        """Start profiling the acquisition stages if enabled in the Profiling settings"""
+        if self.settings['profiling', 'profiling_enabled']:
+            self.profiler.profiler = self.settings['profiling', 'profiler']
+            self.profiler.start()
+
+    def stop_profiling(self):
+        """Save the profiles of the last acquisition tagged with the acquisition parameters"""
+        run_folder = self.profiler.stop(
+            self.settings['profiling', 'profiles_folder'],
+            mode=self.settings['acquisition', 'acq_type'],
+            resolution=f"{self.settings['acquisition', 'timings', 'resolution'] * 1000:.0f}ps",
+            nbins=self.settings['acquisition', 'timings', 'nbins'],
+            acq_time=self.settings['acquisition', 'acq_time'],
+            syncrate=self.settings['acquisition', 'rates', 'syncrate'],
+            ch1_rate=self.settings['acquisition', 'rates', 'ch1_rate'],
+            ch2_rate=self.settings['acquisition', 'rates', 'ch2_rate'],
+            records_per_s=self.metrics.to_dict()['records_per_s'])
+        self.emit_log(f'Profiles saved in {run_folder}')
+
+    def set_publisher(self):
+        """(Re)create the shared memory publisher from the Shared memory settings"""
+        if self.publisher is not None:
+            self.publisher.close()
+            self.publisher = None
+        self.settings.child('sharing', 'segments').setValue('')
+        if self.settings['sharing', 'sharing_enabled']:
+            histograms_size = self.Nchannels * NBINS[-1] * np.dtype(np.float64).itemsize
+            self.publisher = SharedPublisher(f"{self.settings['sharing', 'shm_prefix']}{self.device}",
+                                             capacities=dict(histograms=histograms_size,
+                                                             t3_histograms=histograms_size,
+                                                             photons=T3Reader.buffer_size * PHOTON_DTYPE.itemsize))
+            self.settings.child('sharing', 'segments').setValue(', '.join(
+                [self.publisher.segment_name(key) for key in self.publisher.capacities]))
+
+    def set_stream_server(self):
+        """(Re)start the streaming server from the Streaming settings"""
+        if self.stream_server is not None:
+            self.stream_server.close()
+            self.stream_server = None
+        if self.settings['streaming', 'streaming_enabled']:
+            self.stream_server = StreamServer(self.settings['streaming', 'stream_host'],
+                                              self.settings['streaming', 'stream_port'],
+                                              max_queue=self.settings['streaming', 'stream_queue'])
+            self.emit_log(f'Streaming on {self.stream_server.host}:{self.stream_server.port}')
+
+    def publish(self, key: str, array: np.ndarray):
+        """Publish array in the shared memory segment and to the stream clients corresponding to key, if enabled"""
+        if self.publisher is not None:
+            with self.metrics.time('publish'):
+                self.publisher.publish(key, array)
+        if self.stream_server is not None:
+            with self.metrics.time('stream'):
+                self.stream_server.publish(key, array)
+
+    def get_photon_filter(self) -> PhotonFilter:
+        """Build the photon filter from the Photon filter settings, None if disabled"""
+        if not self.settings['acquisition', 'photon_filter', 'filter_enabled']:
+            return None
+        channels = [ind for ind in range(2) if self.settings['acquisition', 'photon_filter', f'keep_ch{ind + 1}']]
+        return PhotonFilter.from_nanoseconds(
+            self.settings['acquisition', 'timings', 'resolution'], channels=channels,
+            gates=parse_gates(self.settings['acquisition', 'photon_filter', 'gates']),
+            pass_markers=self.settings['acquisition', 'photon_filter', 'pass_markers'],
+            drop_overflows=self.settings['acquisition', 'photon_filter', 'drop_overflows'])
+
+    def get_burst_search(self) -> BurstSearch:
+        """Build the burst search from the Burst search settings, None if disabled"""
+        if not self.settings['acquisition', 'bursts', 'burst_enabled']:
+            return None
+        donor = 0 if self.settings['acquisition', 'bursts', 'donor_channel'] == 'CH1' else 1
+        self.settings.child('acquisition', 'bursts', 'Nbursts').setValue(0)
+        return BurstSearch(m=self.settings['acquisition', 'bursts', 'burst_m'],
+                           rate_threshold=self.settings['acquisition', 'bursts', 'burst_rate'] * 1e3 *
+                           self.sync_period,
+                           min_size=self.settings['acquisition', 'bursts', 'burst_min_size'],
+                           sync_period=self.sync_period, donor_channel=donor, acceptor_channel=1 - donor,
+                           pie_split=int(self.settings['acquisition', 'bursts', 'pie_split'] /
+                                         self.settings['acquisition', 'timings', 'resolution']))
+
     def process_histo_from_h5(self, Nx=1, Ny=1, channel=0, marker=65):
         markers_array = self.h5temp.h5_file.get_node('/markers')
         nanotimes_array = self.h5temp.h5_file.get_node('/nanotimes')
@@ -344,21 +885,20 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
         if mode != self.actual_mode or update:
 
             if mode == 'Counting':
-                self.controller.TH260_Initialize(self.device, mode=0)  # histogram
+                self.engine.initialize('Histo')
                 data = [np.zeros((1,), dtype=np.uint32) for ind in range(N)]
                 self.dte_signal_temp.emit(DataToExport('Rates', data=[
                     DataFromPlugins(name='TH260', data=data, dim='Data0D', labels=labels)]))
 
-            elif mode == 'Histo':
-                self.controller.TH260_Initialize(self.device, mode=0)  # histogram
+            elif mode == 'Histo' or mode == 'Series':
+                self.engine.initialize('Histo')
                 self.data = [np.zeros((self.settings['acquisition', 'timings', 'nbins'],), dtype=np.uint32) for
                              _ in range(N)]
                 self.dte_signal_temp.emit(DataToExport('Histograms', data=[
                     DataFromPlugins(name='TH260', data=self.data, dim='Data1D',
                                     axes=[self.get_xaxis()], labels=labels)]))
-                self.data_pointers = [data.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32)) for data in self.data]
             elif mode == 'T3':
-                self.controller.TH260_Initialize(self.device, mode=3)  # T3 mode
+                self.engine.initialize('T3')
                 data = [np.zeros((self.settings['acquisition', 'timings', 'nbins'],), dtype=np.uint32)
                              for _ in range(N)]
                 self.dte_signal_temp.emit(DataToExport('Histograms', data=[
@@ -367,58 +907,27 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
             self.actual_mode = mode
 
     def ini_channels(self):
-        self.Nchannels = self.controller.TH260_GetNumOfInputChannels(self.device)
-
-        self.controller.TH260_SetSyncDiv(self.device,
-                                         self.settings['line_settings', 'sync_settings', 'divider'])
-
-        self.controller.TH260_SetSyncCFD(self.device,
-                                         self.settings['line_settings', 'sync_settings', 'level'],
-                                         self.settings['line_settings', 'sync_settings', 'zerox'])
-
-        self.controller.TH260_SetSyncChannelOffset(self.device, self.settings['line_settings', 'sync_settings',
-                                                                                    'offset'])
+        self.Nchannels = self.capabilities['Nchannels']
+        self.engine.Nchannels = self.Nchannels
+
+        self.engine.set_sync(divider=self.settings['line_settings', 'sync_settings', 'divider'],
+                             level=self.settings['line_settings', 'sync_settings', 'level'],
+                             zerox=self.settings['line_settings', 'sync_settings', 'zerox'],
+                             offset=self.settings['line_settings', 'sync_settings', 'offset'])
+
+        for channel in range(self.Nchannels):
+            settings = self.settings.child('line_settings', f'ch{channel + 1}_settings')
+            param = settings.child('deadtime')
+            self.engine.set_input(channel, level=settings['level'], zerox=settings['zerox'],
+                                  offset=settings['offset'], deadtime=param.opts['limits'].index(param.value()),
+                                  enabled=settings['enabled'])
+            self.channels_enabled[f'CH{channel + 1}']['enabled'] = settings['enabled']
 
         if self.Nchannels == 1:
             self.settings.child('line_settings', 'ch2_settings').hide()
-
-            self.controller.TH260_SetInputCFD(self.device, 0,
-                                              self.settings['line_settings', 'ch1_settings', 'level'],
-                                              self.settings['line_settings', 'ch1_settings', 'zerox'])
-            self.controller.TH260_SetInputChannelOffset(self.device, 0,
-                                                        self.settings['line_settings', 'ch1_settings',
-                                                                            'offset'])
-            param = self.settings.child('line_settings', 'ch1_settings', 'deadtime')
-            code = param.opts['limits'].index(param.value())
-            self.controller.TH260_SetInputDeadTime(self.device, 0, code)
-
-
-            self.controller.TH260_SetInputChannelEnable(self.device, channel=0,
-                                                        enable=self.settings['line_settings', 'ch1_settings',
-                                                                                   'enabled'])
             self.channels_enabled['CH2']['enabled'] = False
-            self.channels_enabled['CH1']['enabled'] = self.settings['line_settings', 'ch1_settings',
-                                                                          'enabled']
-
-
-        if self.Nchannels == 2:
-            self.controller.TH260_SetInputCFD(self.device, 1,
-                                          self.settings['line_settings', 'ch2_settings', 'level'],
-                                          self.settings['line_settings', 'ch2_settings', 'zerox'])
-
-            self.controller.TH260_SetInputChannelOffset(self.device, 1,
-                                                        self.settings['line_settings', 'ch2_settings',
-                                                                            'offset'])
-            param = self.settings.child('line_settings', 'ch2_settings', 'deadtime')
-            code = param.opts['limits'].index(param.value())
-            self.controller.TH260_SetInputDeadTime(self.device, 1, code)
-
+        else:
             self.settings.child('line_settings', 'ch2_settings').show()
-            self.channels_enabled['CH2']['enabled'] = self.settings['line_settings', 'ch2_settings',
-                                                                          'enabled']
-            self.controller.TH260_SetInputChannelEnable(self.device, channel=1,
-                                                        enable=self.settings['line_settings', 'ch2_settings',
-                                                                                   'enabled'])
 
     def ini_detector(self, controller=None):
         """
@@ -428,32 +937,49 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
         """
         self.device = self.settings['device']
         self.settings.child('device').setOpts(readonly=True)
+        self.settings.child('replay', 'backend').setOpts(readonly=True)
 
+        if self.settings['replay', 'backend'] == 'Replay':
+            new_controller = Th260Replay(self.settings['replay', 'replay_path'],
+                                         speed=self.settings['replay', 'replay_speed'])
+        elif timeharp260 is None:
+            raise OSError('The TH260 library is not available on this computer, only the Replay backend can be used')
+        else:
+            new_controller = timeharp260.Th260()
         self.controller = self.ini_detector_init(old_controller=controller,
-                                                 new_controller=timeharp260.Th260())
+                                                 new_controller=new_controller)
+        self.engine = TH260Engine(self.controller, self.device, metrics=self.metrics)
 
         if self.settings['controller_status'] == "Master":
             # open device and initialize it
-            self.controller.TH260_OpenDevice(self.device)
+            self.engine.open()
+
+        if isinstance(self.controller, Th260Replay):  # do not mix replayed devices with the real ones
+            self.capability_cache = CapabilityCache(self.controller.path.joinpath('capabilities.json'))
+        else:
+            self.capability_cache = CapabilityCache()
+        self.capabilities = self.capability_cache.get(self.controller, self.device)
 
         #set timer to update info from controller
         self.general_timer = QTimer()
         self.general_timer.setInterval(500)
         self.general_timer.timeout.connect(self.update_timer)
 
-        #set timer to check acquisition state
+        #set timer to check acquisition state, its next wake up is computed from the remaining acquisition time
         self.acq_timer = QTimer()
-        self.acq_timer.setInterval(500)
+        self.acq_timer.setSingleShot(True)
         self.acq_timer.timeout.connect(self.check_acquisition)
 
         #init the device and memory in the selected mode
         self.set_acq_mode(self.settings['acquisition', 'acq_type'], update=True)
 
-        model, partn, version = self.controller.TH260_GetHardwareInfo(self.device)
-        serial = self.controller.TH260_GetSerialNumber(self.device)
+        model, partn, version = self.capabilities['hardware_info']
+        serial = self.capabilities['serial']
         self.settings.child('infos').setValue('serial: {}, model: {}, pn: {}, version: {}'.format(serial, model, partn, version))
 
         self.ini_channels()
+        self.set_publisher()
+        self.set_stream_server()
 
         self.set_get_resolution(wintype='both')
 
@@ -480,17 +1006,95 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
         self.settings.child('acquisition', 'elapsed_time').setValue(elapsed_time/1000)  # in s
 
     def check_acquisition(self):
-        if not self.controller.TH260_CTCStatus(self.device):
+        if self.continuous_running:
+            self.check_continuous()
+            return
+        with self.profiler.stage('check_acquisition'):
+            running = self.engine.running
+        if running:
             elapsed_time = self.controller.TH260_GetElapsedMeasTime(self.device)  # in ms
             self.set_elapsed_time(elapsed_time)
-            self.emit_data_tmp()
+            if (time.perf_counter() - self.time_live) * 1000 >= self.settings['acquisition', 'live_period']:
+                with self.profiler.stage('emit_data_tmp'):
+                    self.emit_data_tmp()
+                self.update_metrics()
+                self.time_live = time.perf_counter()
+            self.acq_timer.start(self.next_check_interval(elapsed_time))
         else:
             self.acq_timer.stop()
             QtWidgets.QApplication.processEvents()  # this to be sure the timer is not fired while emitting data
-            self.controller.TH260_StopMeas(self.device)
+            self.engine.stop()
             QtWidgets.QApplication.processEvents()  #this to be sure the timer is not fired while emitting data
             self.emit_data()
 
+    def next_check_interval(self, elapsed_time: float) -> int:
+        """Time (ms) before the next check of the acquisition: the next live update or the expected end of the
+        acquisition, then short polls until the device reports its completion"""
+        remaining = self.time_acq_ms - elapsed_time
+        return int(max(self.final_poll_interval, min(self.settings['acquisition', 'live_period'], remaining)))
+
+    def check_continuous(self):
+        """Continuous Histo mode: emit the histograms of the interval once its end is reached, the measurement
+        keeps running"""
+        elapsed_time = self.controller.TH260_GetElapsedMeasTime(self.device)  # in ms
+        self.set_elapsed_time(elapsed_time - self.snapshot_elapsed)
+        if elapsed_time >= self.time_acq_ms:
+            self.read_snapshot(advance=True)
+            self.emit_data()
+        else:
+            if (time.perf_counter() - self.time_live) * 1000 >= self.settings['acquisition', 'live_period']:
+                self.read_snapshot(advance=False)
+                with self.profiler.stage('emit_data_tmp'):
+                    self.emit_data_tmp()
+                self.update_metrics()
+                self.time_live = time.perf_counter()
+            self.acq_timer.start(self.next_check_interval(elapsed_time))
+
+    def start_continuous(self):
+        """Start a measurement of the maximum duration whose histograms are read on the fly, see read_snapshot"""
+        N = len([k for k in self.channels_enabled if self.channels_enabled[k]['enabled']])
+        shape = (N, self.settings['acquisition', 'timings', 'nbins'])
+        self.snapshots = [np.zeros(shape, dtype=np.uint32) for _ in range(2)]
+        self.interval = np.zeros(shape, dtype=np.uint32)
+        self.ind_snapshot = 0
+        self.snapshot_elapsed = 0.
+        self.engine.start(MAX_ACQ_TIME)
+        self.continuous_running = True
+
+    def read_snapshot(self, advance=True):
+        """Read the running histograms and compute the histograms of the current interval
+
+        Parameters
+        ----------
+        advance: (bool) if True the reading ends the interval and starts the next one, else (live display) the
+                 interval goes on
+        """
+        spare = 1 - self.ind_snapshot
+        channels_index = [self.channels_enabled[k]['index'] for k in self.channels_enabled if
+                          self.channels_enabled[k]['enabled']]
+        with self.metrics.time('histogram'):
+            self.engine.histogram(out=self.snapshots[spare], channels=channels_index)
+            elapsed_time = self.controller.TH260_GetElapsedMeasTime(self.device)  # in ms
+            # uint32 wrap around: exact as long as a bin gets less than 2**32 counts within an interval
+            np.subtract(self.snapshots[spare], self.snapshots[self.ind_snapshot], out=self.interval)
+        self.interval_time = (elapsed_time - self.snapshot_elapsed) / 1000
+        if advance:
+            self.ind_snapshot = spare
+            self.snapshot_elapsed = elapsed_time
+
+    def stop_prestarted_histogram(self):
+        """Discard a histogram started back to back or a continuous measurement (settings changed or acquisition
+        stopped)"""
+        if self.prestarted_time_acq is not None or self.continuous_running:
+            self.engine.stop()
+            self.prestarted_time_acq = None
+            self.continuous_running = False
+
+    def start_histogram(self, time_acq: int):
+        """Clear the histogram memory and start a new measurement of time_acq ms"""
+        self.start_profiling()
+        self.engine.start(time_acq)  # also resets the metrics
+
     def get_rates(self):
         vals = []
         sync_rate = self.controller.TH260_GetSyncRate(self.device)
@@ -507,6 +1111,11 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
     def emit_rates(self, vals):
         for d in vals:
             self.settings.child('acquisition', 'rates', d['channel_rate_name']).setValue(d['rate']*1000)
+        sync_rate = [d['rate'] for d in vals if d['channel_rate_name'] == 'syncrate']
+        channel_rates = [d['rate'] for d in vals if d['channel_rate_name'] != 'syncrate']
+        if len(sync_rate) != 0 and len(channel_rates) != 0:
+            self.settings.child('acquisition', 'pileup', 'pileup_ratio').setValue(
+                100 * pileup_ratio(max(channel_rates), sync_rate[0]))
         if self.settings['acquisition', 'rates', 'large_display']:
             self.emit_status(ThreadCommand('lcd',
                                            [np.array([d['rate']]) for d in vals if
@@ -533,24 +1142,24 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
             return
 
         if param.name() == 'divider':
-            self.controller.TH260_SetSyncDiv(self.device, param.value())
+            self.engine.set_sync(divider=param.value())
 
         elif param.name() == 'zerox' or param.name() == 'level':
             level = param.parent()['level']
             zerox = param.parent()['zerox']
             if source == 'sync':
-                self.controller.TH260_SetSyncCFD(self.device, level, zerox)
+                self.engine.set_sync(level=level, zerox=zerox)
             else:
-                self.controller.TH260_SetInputCFD(self.device, source, level, zerox)
+                self.engine.set_input(source, level=level, zerox=zerox)
 
         elif param.name() == 'offset':
             if source == 'sync':
-                self.controller.TH260_SetSyncChannelOffset(self.device,param.value())
+                self.engine.set_sync(offset=param.value())
             else:
-                self.controller.TH260_SetInputChannelOffset(self.device, source, param.value())
+                self.engine.set_input(source, offset=param.value())
 
         elif param.name() == 'enabled':
-            self.controller.TH260_SetInputChannelEnable(self.device, source, enable=param.value())
+            self.engine.set_input(source, enabled=param.value())
             self.channels_enabled[source_str]['enabled'] = param.value()
             for par in param.parent().children():
                 if par != param:
@@ -558,8 +1167,7 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
             self.set_lcd()
 
         elif param.name() == 'deadtime':
-            code = param.opts['limits'].index(param.value())
-            self.controller.TH260_SetInputDeadTime(self.device, source, code)
+            self.engine.set_input(source, deadtime=param.opts['limits'].index(param.value()))
 
     def set_get_resolution(self, wintype='resolution'):
         """
@@ -573,35 +1181,30 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
 
         """
 
-        base_res, max_bin_size_code = self.controller.TH260_GetBaseResolution(self.device)  # bas res in ps
+        timings = self.capability_cache.timings(self.controller, self.device, self.capabilities,
+                                                self.settings['acquisition', 'timings', 'timing_mode'])
+        base_res = timings['base_resolution']  # bas res in ps
         self.settings.child('acquisition', 'timings', 'base_resolution').setValue(base_res)
         resolution = self.settings['acquisition', 'timings', 'resolution']  # in ns
         Nbins = self.settings['acquisition', 'timings', 'nbins']
 
-        bin_size_code = int(np.log(resolution * 1000 / base_res)/np.log(2))
-        if bin_size_code < 0:
-            bin_size_code = 0
+        bin_size_code = binning_code(timings, resolution)  # max_binning - 1 at most, see SetBinning documentation
 
         if wintype =='resolution' or wintype =='both':
-            if bin_size_code >= max_bin_size_code:
-                bin_size_code = max_bin_size_code-1 #see SetBinning documentation
-            self.controller.TH260_SetBinning(self.device, bin_size_code)
-            resolution = 2**bin_size_code * base_res / 1000
-            resolution=self.controller.TH260_GetResolution(self.device)/1000
+            resolution = self.engine.set_binning(resolution, timings)
             self.settings.child('acquisition', 'timings', 'resolution').setValue(resolution)
         if wintype =='nbins' or wintype =='both':
             mode = self.settings['acquisition', 'acq_type']
 
-            if mode == 'Counting' or mode == 'Histo':
-                Nbins = self.controller.TH260_SetHistoLen(self.device, int(np.log(Nbins/1024)/np.log(2)))
+            Nbins = self.engine.set_histogram_length(Nbins)  # only set on the device in histogram modes
             self.settings.child('acquisition', 'timings', 'nbins').setValue(Nbins)
 
             N = len([k for k in self.channels_enabled.keys() if self.channels_enabled[k]['enabled']])
             if mode == 'Histo':
                 self.data = [np.zeros((Nbins,), dtype=np.uint32) for _ in range(N)]
-                self.data_pointers = [data.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32)) for data in self.data]
 
-        self.settings.child('acquisition', 'timings', 'window').setValue(Nbins*resolution/1e6)  # in ms
+        window = timings['windows'][bin_size_code][NBINS.index(Nbins)] if Nbins in NBINS else Nbins*resolution/1e6
+        self.settings.child('acquisition', 'timings', 'window').setValue(window)  # in ms
         self.set_acq_mode(self.settings['acquisition', 'acq_type'])
         self.get_xaxis()
 
@@ -623,12 +1226,22 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
         self.stop()
         QtWidgets.QApplication.processEvents()
         self.data = None
-        self.data_pointers = None
         self.general_timer.stop()
         QtWidgets.QApplication.processEvents()
         #QThread.msleep(1000)
-        if self.controller is not None:
-            self.controller.TH260_CloseDevice(self.device)
+        if self.engine is not None:
+            self.engine.close()
+        if self.t3_thread is not None:
+            self.t3_thread.quit()
+            self.t3_thread.wait(1000)
+            self.t3_thread = None
+            self.t3_reader = None
+        if self.publisher is not None:
+            self.publisher.close()
+            self.publisher = None
+        if self.stream_server is not None:
+            self.stream_server.close()
+            self.stream_server = None
         if self.h5temp is not None:
             if self.h5temp.h5_file is not None:
                 if self.h5temp.h5_file.isopen:
@@ -647,14 +1260,20 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
         if self.controller is not None:
             res = self.settings['acquisition', 'timings', 'resolution']
             Nbins = self.settings['acquisition', 'timings', 'nbins']
-            self.x_axis = Axis(data=np.linspace(0, (Nbins-1)*res, Nbins) * 1e-9, label='Time', units='s')
+            if self._x_axis_key != (res, Nbins):
+                self.x_axis = Axis(data=np.linspace(0, (Nbins-1)*res, Nbins) * 1e-9, label='Time', units='s')
+                self._x_axis_key = (res, Nbins)
         else:
             raise(Exception('Controller not defined'))
         return self.x_axis
 
     def grab_data(self, Naverage=1, **kwargs):
         """
-
+        Parameters
+        ----------
+        Naverage: (int) not used
+        kwargs: live (bool) True for live grabbing, positions (list of float) the scan coordinates of a T3
+                acquisition saved in the steps table of the photons file (at most MAX_POSITIONS)
         """
         try:
             self.acq_done = False
@@ -668,9 +1287,24 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
             elif mode == 'Histo':
                 self.general_timer.stop()
                 time_acq = int(self.settings['acquisition', 'acq_time'] * 1000)  # in ms
-                self.controller.TH260_ClearHistMem(self.device)
-                self.controller.TH260_StartMeas(self.device, time_acq)
-                self.acq_timer.start()
+                if self.settings['acquisition', 'continuous']:
+                    self.grab_continuous(time_acq, live=kwargs.get('live', False))
+                    return
+                elapsed_time = 0.
+                if self.prestarted_time_acq != time_acq:
+                    if self.prestarted_time_acq is not None:  # started with another acquisition time
+                        self.engine.stop()
+                    self.start_histogram(time_acq)
+                else:  # started back to back, possibly already done
+                    elapsed_time = self.engine.elapsed_time()
+                self.prestarted_time_acq = None
+                self.time_acq_ms = time_acq
+                self.time_live = time.perf_counter()
+                self.acq_timer.start(self.next_check_interval(elapsed_time))
+
+            elif mode == 'Series':
+                self.general_timer.stop()
+                self.start_series()
 
             elif mode == 'T3':
                 self.ind_reading = 0
@@ -678,32 +1312,154 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
                 self.Nx = 1
                 self.Ny = 1
 
-                self.init_h5file()
+                if not (self.t3_session and self.settings['acquisition', 't3_export', 'persistent_session']):
+                    self.end_t3_session()
+                    self.init_h5file()
+                    self.decoder.macrotime_offset = 0
+                    self.Nphotons_saved = 0
+                    self.step_index = 0
+                    self.t3_session = self.settings['acquisition', 't3_export', 'persistent_session']
+                    if self.t3_session:
+                        self.session_path = self.new_photons_path()
+                        self.settings.child('acquisition', 't3_export', 'photons_file').setValue(
+                            str(self.session_path))
+                else:  # the sync counter restarts with each measurement, keep the timestamps of the file ordered
+                    self.decoder.macrotime_offset += T3_WRAPAROUND
+                self.step_first_photon = self.Nphotons_saved
+                self.step_start_macrotime = self.step_stop_macrotime = self.decoder.macrotime_offset
+                self.step_positions = np.full((MAX_POSITIONS,), np.nan)
+                positions = np.atleast_1d(np.asarray(kwargs.get('positions', []), dtype=np.float64))
+                self.step_positions[:min(MAX_POSITIONS, positions.size)] = positions[:MAX_POSITIONS]
+                self.photon_filter = self.get_photon_filter()
+                sync_rate = self.controller.TH260_GetSyncRate(self.device)
+                self.sync_period = 1 / sync_rate if sync_rate > 0 else 1.
+                self.intensity_trace = None
+                if self.settings['acquisition', 'trace', 'trace_enabled']:
+                    self.intensity_trace = IntensityTrace(
+                        self.settings['acquisition', 'trace', 'trace_bin'] * 1e-3 / self.sync_period,
+                        Nchannels=self.Nchannels, length=self.settings['acquisition', 'trace', 'trace_length'])
+                self.burst_search = self.get_burst_search()
+                self.t3_histograms = np.zeros((self.Nchannels, self.settings['acquisition', 'timings', 'nbins']),
+                                              dtype=np.int64)
+                self.save_photons = self.burst_search is None or self.settings['acquisition', 'bursts',
+                                                                               'save_photons']
                 time_acq = int(self.settings['acquisition', 'acq_time'] * 1000)  # in ms
                 self.general_timer.stop()
 
-                t3_reader = T3Reader(self.device, self.controller, time_acq, self.Nchannels)
-                self.detector_thread = QThread()
-                t3_reader.moveToThread(self.detector_thread)
+                controller = self.controller
+                if self.settings['replay', 'record_fifo']:
+                    self.fifo_recorder = FifoRecorder(self.controller, self.settings['replay', 'captures_folder'],
+                                                      self.device, mode=mode, acq_time=time_acq,
+                                                      nbins=self.settings['acquisition', 'timings', 'nbins'])
+                    controller = self.fifo_recorder
+
+                self.metrics.start()
+                self.start_profiling()
+                if self.t3_reader is None:  # the reader thread waits for the next acquisitions, see close
+                    self.t3_reader = T3Reader(self.device, controller, time_acq, self.Nchannels, metrics=self.metrics,
+                                              profiler=self.profiler)
+                    self.t3_thread = QThread()
+                    self.t3_reader.moveToThread(self.t3_thread)
+
+                    self.t3_reader.data_signal[dict].connect(self.populate_h5)
+                    self.stop_tttr.connect(self.t3_reader.stop_TTTR)
+                    self.start_tttr[int].connect(self.t3_reader.start_TTTR)
+
+                    self.t3_thread.t3_reader = self.t3_reader
+                    self.t3_thread.start(QThread.HighestPriority)
+                self.t3_reader.controller = controller
+                self.t3_reader.acquisition_stoped = False
 
-                t3_reader.data_signal[dict].connect(self.populate_h5)
-                self.stop_tttr.connect(t3_reader.stop_TTTR)
-
-                self.detector_thread.t3_reader = t3_reader
-                self.detector_thread.started.connect(t3_reader.start_TTTR)
-
-                self.detector_thread.setPriority(QThread.HighestPriority)
                 self.time_t3 = time.perf_counter()
                 self.time_t3_rate = time.perf_counter()
-                self.detector_thread.start()
+                self.t3_elapsed_time = 0.
+                self.start_tttr.emit(time_acq)
 
         except Exception as e:
             self.emit_status(ThreadCommand('Update_Status', [getLineInfo() + str(e), "log"]))
 
 
+    def start_series(self):
+        """Preallocate the frames, configure the measurement control and start the series in a separate thread"""
+        channels = [self.channels_enabled[k]['index'] for k in self.channels_enabled if
+                    self.channels_enabled[k]['enabled']]
+        self.series = np.zeros((self.settings['acquisition', 'series', 'Nframes'], len(channels),
+                                self.settings['acquisition', 'timings', 'nbins']), dtype=np.uint32)
+        self.settings.child('acquisition', 'series', 'frames_done').setValue(0)
+        self.controller.TH260_SetMeasControl(
+            self.device, SERIES_CONTROLS.index(self.settings['acquisition', 'series', 'meas_control']),
+            EDGES.index(self.settings['acquisition', 'series', 'start_edge']),
+            EDGES.index(self.settings['acquisition', 'series', 'stop_edge']))
+
+        self.init_h5file()
+        self.h5temp.get_set_group('/RawData', 'myseries')
+        self.series_saver = DataToExportEnlargeableSaver(self.h5temp, axis_name='frame time', axis_units='s')
+        self.get_xaxis()
+
+        self.controller.TH260_ClearHistMem(self.device)
+        self.metrics.start()
+        self.start_profiling()
+        self.series_reader = SeriesReader(self.device, self.controller, self.series, channels,
+                                          self.settings['acquisition', 'series', 'frame_time'],
+                                          metrics=self.metrics, profiler=self.profiler)
+        self.detector_thread = QThread()
+        self.series_reader.moveToThread(self.detector_thread)
+        self.series_reader.frame_signal[int].connect(self.save_frame)
+        self.series_reader.done_signal[int].connect(self.series_done)
+        self.detector_thread.series_reader = self.series_reader
+        self.detector_thread.started.connect(self.series_reader.start_series)
+        self.time_live = time.perf_counter()
+        self.detector_thread.start(QThread.HighestPriority)
+
+    @Slot(int)
+    def save_frame(self, frame: int):
+        """Append a completed frame to the temporary h5 file and update the display every live period"""
+        frame_time = self.series_reader.times[frame]
+        with self.metrics.time('write'):
+            self.series_saver.add_data('/RawData/myseries', axis_value=frame_time, data=DataToExport(
+                'series', data=[DataRaw('frame', data=[histogram for histogram in self.series[frame]],
+                                        labels=self.series_reader.labels, axes=[self.x_axis])]))
+        self.settings.child('acquisition', 'series', 'frames_done').setValue(frame + 1)
+        self.set_elapsed_time(frame_time * 1000)
+        self.publish('histograms', self.series[frame])
+        if (time.perf_counter() - self.time_live) * 1000 >= self.settings['acquisition', 'live_period']:
+            with self.profiler.stage('emit_data_tmp'):
+                self.emit_data_tmp()
+            self.update_metrics()
+            self.time_live = time.perf_counter()
+
+    @Slot(int)
+    def series_done(self, Nframes: int):
+        """Series completed or stopped: back to the software controlled measurements and emit the frames"""
+        self.detector_thread.quit()
+        self.controller.TH260_SetMeasControl(self.device, 0, 0, 0)
+        self.h5temp.flush()
+        self.emit_data()
+
+    def grab_continuous(self, time_acq: int, live=False):
+        """Continuous Histo mode: start the measurement if needed and schedule the end of the next interval
+
+        Parameters
+        ----------
+        time_acq: (int) duration of the interval in ms
+        live: (bool) if True the interval starts at the end of the previous one (no count lost between two
+              histograms), else the counts detected since the last histogram (while a scan moves) are discarded
+        """
+        if not self.continuous_running or not self.engine.running:
+            self.start_continuous()
+        elif not live:
+            self.read_snapshot(advance=True)
+        self.metrics.start()
+        self.start_profiling()
+        self.time_acq_ms = self.snapshot_elapsed + time_acq  # end of the interval in measurement time
+        self.time_live = time.perf_counter()
+        self.acq_timer.start(self.next_check_interval(self.engine.elapsed_time()))  # the interval may have begun
+
     def init_h5file(self):
         if self.h5temp is not None:
             self.h5temp.close()
+            if self.parquet_writer is not None:
+                self.parquet_writer.close()
             self.temp_path.cleanup()
 
         self.h5temp = H5Saver(save_type='detector')
@@ -714,6 +1470,83 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
         self.saver: DataToExportEnlargeableSaver = DataToExportEnlargeableSaver(self.h5temp,
                                                                                 axis_name='photon index',
                                                                                 axis_units='index')
+        self._loader = DataLoader(self.h5temp)
+        self.h5temp.get_set_group('/RawData', 'mysteps')
+        self.step_saver = DataToExportEnlargeableSaver(self.h5temp, axis_name='step', axis_units='index')
+        self.trace_saver = None
+        if self.settings['acquisition', 'trace', 'trace_enabled'] and self.settings['acquisition', 'trace',
+                                                                                    'save_trace']:
+            self.h5temp.get_set_group('/RawData', 'mytrace')
+            self.trace_saver = DataToExportEnlargeableSaver(self.h5temp, axis_name='trace bin', axis_units='index')
+        self.burst_saver = None
+        if self.settings['acquisition', 'bursts', 'burst_enabled']:
+            self.h5temp.get_set_group('/RawData', 'mybursts')
+            self.burst_saver = DataToExportEnlargeableSaver(self.h5temp, axis_name='burst index', axis_units='index')
+        self.parquet_writer = None
+        if self.settings['acquisition', 'acq_type'] == 'T3' and self.settings['acquisition', 't3_export',
+                                                                              'parquet_export']:
+            self.parquet_writer = ParquetPhotonWriter(
+                Path(self.temp_path.name).joinpath('temp_data.parquet'),
+                metadata=dict(resolution_ns=self.settings['acquisition', 'timings', 'resolution'],
+                              sync_rate=self.controller.TH260_GetSyncRate(self.device)))
+
+    def new_photons_path(self) -> Path:
+        """A new file path within the photons folder"""
+        folder = Path(self.settings['acquisition', 't3_export', 'photons_folder'])
+        return folder.joinpath(f"t3_photons_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.h5")
+
+    def finalize_h5file(self, path: Path = None) -> Path:
+        """Close the temporary h5 file and move it (and the parquet file if exported) into the photons folder
+
+        Parameters
+        ----------
+        path: (Path) the new path of the file, default to a new one, see new_photons_path
+
+        Returns
+        -------
+        Path: the new path of the file
+        """
+        self.h5temp.close()
+        if path is None:
+            path = self.new_photons_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(Path(self.temp_path.name).joinpath('temp_data.h5')), str(path))
+        if self.parquet_writer is not None:
+            shutil.move(str(self.parquet_writer.close()), str(path.with_suffix('.parquet')))
+            self.parquet_writer = None
+        self.temp_path.cleanup()
+        self.h5temp = None
+        self._loader = None
+        self.settings.child('acquisition', 't3_export', 'photons_file').setValue(str(path))
+        return path
+
+    def save_step(self):
+        """Mark the boundaries of the current acquisition within the steps table of the photons file, see
+        T3PhotonFile.steps
+
+        The scan coordinates are the ones given to grab_data with the positions keyword, NaN if not given.
+        """
+        data = DataToExport('steps', data=[
+            DataRaw('steps', data=[np.array([value], dtype=np.int64) for value in
+                                   (self.step_first_photon, self.Nphotons_saved - self.step_first_photon,
+                                    self.step_start_macrotime, self.step_stop_macrotime)],
+                    labels=list(STEP_FIELDS)),
+            DataRaw('positions', data=[np.array([position]) for position in self.step_positions],
+                    labels=[f'position_{ind}' for ind in range(MAX_POSITIONS)])])
+        self.step_saver.add_data('/RawData/mysteps', axis_value=self.step_index, data=data)
+
+    def end_t3_session(self):
+        """Close the photons file kept open for consecutive acquisitions and move it into the photons folder"""
+        if not self.t3_session:
+            return
+        self.t3_session = False
+        self.photons = T3PhotonFile(self.finalize_h5file(self.session_path))
+        self.emit_log(f'T3 photons of {self.step_index} acquisitions saved in {self.photons.path}')
+
+    def release_records(self, data_dict: dict):
+        """Give the FIFO buffer of a chunk back to the T3 reader"""
+        if data_dict.get('buffer', None) is not None and self.t3_reader is not None:
+            self.t3_reader.release_buffer(data_dict['buffer'])
 
     @Slot(dict)
     def populate_h5(self, data_dict):
@@ -721,41 +1554,85 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
 
         Parameters
         ----------
-        data_dict: (dict) dict(data=self.buffer[0:nrecords], rates=rates, elapsed_time=elapsed_time)
+        data_dict: (dict) dict(data=buffer[0:nrecords], buffer=buffer, rates=rates, elapsed_time=elapsed_time), the
+                   buffer is given back to the reader once decoded
 
         Returns
         -------
 
         """
-        if data_dict['data'] != []:
-            # self.raw_datas_array.append(datas['data'])
-            # self.raw_datas_array._v_attrs['shape'] = self.raw_datas_array.shape
-            detectors, timestamps, nanotimes = pqreader.process_t3records(
-                data_dict['data'], time_bit=10, dtime_bit=15, ch_bit=6, special_bit=True,
-                ovcfunc=pqreader._correct_overflow_nsync)
-
-            data = DataToExport('photons', data=[
-                DataRaw('time', data=[nanotimes, detectors],
-                        labels=['nanotimes', 'detectors'],
-                        nav_indexes=(0, ),
-                        axes=[Axis('timestamps', data=timestamps, index=0)]
-                        )
-            ])
-
-            self.saver.add_data('/RawData/myphotons', axis_value=timestamps, data=data)
+        if self.h5temp is None:  # chunks read after stopping the acquisition
+            self.release_records(data_dict)
+            return
+        self.t3_elapsed_time = data_dict['elapsed_time'] / 1000  # in s
+        if len(data_dict['data']) != 0:
+            self.metrics.increment('chunks_processed')  # the final status carries no records and is not counted
+            self.metrics.set_gauge('queue_depth', self.metrics.counters.get('chunks_emitted', 0) -
+                                   self.metrics.counters['chunks_processed'])
+            with self.metrics.time('decode'), self.profiler.stage('decode'):
+                chunk = self.decoder.decode(data_dict['data'])
+            self.release_records(data_dict)
+            self.metrics.increment('decoded_records', len(chunk))
+
+            if self.intensity_trace is not None:
+                with self.metrics.time('trace'):
+                    self.save_trace(*self.intensity_trace.add(chunk.detectors, chunk.timestamps))
+
+            photons = chunk
+            if self.photon_filter is not None:
+                with self.metrics.time('filter'):
+                    photons = self.photon_filter.apply(chunk)
+            self.metrics.increment('kept_records', len(photons))
+            if len(photons) != 0 and (self.publisher is not None or self.stream_server is not None):
+                self.publish('photons', photons.to_records())
+
+            with self.metrics.time('histogram'):
+                self.t3_histograms += photons.histograms(self.t3_histograms.shape[1], self.t3_histograms.shape[0])
+
+            if self.burst_search is not None:  # on the filtered photons so that gates can remove scattered light
+                with self.metrics.time('bursts'):
+                    self.save_bursts(self.burst_search.add(photons.detectors, photons.timestamps,
+                                                           photons.nanotimes))
+
+            if self.save_photons and len(photons) != 0:
+                data = DataToExport('photons', data=[
+                    DataRaw('time', data=[photons.nanotimes, photons.detectors],
+                            labels=['nanotimes', 'detectors'],
+                            nav_indexes=(0, ),
+                            axes=[Axis('timestamps', data=photons.timestamps, index=0)]
+                            )
+                ])
+
+                with self.metrics.time('write'), self.profiler.stage('add_data'):
+                    self.saver.add_data('/RawData/myphotons', axis_value=photons.timestamps, data=data)
+                self.Nphotons_saved += len(photons)
+                self.step_stop_macrotime = int(photons.timestamps[-1])
+                self.metrics.increment('bytes_written', photons.nanotimes.nbytes + photons.detectors.nbytes +
+                                       photons.timestamps.nbytes)
+            if self.parquet_writer is not None and len(photons) != 0:
+                with self.metrics.time('parquet'):
+                    self.parquet_writer.write_chunk(photons, self.step_index)
+            chunk.release()  # everything needed has been copied (h5 file, histograms, bursts...)
 
             if time.perf_counter() - self.time_t3_rate > 0.5:
                 self.emit_rates(data_dict['rates'])
                 self.set_elapsed_time(data_dict['elapsed_time'])
-                self.settings.child('acquisition', 'rates', 'records').setValue(nanotimes.shape[0])
+                self.settings.child('acquisition', 'rates', 'records').setValue(len(photons))
+                self.settings.child('acquisition', 'photon_filter', 'kept_ratio').setValue(
+                    100 * self.metrics.counters['kept_records'] / max(1, self.metrics.counters['decoded_records']))
+                self.update_metrics()
+                if self.intensity_trace is not None:
+                    self.dte_signal_temp.emit(DataToExport('Trace', data=[self._format_trace()]))
                 self.time_t3_rate = time.perf_counter()
 
             elif time.perf_counter() - self.time_t3 > 5:
-                self.emit_data_tmp()
+                with self.metrics.time('emit_tmp'), self.profiler.stage('emit_data_tmp'):
+                    self.emit_data_tmp()
                 self.time_t3 = time.perf_counter()
 
-            if data_dict['acquisition_done']:
-                self.emit_data()
+        if data_dict['acquisition_done']:
+            self.set_elapsed_time(data_dict['elapsed_time'])
+            self.emit_data()
 
     def stop(self):
         """
@@ -763,9 +1640,16 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
         """
         try:
             self.acq_timer.stop()
+            if self.series_reader is not None:
+                self.series_reader.set_acquisition_stoped()
+            if self.t3_reader is not None:
+                self.t3_reader.set_acquisition_stoped()
             QtWidgets.QApplication.processEvents()
-            self.controller.TH260_StopMeas(self.device)
+            self.engine.stop()
+            self.prestarted_time_acq = None
+            self.continuous_running = False
             QtWidgets.QApplication.processEvents()
+            self.end_t3_session()
             self.general_timer.start()
         except Exception as e:
             self.emit_status(ThreadCommand('Update_Status', [getLineInfo()+ str(e), "log"]))
@@ -774,67 +1658,108 @@ class DAQ_1DViewer_TH260(DAQ_Viewer_base):
 
 
 class T3Reader(QObject):
-    data_signal = Signal(dict)  # dict(data=self.buffer[0:nrecords], rates=rates, elapsed_time=elapsed_time)
+    """Qt wrapper of the FifoReader of the headless engine, run in the plugin reader thread
+
+    Each chunk is emitted with its buffer, the receiver should give the buffer back with release_buffer once the
+    records are decoded.
+    """
+    data_signal = Signal(dict)  # dict(data=buffer[0:nrecords], buffer=buffer, rates=rates, elapsed_time=elapsed_time)
+    buffer_size = FifoReader.buffer_size
 
-    def __init__(self, device, controller, time_acq, Nchannels=2):
+    def __init__(self, device, controller, time_acq, Nchannels=2, metrics: AcquisitionMetrics = None,
+                 profiler: StageProfiler = None):
         super().__init__()
+        self.reader = FifoReader(device, controller, time_acq, Nchannels, metrics=metrics, profiler=profiler)
 
-        self.Nchannels = Nchannels
-        self.device = device
-        self.controller = controller
-        self.time_acq = time_acq
-        self.acquisition_stoped = False
-        self.buffer = zeros_aligned(2 ** 14, 4096, dtype=np.uint32)
-        self.data_ptr = self.buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32))
+    @property
+    def controller(self):
+        return self.reader.controller
 
-    def set_acquisition_stoped(self):
-        self.acquisition_stoped = True
+    @controller.setter
+    def controller(self, controller):
+        self.reader.controller = controller
 
-    def start_TTTR(self):
+    @property
+    def acquisition_stoped(self) -> bool:
+        return self.reader.acquisition_stoped
 
-        self.controller.TH260_StartMeas(self.device, self.time_acq)
+    @acquisition_stoped.setter
+    def acquisition_stoped(self, stoped: bool):
+        self.reader.acquisition_stoped = stoped
 
-        while not self.acquisition_stoped:
-            if 'FIFOFULL' in self.controller.TH260_GetFlags(self.device):
-                print("\nFiFo Overrun!")
-                #self.stop_TTTR()
+    def release_buffer(self, buffer: np.ndarray):
+        self.reader.release_buffer(buffer)
 
-            rates = self.get_rates()
-            elapsed_time = self.controller.TH260_GetElapsedMeasTime(self.device)  # in ms
+    def set_acquisition_stoped(self):
+        self.reader.set_acquisition_stoped()
 
-            nrecords = self.controller.TH260_ReadFiFo(self.device, self.buffer.size, self.data_ptr)
+    @Slot(int)
+    def start_TTTR(self, time_acq: int = None):
+        self.reader.run(self.data_signal.emit, time_acq)
 
-            if nrecords > 0:
-                # We could just iterate through our buffer with a for loop, however,
-                # this is slow and might cause a FIFO overrun. So instead, we shrinken
-                # the buffer to its appropriate length with array slicing, which gives
-                # us a python list. This list then needs to be converted back into
-                # a ctype array which can be written at once to the output file
-                self.data_signal.emit(dict(data=self.buffer[0:nrecords], rates=rates, elapsed_time=elapsed_time,
-                                           acquisition_done=False))
-            else:
+    def stop_TTTR(self):
+        self.reader.stop_TTTR()
 
-                if self.controller.TH260_CTCStatus(self.device):
-                    print("\nDone")
-                    self.stop_TTTR()
-                    self.data_signal.emit(dict(data=[], rates=rates, elapsed_time=elapsed_time, acquisition_done=True))
-            # within this loop you can also read the count rates if needed.
 
-    def stop_TTTR(self):
-        self.acquisition_stoped = True
-        self.controller.TH260_StopMeas(self.device)
+class SeriesReader(QObject):
+    """Acquire a series of histograms, frame after frame, into a preallocated buffer
 
+    Each frame is a measurement of frame_time (software timing) or is controlled by the C1 input, depending on the
+    TH260_SetMeasControl configuration, then read with a clearing of the histogram memory so that the next frame
+    starts from zero.
 
-    def get_rates(self):
-        vals = []
-        sync_rate = self.controller.TH260_GetSyncRate(self.device)
+    Parameters
+    ----------
+    device: (int) device index
+    controller: the TH260 (or replay) controller
+    buffer: (ndarray) the histograms of shape (Nframes, Nchannels, Nbins) and dtype uint32
+    channels: (list of int) index of the channel corresponding to each histogram of a frame
+    frame_time: (int) acquisition time of each frame in ms
+    """
+    frame_signal = Signal(int)  # index of the completed frame
+    done_signal = Signal(int)  # number of completed frames
+    poll_interval = 0.0005  # in s, polling period of the end of a frame
 
-        vals.append(dict(channel_rate_name='syncrate', rate=sync_rate/1000))
-        for ind_channel in range(self.Nchannels):
-            rate = self.controller.TH260_GetCountRate(self.device, ind_channel)
-            vals.append(dict(channel_rate_name=f'ch{ind_channel+1}_rate', rate=rate/1000))
+    def __init__(self, device, controller, buffer: np.ndarray, channels: List[int], frame_time: int,
+                 metrics: AcquisitionMetrics = None, profiler: StageProfiler = None):
+        super().__init__()
 
-        return vals
+        self.metrics = metrics if metrics is not None else AcquisitionMetrics()
+        self.profiler = profiler if profiler is not None else StageProfiler()
+        self.device = device
+        self.controller = controller
+        self.buffer = buffer
+        self.channels = channels
+        self.labels = [f'CH{channel + 1}' for channel in channels]
+        self.frame_time = frame_time
+        self.times = np.zeros((buffer.shape[0],))  # end of each frame in s from the start of the series
+        self.Nframes = 0
+        self.acquisition_stoped = False
+        self.data_pointers = [[self.buffer[frame, ind].ctypes.data_as(ctypes.POINTER(ctypes.c_uint32))
+                               for ind in range(len(channels))] for frame in range(buffer.shape[0])]
+
+    def set_acquisition_stoped(self):
+        self.acquisition_stoped = True
+
+    def start_series(self):
+        start = time.perf_counter()
+        with self.profiler.stage('start_series'):
+            for frame in range(self.buffer.shape[0]):
+                self.controller.TH260_StartMeas(self.device, self.frame_time)
+                while not self.acquisition_stoped and not self.controller.TH260_CTCStatus(self.device):
+                    time.sleep(self.poll_interval)
+                self.controller.TH260_StopMeas(self.device)
+                if self.acquisition_stoped:  # the frame is incomplete
+                    break
+                with self.metrics.time('histogram'):
+                    for ind, channel in enumerate(self.channels):
+                        self.controller.TH260_GetHistogram(self.device, self.data_pointers[frame][ind],
+                                                           channel=channel, clear=True)
+                self.times[frame] = time.perf_counter() - start
+                self.Nframes = frame + 1
+                self.metrics.increment('frames')
+                self.frame_signal.emit(frame)
+        self.done_signal.emit(self.Nframes)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,156 @@
+"""
+Asyncio facade of the headless TimeHarp 260 engine, to coordinate the device with other instruments in one event loop
+
+    async with AsyncTH260Engine(Th260()) as engine:
+        await engine.configure('T3', resolution=0.25)
+        await engine.TH260_SetSyncDiv(0, 2)  # any call of the controller can be awaited
+        await engine.start(1000)
+        async for chunk in engine.chunks():
+            ...
+        await engine.wait()
+
+The controller calls of a device are made one after the other in a dedicated executor thread, the FIFO being read and
+decoded by the reader thread of the engine. The event loop is woken up when chunks are queued or when the measurement
+ends, no thread is used to wait for them. In histogram mode, the end of a measurement is awaited by sleeping for its
+remaining time before checking the device status.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Callable
+
+import numpy as np
+
+from pymodaq_plugins_picoquant.hardware.picoquant.engine import TH260Engine
+from pymodaq_plugins_picoquant.processing.chunks import PhotonChunk
+
+
+class AsyncTH260Engine:
+    """Awaitable configuration, acquisition and completion of a TH260Engine
+
+    Parameters
+    ----------
+    controller: (Th260) the controller of the hardware, or any object with the same methods (Th260Replay...)
+    device: (int) device index
+    max_chunks: (int) maximum number of decoded chunks waiting to be consumed
+    """
+    final_poll_interval = 0.002  # in s, interval of the completion checks once the acquisition time is elapsed
+
+    def __init__(self, controller, device: int = 0, max_chunks: int = 64):
+        self.engine = TH260Engine(controller, device, max_chunks)
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix=f'TH260_{device}')
+        self._loop: asyncio.AbstractEventLoop = None
+        self._update: asyncio.Event = None
+
+    def __getattr__(self, item):
+        if item.startswith('TH260_'):
+            return partial(self.call, getattr(self.engine.controller, item))
+        raise AttributeError(f'{type(self).__name__} has no attribute {item}')
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def call(self, func: Callable, *args, **kwargs):
+        """Call func in the executor thread of the device"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._update = asyncio.Event()
+            self.engine.on_update = self._notify
+
+    def _notify(self):
+        """Called from the reader thread of the engine"""
+        try:
+            self._loop.call_soon_threadsafe(self._update.set)
+        except RuntimeError:  # the event loop is closed
+            pass
+
+    async def _wait_update(self, condition: Callable[[], bool]):
+        while True:
+            self._update.clear()
+            if condition():
+                return
+            await self._update.wait()
+
+    async def open(self):
+        await self.call(self.engine.open)
+
+    async def close(self):
+        await self.call(self.engine.close)
+        self.executor.shutdown(wait=False)
+
+    async def configure(self, *args, **kwargs) -> dict:
+        """See TH260Engine.configure"""
+        return await self.call(self.engine.configure, *args, **kwargs)
+
+    async def start(self, time_acq: int = 1000):
+        """Start a measurement of time_acq ms"""
+        self._bind_loop()
+        await self.call(self.engine.start, time_acq)
+
+    async def stop(self):
+        await self.call(self.engine.stop)
+
+    async def histogram(self) -> np.ndarray:
+        """See TH260Engine.histogram"""
+        return await self.call(self.engine.histogram)
+
+    async def wait(self, timeout: float = None) -> bool:
+        """Wait for the end of the measurement, returns False if still running after timeout (in s)"""
+        try:
+            await asyncio.wait_for(self._wait_done(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _wait_done(self):
+        if self.engine.mode == 'T3':
+            self._bind_loop()
+            await self._wait_update(lambda: not self.engine.running)
+        else:  # the device has no completion event, sleep until the expected end then check its status
+            while await self.call(lambda: self.engine.running):
+                remaining = await self.call(self.engine.remaining_time)  # in ms
+                await asyncio.sleep(max(self.final_poll_interval, remaining / 1000))
+
+    async def chunks(self, timeout: float = None) -> AsyncIterator[PhotonChunk]:
+        """Decoded photons of the running T3 measurement, until its end (or stop)
+
+        A chunk is given back to the pool when the next one is requested, copy it (or its arrays) to keep it.
+
+        Parameters
+        ----------
+        timeout: (float) maximum time in s to wait for a chunk, None to wait until the end of the measurement
+
+        Raises
+        ------
+        TimeoutError: if no chunk is received within timeout
+        """
+        self._bind_loop()
+        while True:
+            chunk = None
+
+            def received() -> bool:
+                nonlocal chunk
+                try:
+                    chunk = self.engine.next_chunk()
+                except StopIteration:
+                    return True
+                return chunk is not None
+
+            try:
+                await asyncio.wait_for(self._wait_update(received), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f'No photons received within {timeout} s')
+            if chunk is None:
+                return
+            try:
+                yield chunk
+            finally:
+                chunk.release()
@@ -0,0 +1,86 @@
+"""
+Per device cache of the TimeHarp 260 capabilities
+
+The hardware information, number of channels, features and resolution tables of a device never change for a given
+serial number and library version. They are queried once and saved in the plugin configuration directory so that
+the next initialisations and the resolution/Nbins changes do not need the corresponding library calls. An entry is
+queried again if the library version differs from the one used to build it.
+"""
+import json
+from pathlib import Path
+from typing import List, Union
+
+from pymodaq_plugins_picoquant.utils import Config
+
+
+NBINS = [1024 * 2 ** lencode for lencode in range(6)]  # allowed histogram lengths
+
+
+def default_cache_path() -> Path:
+    return Path(Config().config_path).parent.joinpath('picoquant_capabilities.json')
+
+
+def timing_table(base_resolution: float, max_binning: int) -> dict:
+    """Resolutions (ns) for each binning code and the corresponding time windows (ms) for each allowed Nbins"""
+    resolutions = [2 ** code * base_resolution / 1000 for code in range(max(1, max_binning))]
+    return dict(base_resolution=base_resolution, max_binning=max_binning, resolutions=resolutions, nbins=NBINS,
+                windows=[[resolution * nbins / 1e6 for nbins in NBINS] for resolution in resolutions])
+
+
+def binning_code(table: dict, resolution: float) -> int:
+    """Largest binning code whose resolution is not above the requested one (in ns)"""
+    codes = [code for code, value in enumerate(table['resolutions']) if value <= resolution * (1 + 1e-9)]
+    return codes[-1] if len(codes) != 0 else 0
+
+
+class CapabilityCache:
+    """Capabilities of the TimeHarp 260 devices, by serial number, persisted as json
+
+    Parameters
+    ----------
+    path: (str or Path) the json file, default to picoquant_capabilities.json in the configuration directory
+    """
+    def __init__(self, path: Union[str, Path] = None):
+        self.path = Path(path) if path is not None else default_cache_path()
+        self._entries = {}
+        if self.path.is_file():
+            try:
+                self._entries = json.loads(self.path.read_text())
+            except ValueError:  # corrupted file, rebuilt at the next save
+                self._entries = {}
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self._entries, indent=2))
+
+    def get(self, controller, device: int = 0) -> dict:
+        """Capabilities of the opened device, from the cache if valid, else queried from the library and cached
+
+        Returns
+        -------
+        dict: library_version, serial, hardware_info (model, part number, version), Nchannels, features and timings
+              (one timing table for each timing mode, see timing_table)
+        """
+        library_version = controller.TH260_GetLibraryVersion()
+        serial = controller.TH260_GetSerialNumber(device)
+        entry = self._entries.get(serial, None)
+        if entry is None or entry['library_version'] != library_version:
+            entry = dict(library_version=library_version, serial=serial,
+                         hardware_info=list(controller.TH260_GetHardwareInfo(device)),
+                         Nchannels=controller.TH260_GetNumOfInputChannels(device),
+                         features=list(controller.TH260_GetFeatures(device)),
+                         timings={})
+            self._entries[serial] = entry
+            self.save()
+        return entry
+
+    def timings(self, controller, device: int, entry: dict, timing_mode: str) -> dict:
+        """Timing table of a timing mode (Hires or Lowres), queried from the library only the first time"""
+        if timing_mode not in entry['timings']:
+            entry['timings'][timing_mode] = timing_table(*controller.TH260_GetBaseResolution(device))
+            self._entries[entry['serial']] = entry
+            self.save()
+        return entry['timings'][timing_mode]
+
+    def serials(self) -> List[str]:
+        return list(self._entries.keys())
@@ -0,0 +1,431 @@
+"""
+Headless acquisition engine of the TimeHarp 260, without any Qt dependency, for scripts, batch jobs and tests
+
+    engine = TH260Engine(Th260())  # or Th260Replay(capture_folder, speed=0)
+    engine.open()
+    engine.configure('T3', resolution=0.25)
+    engine.start(1000)
+    for chunk in engine.iter_chunks():  # decoded photons, see processing.chunks.PhotonChunk
+        ...
+    histograms = engine.histogram()
+    engine.close()
+
+The TH260 viewer plugin configures, starts and stops the device through a TH260Engine and reads its histograms with
+it. FifoReader runs the FIFO reading loop of the T3 mode, in a plain thread for the engine and wrapped in a QObject
+moved to a QThread for the plugin (see T3Reader), which decodes and saves the chunks itself.
+"""
+import ctypes
+import queue
+import threading
+import time
+from functools import partial
+from typing import Callable, Iterator, List
+
+import numpy as np
+
+from pymodaq_utils.logger import set_logger, get_module_name
+from pymodaq_utils.utils import zeros_aligned
+
+from pymodaq_plugins_picoquant.hardware.picoquant.capabilities import NBINS, binning_code, timing_table
+from pymodaq_plugins_picoquant.processing.chunks import BufferPool, PhotonChunk, T3Decoder
+from pymodaq_plugins_picoquant.processing.filters import PhotonFilter
+from pymodaq_plugins_picoquant.processing.metrics import AcquisitionMetrics
+from pymodaq_plugins_picoquant.processing.photons import nanotime_histograms
+from pymodaq_plugins_picoquant.processing.profiling import StageProfiler
+
+
+logger = set_logger(get_module_name(__file__))
+
+MODES = dict(Histo=0, T3=3)  # TH260_Initialize codes of the supported modes
+
+
+class FifoReader:
+    """Read the FIFO into buffers taken from a pool, each chunk being given to a callback with its buffer
+
+    The receiver should give the buffer back with release_buffer once the records are decoded, a buffer is never
+    reused while its records are still waiting to be processed.
+    """
+    buffer_size = 2 ** 14  # maximum number of records read from the FIFO at once
+    pool_size = 8  # number of buffers allocated at once
+
+    def __init__(self, device, controller, time_acq, Nchannels=2, metrics: AcquisitionMetrics = None,
+                 profiler: StageProfiler = None):
+        self.metrics = metrics if metrics is not None else AcquisitionMetrics()
+        self.profiler = profiler if profiler is not None else StageProfiler()
+        self.Nchannels = Nchannels
+        self.device = device
+        self.controller = controller
+        self.time_acq = time_acq
+        self.acquisition_stoped = False
+        self.pool = BufferPool(partial(zeros_aligned, self.buffer_size, 4096, dtype=np.uint32), self.pool_size)
+
+    def release_buffer(self, buffer: np.ndarray):
+        self.pool.release(buffer)
+
+    def set_acquisition_stoped(self):
+        self.acquisition_stoped = True
+
+    def run(self, emit: Callable[[dict], None], time_acq: int = None):
+        """Start a measurement and read the FIFO until its end or until acquisition_stoped is set
+
+        Parameters
+        ----------
+        emit: (Callable) called with dict(data=buffer[0:nrecords], buffer=buffer, rates=rates,
+              elapsed_time=elapsed_time, acquisition_done=False) for each chunk and with
+              dict(data=[], rates=rates, elapsed_time=elapsed_time, acquisition_done=True) at the end of the
+              measurement (not if stopped)
+        time_acq: (int) acquisition time in ms, default to the one given at initialization
+        """
+        if time_acq is not None:
+            self.time_acq = time_acq
+        done_status = None
+        with self.profiler.stage('start_TTTR'):
+            self.controller.TH260_StartMeas(self.device, self.time_acq)
+
+            while not self.acquisition_stoped:
+                with self.metrics.time('status'):
+                    flags = self.controller.TH260_GetFlags(self.device)
+                    rates = self.get_rates()
+                    elapsed_time = self.controller.TH260_GetElapsedMeasTime(self.device)  # in ms
+                if 'FIFOFULL' in flags:
+                    logger.warning('FiFo Overrun!')
+                    self.metrics.increment('fifo_overruns')
+
+                buffer = self.pool.acquire()
+                with self.metrics.time('fifo_read'):
+                    nrecords = self.controller.TH260_ReadFiFo(self.device, buffer.size,
+                                                              buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32)))
+                self.metrics.observe_fifo_read(nrecords)
+
+                if nrecords > 0:
+                    if 'FIFOFULL' in flags or 'EVTS_DROPPED' in flags:
+                        self.metrics.increment('dropped_chunks')
+                    self.metrics.increment('chunks_emitted')
+                    self.metrics.set_gauge('record_buffers', self.pool.Nallocated)
+                    # the buffer is only read by the receiver, the next reads use other buffers of the pool
+                    emit(dict(data=buffer[0:nrecords], buffer=buffer, rates=rates, elapsed_time=elapsed_time,
+                              acquisition_done=False))
+                else:
+                    self.pool.release(buffer)
+                    if self.controller.TH260_CTCStatus(self.device):
+                        logger.debug('T3 measurement done')
+                        elapsed_time = self.controller.TH260_GetElapsedMeasTime(self.device)  # of the whole measurement
+                        self.stop_TTTR()
+                        done_status = dict(data=[], rates=rates, elapsed_time=elapsed_time, acquisition_done=True)
+        if done_status is not None:  # emitted out of the profiled stage so that profiles can be saved on reception
+            emit(done_status)
+
+    def stop_TTTR(self):
+        self.acquisition_stoped = True
+        self.controller.TH260_StopMeas(self.device)
+
+    def get_rates(self):
+        vals = []
+        sync_rate = self.controller.TH260_GetSyncRate(self.device)
+
+        vals.append(dict(channel_rate_name='syncrate', rate=sync_rate/1000))
+        for ind_channel in range(self.Nchannels):
+            rate = self.controller.TH260_GetCountRate(self.device, ind_channel)
+            vals.append(dict(channel_rate_name=f'ch{ind_channel+1}_rate', rate=rate/1000))
+
+        return vals
+
+
+class TH260Engine:
+    """Configure a TimeHarp 260 and acquire histograms or decoded T3 photons from plain Python
+
+    In T3 mode the FIFO is read and decoded by a background thread into a bounded queue of PhotonChunk (the reader
+    waits when the queue is full, the device FIFO buffering meanwhile), the nanotime histograms of every decoded photon
+    being accumulated on the fly.
+
+    Parameters
+    ----------
+    controller: (Th260) the controller of the hardware, or any object with the same methods (Th260Replay...)
+    device: (int) device index
+    max_chunks: (int) maximum number of decoded chunks waiting to be consumed
+    metrics: (AcquisitionMetrics) where the measurements are timed and counted, reset at each start
+    """
+    poll_interval = 0.01  # in s, interval of the status checks while waiting for the end of a measurement
+
+    def __init__(self, controller, device: int = 0, max_chunks: int = 64, metrics: AcquisitionMetrics = None):
+        self.controller = controller
+        self.device = device
+        self.max_chunks = max_chunks
+        self.mode: str = None
+        self.Nchannels = 2
+        self.resolution: float = None  # in ns
+        self.nbins = NBINS[0]
+        self.photon_filter: PhotonFilter = None
+        self.time_acq: int = None  # in ms, duration of the last started measurement
+        self.metrics = metrics if metrics is not None else AcquisitionMetrics()
+        self.reader: FifoReader = None
+        self.decoder: T3Decoder = None
+        self._queue: queue.Queue = None
+        self._thread: threading.Thread = None
+        self._histograms: np.ndarray = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self.on_update: Callable[[], None] = None  # called from the reader thread when a chunk is queued and at the end
+
+    def open(self):
+        self.controller.TH260_OpenDevice(self.device)
+        self.Nchannels = self.controller.TH260_GetNumOfInputChannels(self.device)
+
+    def close(self):
+        self.stop()
+        self.controller.TH260_CloseDevice(self.device)
+
+    def configure(self, mode: str = 'T3', resolution: float = None, nbins: int = None, sync_divider: int = None,
+                  sync: dict = None, inputs: List[dict] = None, photon_filter: PhotonFilter = None) -> dict:
+        """Initialize the device in a measurement mode and apply the given settings (the others are left untouched)
+
+        Parameters
+        ----------
+        mode: (str) one of MODES
+        resolution: (float) requested bin width in ns, the closest available one not above is used, None to keep the
+            current binning
+        nbins: (int) histogram length, one of NBINS (Histo mode), the number of nanotime bins of the histograms, None
+            to keep the current length
+        sync_divider: (int) 1, 2, 4 or 8
+        sync: (dict) level, zerox (CFD in mV) and offset (ps) of the sync input, see set_sync
+        inputs: (list of dict) level, zerox, offset, enabled and deadtime (code) of each input channel, see set_input
+        photon_filter: (PhotonFilter) selection of the photons given by iter_chunks (T3 mode)
+
+        Returns
+        -------
+        dict: the actual mode, resolution (ns), nbins and Nchannels
+        """
+        self.initialize(mode)
+        self.set_sync(divider=sync_divider, **(sync if sync is not None else {}))
+        for channel, settings in enumerate(inputs if inputs is not None else []):
+            self.set_input(channel, **settings)
+        if resolution is not None:
+            self.set_binning(resolution)
+        else:
+            self.resolution = self.controller.TH260_GetResolution(self.device) / 1000
+        if nbins is not None:
+            self.set_histogram_length(nbins)
+        self.photon_filter = photon_filter
+        return dict(mode=self.mode, resolution=self.resolution, nbins=self.nbins, Nchannels=self.Nchannels)
+
+    def initialize(self, mode: str):
+        """Stop any measurement and initialize the device in one of MODES"""
+        if mode not in MODES:
+            raise ValueError(f'{mode} is not a valid mode, possible modes are {list(MODES)}')
+        self.stop()
+        self.controller.TH260_Initialize(self.device, mode=MODES[mode])
+        self.mode = mode
+
+    def set_sync(self, divider: int = None, level: int = None, zerox: int = None, offset: int = None):
+        """Set the given settings of the sync input, level and zerox (CFD in mV) being set together, offset in ps"""
+        if divider is not None:
+            self.controller.TH260_SetSyncDiv(self.device, divider)
+        if level is not None or zerox is not None:
+            if level is None or zerox is None:
+                raise ValueError('The CFD level and zerox should be given together')
+            self.controller.TH260_SetSyncCFD(self.device, level, zerox)
+        if offset is not None:
+            self.controller.TH260_SetSyncChannelOffset(self.device, offset)
+
+    def set_input(self, channel: int, level: int = None, zerox: int = None, offset: int = None, deadtime: int = None,
+                  enabled: bool = None):
+        """Set the given settings of an input channel, level and zerox (CFD in mV) being set together, offset in ps
+        and deadtime as a code"""
+        if level is not None or zerox is not None:
+            if level is None or zerox is None:
+                raise ValueError('The CFD level and zerox should be given together')
+            self.controller.TH260_SetInputCFD(self.device, channel, level, zerox)
+        if offset is not None:
+            self.controller.TH260_SetInputChannelOffset(self.device, channel, offset)
+        if deadtime is not None:
+            self.controller.TH260_SetInputDeadTime(self.device, channel, deadtime)
+        if enabled is not None:
+            self.controller.TH260_SetInputChannelEnable(self.device, channel=channel, enable=enabled)
+
+    def set_binning(self, resolution: float, timings: dict = None) -> float:
+        """Set the largest bin width not above resolution (ns) and return it
+
+        Parameters
+        ----------
+        resolution: (float) requested bin width in ns
+        timings: (dict) timing table of the device (see capabilities.timing_table), queried if not given
+        """
+        if timings is None:
+            timings = timing_table(*self.controller.TH260_GetBaseResolution(self.device))
+        code = binning_code(timings, resolution)
+        self.controller.TH260_SetBinning(self.device, code)
+        self.resolution = timings['resolutions'][code]
+        return self.resolution
+
+    def set_histogram_length(self, nbins: int) -> int:
+        """Set and return the number of time bins of the histograms (the device memory is only set in Histo mode)"""
+        if self.mode == 'Histo':
+            nbins = self.controller.TH260_SetHistoLen(self.device, int(np.log2(nbins / NBINS[0])))
+        self.nbins = nbins
+        return self.nbins
+
+    @property
+    def running(self) -> bool:
+        if self.mode == 'T3':
+            return self._thread is not None and not self._done.is_set()
+        return self.mode is not None and not self.controller.TH260_CTCStatus(self.device)
+
+    def start(self, time_acq: int = 1000):
+        """Start a measurement of time_acq ms"""
+        if self.mode is None:
+            raise RuntimeError('The engine should be configured before starting a measurement')
+        self.stop()
+        self.metrics.start()
+        if self.mode == 'T3':
+            self.decoder = T3Decoder(FifoReader.buffer_size)
+            self._histograms = np.zeros((self.Nchannels, self.nbins), dtype=np.int64)
+            self._queue = queue.Queue(self.max_chunks)
+            self.reader = FifoReader(self.device, self.controller, time_acq, self.Nchannels, metrics=self.metrics)
+            self._done.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        else:
+            self.controller.TH260_ClearHistMem(self.device)
+            self.controller.TH260_StartMeas(self.device, time_acq)
+        self.time_acq = time_acq
+
+    def _run(self):
+        try:
+            self.reader.run(self._process)
+        finally:
+            self._done.set()
+            self._notify()
+
+    def _notify(self):
+        if self.on_update is not None:
+            self.on_update()
+
+    def _put(self, item) -> bool:
+        while not self.reader.acquisition_stoped or item is None:
+            try:
+                self._queue.put(item, timeout=self.poll_interval)
+                self._notify()
+                return True
+            except queue.Full:
+                if item is None and self.reader.acquisition_stoped:
+                    return False
+        return False
+
+    def _process(self, data_dict: dict):
+        """Decode a chunk in the reader thread and queue it"""
+        if len(data_dict['data']) != 0:
+            with self.metrics.time('decode'):
+                chunk = self.decoder.decode(data_dict['data'])
+            self.reader.release_buffer(data_dict['buffer'])
+            self.metrics.increment('decoded_records', len(chunk))
+            if self.photon_filter is not None:
+                filtered = self.photon_filter.apply(chunk)
+                chunk.release()
+                chunk = filtered
+            with self._lock:
+                self._histograms += nanotime_histograms(chunk.detectors, chunk.nanotimes, self.nbins, self.Nchannels)
+            if not self._put(chunk):
+                chunk.release()
+        if data_dict['acquisition_done']:
+            self._put(None)
+
+    def next_chunk(self, timeout: float = 0.) -> PhotonChunk:
+        """The next decoded chunk of the running T3 measurement, None if none is received within timeout (in s)
+
+        Raises
+        ------
+        StopIteration: at the end of the measurement (or once stopped), when all the queued chunks are consumed
+        """
+        if self.mode != 'T3' or self._queue is None:
+            raise RuntimeError('Photon chunks are only available in T3 mode, once started')
+        try:
+            chunk = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+        except queue.Empty:
+            if not self.running and self._queue.empty():
+                raise StopIteration
+            return None
+        if chunk is None:
+            raise StopIteration
+        return chunk
+
+    def iter_chunks(self, timeout: float = None) -> Iterator[PhotonChunk]:
+        """Decoded photons of the running T3 measurement, until its end (or stop)
+
+        A chunk is given back to the pool when the next one is requested, copy it (or its arrays) to keep it.
+
+        Parameters
+        ----------
+        timeout: (float) maximum time in s to wait for a chunk, None to wait until the end of the measurement
+
+        Raises
+        ------
+        TimeoutError: if no chunk is received within timeout
+        """
+        waited = 0.
+        while True:
+            try:
+                chunk = self.next_chunk(self.poll_interval)
+            except StopIteration:
+                return
+            if chunk is None:
+                waited += self.poll_interval
+                if timeout is not None and waited >= timeout:
+                    raise TimeoutError(f'No photons received within {timeout} s')
+                continue
+            waited = 0.
+            try:
+                yield chunk
+            finally:
+                chunk.release()
+
+    def histogram(self, out: np.ndarray = None, channels: List[int] = None, clear: bool = False) -> np.ndarray:
+        """Histogram of each channel, shape (len(channels), nbins)
+
+        In T3 mode, the nanotime histograms of all the decoded (and filtered) photons so far, else the histograms of
+        the device memory.
+
+        Parameters
+        ----------
+        out: (np.ndarray or list of np.ndarray) uint32 arrays the device histograms are read into (Histo mode)
+        channels: (list of int) the channels to read, default to all of them
+        clear: (bool) if True, the device memory is cleared after reading (Histo mode)
+        """
+        channels = list(range(self.Nchannels)) if channels is None else channels
+        if self.mode == 'T3':
+            with self._lock:
+                return self._histograms[channels] if self._histograms is not None else \
+                    np.zeros((len(channels), self.nbins), dtype=np.int64)
+        if out is None:
+            out = np.zeros((len(channels), self.nbins), dtype=np.uint32)
+        for ind, channel in enumerate(channels):
+            self.controller.TH260_GetHistogram(self.device, out[ind].ctypes.data_as(ctypes.POINTER(ctypes.c_uint32)),
+                                               channel=channel, clear=clear)
+        return out
+
+    def elapsed_time(self) -> float:
+        """Elapsed time of the running measurement in ms"""
+        return self.controller.TH260_GetElapsedMeasTime(self.device)
+
+    def remaining_time(self) -> float:
+        """Time before the expected end of the last started measurement in ms"""
+        if self.time_acq is None:
+            return 0.
+        return max(0., self.time_acq - self.elapsed_time())
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait for the end of the measurement, returns False if still running after timeout (in s)"""
+        start = time.perf_counter()
+        while self.running:
+            if timeout is not None and time.perf_counter() - start >= timeout:
+                return False
+            time.sleep(self.poll_interval)
+        return True
+
+    def stop(self):
+        """Stop the running measurement (the chunks already queued can still be iterated)"""
+        if self.mode == 'T3' and self._thread is not None:
+            self.reader.set_acquisition_stoped()
+            self._thread.join()
+            self._thread = None
+        if self.mode is not None:
+            self.controller.TH260_StopMeas(self.device)
@@ -0,0 +1,328 @@
+"""
+Record and replay of the TTTR FIFO stream of a Timeharp 260
+
+FifoRecorder wraps a Th260 controller and records, while an acquisition runs, every TH260_ReadFiFo chunk (size,
+content and time) together with the flags, rates, elapsed time and CTC status returned by the library. Th260Replay
+exposes the same methods as Th260 but serves a recorded capture, at the original or at an accelerated speed, so that
+a production run can be reproduced on any computer (the TH260 library is only available on windows).
+
+A capture is a folder containing:
+
+* records.bin: all the TTTR records (uint32) concatenated
+* events.bin: one REPLAY_DTYPE element for each recorded library call
+* header.json: device information (resolution, number of channels, hardware info...) and acquisition settings
+"""
+import ctypes
+import datetime
+import json
+import threading
+import time
+from enum import IntEnum
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+
+
+REPLAY_DTYPE = np.dtype([('time', '<f8'), ('call', 'u1'), ('channel', 'i1'), ('value', '<f8'), ('offset', '<i8')])
+
+FLAGS = {'OVERFLOW': 0x0001, 'FIFOFULL': 0x0002, 'SYNC_LOST': 0x0004, 'EVTS_DROPPED': 0x0008,
+         'SYSERROR': 0x0010, 'SOFTERROR': 0x0020}
+
+
+class ReplayCalls(IntEnum):
+    START = 0
+    READFIFO = 1
+    FLAGS = 2
+    SYNCRATE = 3
+    COUNTRATE = 4
+    ELAPSED = 5
+    CTCSTATUS = 6
+    STOP = 7
+
+
+def flags_to_int(flags: list) -> int:
+    return sum([FLAGS[flag] for flag in flags])
+
+
+def int_to_flags(value: int) -> list:
+    return [flag for flag, bit in FLAGS.items() if int(value) & bit]
+
+
+def new_capture_folder(folder: Union[str, Path]) -> Path:
+    """Create a new capture folder, named from the current time and numbered if it already exists"""
+    name = f"fifo_capture_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    index = 0
+    while True:
+        path = Path(folder).joinpath(name if index == 0 else f'{name}_{index:03d}')
+        try:
+            path.mkdir()
+            return path
+        except FileExistsError:
+            index += 1
+
+
+class FifoRecorder:
+    """Wrapper around a Th260 controller recording the TTTR stream and the status calls of an acquisition
+
+    All methods not listed here are forwarded untouched to the wrapped controller.
+
+    Parameters
+    ----------
+    controller: (Th260) the controller of the hardware
+    folder: (str or Path) parent folder where the capture folder will be created
+    device: (int) device index
+    metadata: extra information saved in the header (acquisition settings...)
+    """
+    def __init__(self, controller, folder: Union[str, Path], device: int = 0, **metadata):
+        self._controller = controller
+        self._lock = threading.Lock()
+        self.path = new_capture_folder(folder)
+        self._records_file = open(self.path.joinpath('records.bin'), 'wb')
+        self._events_file = open(self.path.joinpath('events.bin'), 'wb')
+        self._nrecords = 0
+        self._t0 = time.perf_counter()
+
+        base_resolution, max_binning = controller.TH260_GetBaseResolution(device)
+        self.header = dict(metadata,
+                           hardware_info=controller.TH260_GetHardwareInfo(device),
+                           serial=controller.TH260_GetSerialNumber(device),
+                           base_resolution=base_resolution,
+                           max_binning=max_binning,
+                           resolution=controller.TH260_GetResolution(device),
+                           Nchannels=controller.TH260_GetNumOfInputChannels(device),
+                           histogram_length=controller.histogram_length,
+                           date=datetime.datetime.now().isoformat())
+
+    def __getattr__(self, item):
+        return getattr(self._controller, item)
+
+    def _record(self, call: ReplayCalls, value: float = 0., channel: int = -1, offset: int = -1):
+        event = np.array([(time.perf_counter() - self._t0, call, channel, value, offset)], dtype=REPLAY_DTYPE)
+        with self._lock:
+            self._events_file.write(event.tobytes())
+
+    def TH260_StartMeas(self, device: int = 0, tacq: int = 1000):
+        self._t0 = time.perf_counter()
+        self._controller.TH260_StartMeas(device, tacq)
+        self._record(ReplayCalls.START, tacq)
+
+    def TH260_StopMeas(self, device: int = 0):
+        self._controller.TH260_StopMeas(device)
+        self._record(ReplayCalls.STOP)
+
+    def TH260_ReadFiFo(self, device: int = 0, count: int = 0, buffer_ptr=None):
+        nrecords = self._controller.TH260_ReadFiFo(device, count, buffer_ptr)
+        if nrecords > 0:
+            with self._lock:
+                self._records_file.write(np.ctypeslib.as_array(buffer_ptr, shape=(nrecords,)).tobytes())
+                offset = self._nrecords
+                self._nrecords += nrecords
+        else:
+            offset = self._nrecords
+        self._record(ReplayCalls.READFIFO, nrecords, offset=offset)
+        return nrecords
+
+    def TH260_GetFlags(self, device: int = 0):
+        flags = self._controller.TH260_GetFlags(device)
+        self._record(ReplayCalls.FLAGS, flags_to_int(flags))
+        return flags
+
+    def TH260_GetSyncRate(self, device: int = 0):
+        rate = self._controller.TH260_GetSyncRate(device)
+        self._record(ReplayCalls.SYNCRATE, rate)
+        return rate
+
+    def TH260_GetCountRate(self, device: int = 0, channel: int = 0):
+        rate = self._controller.TH260_GetCountRate(device, channel)
+        self._record(ReplayCalls.COUNTRATE, rate, channel=channel)
+        return rate
+
+    def TH260_GetElapsedMeasTime(self, device: int = 0):
+        elapsed = self._controller.TH260_GetElapsedMeasTime(device)
+        self._record(ReplayCalls.ELAPSED, elapsed)
+        return elapsed
+
+    def TH260_CTCStatus(self, device: int = 0):
+        status = self._controller.TH260_CTCStatus(device)
+        self._record(ReplayCalls.CTCSTATUS, status)
+        return status
+
+    def close(self) -> Path:
+        """Close the capture files and write the header, returns the capture folder"""
+        with self._lock:
+            self._records_file.close()
+            self._events_file.close()
+        self.header['Nrecords'] = self._nrecords
+        self.path.joinpath('header.json').write_text(json.dumps(self.header, indent=2, default=str))
+        return self.path
+
+
+class Th260Replay:
+    """Replay backend of the Th260 controller serving a capture recorded with FifoRecorder
+
+    The recorded chunks are returned by TH260_ReadFiFo in the same order, with the same sizes and content, each one
+    not before its recorded time divided by speed. Status calls return the last recorded value at the current replay
+    time. Setters are accepted and ignored. In histogram mode, where the FIFO is not read, a measurement ends once its
+    acquisition time is elapsed (immediately if speed is 0) and the histograms are empty.
+
+    Parameters
+    ----------
+    path: (str or Path) the capture folder
+    speed: (float) replay speed factor, 1 for the original timing, 0 to replay as fast as possible
+    """
+    fifo_timeout = 0.005  # in s, the library returns after a few ms if no data could be fetched
+
+    def __init__(self, path: Union[str, Path], speed: float = 1.):
+        self.path = Path(path)
+        self.speed = speed
+        self.header = json.loads(self.path.joinpath('header.json').read_text())
+        self.records = np.memmap(self.path.joinpath('records.bin'), dtype=np.uint32, mode='r') \
+            if self.header['Nrecords'] > 0 else np.zeros((0,), dtype=np.uint32)
+        events = np.fromfile(self.path.joinpath('events.bin'), dtype=REPLAY_DTYPE)
+        events = events[np.argsort(events['time'], kind='stable')]  # calls may come from different threads
+        self._events = {call: events[events['call'] == call] for call in ReplayCalls}
+        self.chunks = self._events[ReplayCalls.READFIFO]
+        self.chunks = self.chunks[self.chunks['value'] > 0]
+        self._end_time = events['time'].max() if len(events) > 0 else 0.
+        self.Nchannels = self.header['Nchannels']
+        self.histogram_length = self.header['histogram_length']
+        self.resolution = self.header['resolution']
+        self.mode = 3
+        self.running = False
+        self._tacq = 0
+        self._t0 = time.perf_counter()
+        self._ind_chunk = 0
+        self._ind_in_chunk = 0
+        self._chunk_time = 0.
+
+    def __getattr__(self, item):
+        if item.startswith('TH260_Set') or item in ('TH260_ClearHistMem', 'TH260_OpenDevice', 'TH260_CloseDevice'):
+            return lambda *args, **kwargs: None
+        raise AttributeError(f'{item} is not available in the replay backend')
+
+    @property
+    def fifo_mode(self) -> bool:
+        """True in T2 or T3 mode, where the recorded FIFO stream is served"""
+        return self.mode in (2, 3)
+
+    @property
+    def done(self) -> bool:
+        return self._ind_chunk >= len(self.chunks)
+
+    def _elapsed_ms(self) -> float:
+        """Elapsed time of a histogram measurement in ms"""
+        if self.speed <= 0:
+            return float(self._tacq)
+        return min((time.perf_counter() - self._t0) * self.speed * 1000, float(self._tacq))
+
+    def replay_time(self) -> float:
+        """The current time within the capture"""
+        if self.speed <= 0:
+            return self._chunk_time
+        return (time.perf_counter() - self._t0) * self.speed
+
+    def _last_value(self, call: ReplayCalls, channel: int = -1, default=0.):
+        events = self._events[call]
+        if channel >= 0:
+            events = events[events['channel'] == channel]
+        ind = int(np.searchsorted(events['time'], self.replay_time(), side='right')) - 1
+        if ind < 0:
+            return events['value'][0] if len(events) > 0 else default
+        return events['value'][ind]
+
+    def TH260_Initialize(self, device: int = 0, mode: int = 0):
+        self.mode = mode
+
+    def TH260_GetLibraryVersion(self):
+        return 'replay'
+
+    def TH260_GetHardwareInfo(self, device: int = 0):
+        return tuple(self.header['hardware_info'])
+
+    def TH260_GetSerialNumber(self, device: int = 0):
+        return self.header['serial']
+
+    def TH260_GetFeatures(self, device: int = 0):
+        return ['FEATURE_TTTR', 'FEATURE_MARKERS']
+
+    def TH260_GetBaseResolution(self, device: int = 0):
+        return self.header['base_resolution'], self.header['max_binning']
+
+    def TH260_GetNumOfInputChannels(self, device: int = 0):
+        return self.Nchannels
+
+    def TH260_GetResolution(self, device: int = 0):
+        return self.resolution
+
+    def TH260_SetHistoLen(self, device: int = 0, lencode: int = 0):
+        self.histogram_length = 1024 * 2 ** lencode
+        return self.histogram_length
+
+    def TH260_GetHistogram(self, device: int = 0, data_pointer=None, channel: int = 0, clear: bool = False):
+        np.ctypeslib.as_array(data_pointer, shape=(self.histogram_length,))[:] = 0
+
+    def TH260_StartMeas(self, device: int = 0, tacq: int = 1000):
+        self._t0 = time.perf_counter()
+        self._ind_chunk = 0
+        self._ind_in_chunk = 0
+        self._chunk_time = 0.
+        self._tacq = tacq
+        self.running = True
+
+    def TH260_StopMeas(self, device: int = 0):
+        self.running = False
+
+    def TH260_CTCStatus(self, device: int = 0):
+        if not self.running:
+            return True
+        if not self.fifo_mode:
+            return self._elapsed_ms() >= self._tacq
+        if not self.done:
+            return False
+        return self.speed <= 0 or self.replay_time() >= self._end_time or \
+            bool(self._last_value(ReplayCalls.CTCSTATUS, default=1.))
+
+    def TH260_GetFlags(self, device: int = 0):
+        return int_to_flags(self._last_value(ReplayCalls.FLAGS))
+
+    def TH260_GetSyncRate(self, device: int = 0):
+        return int(self._last_value(ReplayCalls.SYNCRATE))
+
+    def TH260_GetCountRate(self, device: int = 0, channel: int = 0):
+        return int(self._last_value(ReplayCalls.COUNTRATE, channel=channel))
+
+    def TH260_GetElapsedMeasTime(self, device: int = 0):
+        if not self.fifo_mode and self.running:
+            return self._elapsed_ms()
+        return float(self._last_value(ReplayCalls.ELAPSED))
+
+    def TH260_GetWarnings(self, device: int = 0):
+        return ''
+
+    def TH260_GetSyncPeriod(self, device: int = 0):
+        rate = self.TH260_GetSyncRate(device)
+        return 1 / rate if rate != 0 else 0.
+
+    def TH260_ReadFiFo(self, device: int = 0, count: int = 0, buffer_ptr=None):
+        if not self.running or self.done:
+            time.sleep(self.fifo_timeout)
+            return 0
+        chunk = self.chunks[self._ind_chunk]
+        if self.speed > 0:
+            wait = chunk['time'] / self.speed - (time.perf_counter() - self._t0)
+            if wait > self.fifo_timeout:
+                time.sleep(self.fifo_timeout)
+                return 0
+            elif wait > 0:
+                time.sleep(wait)
+        start = int(chunk['offset']) + self._ind_in_chunk
+        nrecords = min(int(chunk['value']) - self._ind_in_chunk, count)
+        ctypes.memmove(buffer_ptr, self.records[start:start + nrecords].ctypes.data, nrecords * 4)
+        self._ind_in_chunk += nrecords
+        if self._ind_in_chunk >= int(chunk['value']):
+            self._ind_chunk += 1
+            self._ind_in_chunk = 0
+            self._chunk_time = chunk['time']
+        return nrecords
@@ -9,7 +9,6 @@ from enum import IntEnum
 import platform
 from pymodaq_plugins_picoquant.hardware.utils import winfunc
 from pymodaq_utils.utils import is_64bits
-from bitstring import Bits
 
 
 from pymodaq_plugins_picoquant.utils import Config
@@ -259,18 +258,17 @@ class Th260(object):
         ret=[]
 
         if res == 0:
-            feature = Bits(int=feature.value, length=32)
-            if len(feature.find('0x0001')) != 0:
+            if feature.value & 0x0001:
                 ret.append("FEATURE_DLL")
-            if len(feature.find('0x0002')) != 0:
+            if feature.value & 0x0002:
                 ret.append("FEATURE_TTTR")
-            if len(feature.find('0x0004')) != 0:
+            if feature.value & 0x0004:
                 ret.append("FEATURE_MARKERS")
-            if len(feature.find('0x0008')) != 0:
+            if feature.value & 0x0008:
                 ret.append("FEATURE_LOWRES")
-            if len(feature.find('0x0010')) != 0:
+            if feature.value & 0x0010:
                 ret.append("FEATURE_TRIGOUT")
-            if len(feature.find('0x0020')) != 0:
+            if feature.value & 0x0020:
                 ret.append("FEATURE_PROG_TD")
 
             return ret
@@ -488,6 +486,20 @@ class Th260(object):
         if res != 0:
             raise IOError(ErrorCodes(res).name)
 
+    def TH260_SetOffset(self, device: int = 0, offset: int = 0):
+        """
+        This offset must not be confused with the input offsets in each channel that act like a cable delay. In contrast,
+        the offset here is subtracted from each start-stop measurement before it is used to either address the histogram
+        channel to be incremented (in histogramming mode) or to be stored in a T3 mode record.
+        Parameters
+        ----------
+        device: (int) device index if multiple devices 0..3 (default 0)
+        offset: (int) histogram time offset in ns minimum = OFFSETMIN (0) maximum = OFFSETMAX (100000000)
+        """
+        res = self._TH260_SetOffset(device, offset)
+        if res != 0:
+            raise IOError(ErrorCodes(res).name)
+
     def TH260_SetHistoLen(self, device: int = 0, lencode: int= 0):
         """
         This sets the number of time bins in histogramming and T3 mode. It is not meaningful in T2 mode.
@@ -693,18 +705,17 @@ class Th260(object):
         res = self._TH260_GetFlags(device, byref(flags))
         if res == 0:
             ret=[]
-            #flags = Bits(int=flags.value, length=32)
-            if flags.value & 0x0001 > 1:
+            if flags.value & 0x0001:
                 ret.append('OVERFLOW')
-            if flags.value & 0x0002 > 1:
+            if flags.value & 0x0002:
                 ret.append('FIFOFULL')
-            if flags.value & 0x0004 > 1:
+            if flags.value & 0x0004:
                 ret.append('SYNC_LOST')
-            if flags.value & 0x0008 > 1:
+            if flags.value & 0x0008:
                 ret.append('EVTS_DROPPED')
-            if flags.value & 0x0010 > 1:
+            if flags.value & 0x0010:
                 ret.append('SYSERROR')
-            if flags.value & 0x0020 > 1:
+            if flags.value & 0x0020:
                 ret.append('SOFTERROR')
             return ret
         else:
@@ -0,0 +1,88 @@
+"""
+Export of the decoded photons as Apache Arrow record batches and Parquet files (pyarrow is an optional dependency)
+
+Each chunk of decoded records gives a record batch, written as its own row group, with the columns:
+
+* macrotime (int64): the overflow corrected sync count
+* nanotime (uint16): the time bin within the sync period
+* channel (dictionary of uint8 indexed by int8): the input channel of a photon, null for a marker
+* marker (uint8): the marker bits of a marker record, 0 for a photon
+* step (uint32): the index of the acquisition (scan step) within the file
+
+Overflow records are not exported, the macrotimes being already corrected.
+"""
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from pymodaq_plugins_picoquant.processing.chunks import PhotonChunk
+from pymodaq_plugins_picoquant.processing.filters import OVERFLOW_DETECTOR, MARKER_OFFSET
+
+
+def _check_pyarrow():
+    if pa is None:
+        raise ImportError('pyarrow is needed to export the photons as Arrow/Parquet')
+
+
+def photon_schema(metadata: dict = None) -> 'pa.Schema':
+    """Schema of the photon tables, metadata (such as the resolution) is saved as strings"""
+    _check_pyarrow()
+    schema = pa.schema([('macrotime', pa.int64()), ('nanotime', pa.uint16()),
+                        ('channel', pa.dictionary(pa.int8(), pa.uint8())), ('marker', pa.uint8()),
+                        ('step', pa.uint32())])
+    if metadata is not None:
+        schema = schema.with_metadata({key: str(value) for key, value in metadata.items()})
+    return schema
+
+
+def to_record_batch(chunk: PhotonChunk, step: int = 0, schema: 'pa.Schema' = None) -> 'pa.RecordBatch':
+    """The photons and markers of a chunk as a record batch (the data are copied)"""
+    _check_pyarrow()
+    keep = chunk.detectors != OVERFLOW_DETECTOR
+    detectors = chunk.detectors[keep]
+    is_marker = detectors >= MARKER_OFFSET
+    channels = pa.DictionaryArray.from_arrays(
+        pa.array(np.where(is_marker, 0, detectors).astype(np.int8), mask=is_marker),
+        pa.array(np.arange(MARKER_OFFSET, dtype=np.uint8)))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(chunk.timestamps[keep]), pa.array(chunk.nanotimes[keep]), channels,
+         pa.array(np.where(is_marker, detectors - MARKER_OFFSET, 0).astype(np.uint8)),
+         pa.array(np.full((detectors.size,), step, dtype=np.uint32))],
+        schema=schema if schema is not None else photon_schema())
+
+
+class ParquetPhotonWriter:
+    """Parquet file of photons written chunk by chunk, each chunk being a row group
+
+    Parameters
+    ----------
+    path: (str or Path) the parquet file
+    compression: (str) parquet compression codec
+    metadata: (dict) saved within the schema (resolution, sync period...)
+    """
+    def __init__(self, path: Union[str, Path], compression: str = 'zstd', metadata: dict = None):
+        _check_pyarrow()
+        self.path = Path(path)
+        self.schema = photon_schema(metadata)
+        self._writer = pq.ParquetWriter(str(self.path), self.schema, compression=compression)
+        self.Nrows = 0
+
+    def write_chunk(self, chunk: PhotonChunk, step: int = 0):
+        batch = to_record_batch(chunk, step, self.schema)
+        if batch.num_rows != 0:
+            self._writer.write_batch(batch, row_group_size=batch.num_rows)
+            self.Nrows += batch.num_rows
+
+    def close(self) -> Path:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        return self.path
@@ -0,0 +1,155 @@
+"""
+All-photon burst search and burst-wise smFRET quantities computed on the stream of decoded T3 photons
+
+A photon window of M consecutive photons is considered within a burst when its count rate, (M - 1) / duration, is
+above a threshold. A burst starts at the first photon of the first such window and stops at the last photon of the
+last contiguous one (sliding window search as in Nir et al., J. Phys. Chem. B 110, 22103 (2006)). Bursts with less
+than a minimum number of photons are discarded.
+
+For each burst, photons are split into the usual FRET streams from the detector (donor or acceptor channel) and,
+in pulsed interleaved excitation (PIE), from the nanotime (before or after the PIE split):
+
+* DD: donor channel, donor excitation
+* DA: acceptor channel, donor excitation
+* AA: acceptor channel, acceptor excitation
+
+giving the proximity ratio E = DA / (DA + DD) and the stoichiometry S = (DD + DA) / (DD + DA + AA) (S is 1 without
+PIE). These are not corrected for background, leakage, direct excitation or detection efficiencies.
+"""
+import numpy as np
+
+
+BURST_DTYPE = np.dtype([('start', '<i8'), ('stop', '<i8'), ('duration', '<f8'), ('size', '<u4'),
+                        ('n_dd', '<u4'), ('n_da', '<u4'), ('n_aa', '<u4'), ('E', '<f8'), ('S', '<f8'),
+                        ('nanotime_donor', '<f8'), ('nanotime_acceptor', '<f8')])
+
+
+class BurstSearch:
+    """Streaming sliding window burst search
+
+    Photons are given chunk after chunk (time ordered), the ones belonging to a burst not yet completed (or needed to
+    decide whether the next window is a burst) are kept until the next chunk.
+
+    Parameters
+    ----------
+    m: (int) number of photons of the sliding window
+    rate_threshold: (float) minimum count rate within a window in photons per macrotime unit
+    min_size: (int) minimum number of photons of a burst
+    sync_period: (float) duration of a macrotime unit in s, used for the burst durations
+    donor_channel: (int) detector index of the donor channel
+    acceptor_channel: (int) detector index of the acceptor channel
+    pie_split: (int) nanotime bin separating donor excitation (before) and acceptor excitation (after) photons, 0 if
+               there is no PIE
+    """
+    def __init__(self, m: int = 10, rate_threshold: float = 1e-3, min_size: int = 30, sync_period: float = 1.,
+                 donor_channel: int = 0, acceptor_channel: int = 1, pie_split: int = 0):
+        self.m = max(2, int(m))
+        self.max_duration = (self.m - 1) / rate_threshold  # in macrotime units
+        self.min_size = max(self.m, int(min_size))
+        self.sync_period = sync_period
+        self.donor_channel = donor_channel
+        self.acceptor_channel = acceptor_channel
+        self.pie_split = pie_split
+        self.Nbursts = 0
+        self._timestamps = np.zeros((0,), dtype=np.int64)
+        self._detectors = np.zeros((0,), dtype=np.uint8)
+        self._nanotimes = np.zeros((0,), dtype=np.uint16)
+        self._last_stop = 0  # index of the photon following the last emitted burst
+
+    def add(self, detectors: np.ndarray, timestamps: np.ndarray, nanotimes: np.ndarray) -> np.ndarray:
+        """Search the bursts within a new chunk of decoded records
+
+        Parameters
+        ----------
+        detectors: (ndarray) detector of each record, only the photons of the donor and acceptor channels are used
+        timestamps: (ndarray) overflow corrected macrotimes
+        nanotimes: (ndarray) nanotimes
+
+        Returns
+        -------
+        ndarray: the completed bursts as a structured array of dtype BURST_DTYPE
+        """
+        is_photon = (detectors == self.donor_channel) | (detectors == self.acceptor_channel)
+        self._timestamps = np.concatenate((self._timestamps, timestamps[is_photon]))
+        self._detectors = np.concatenate((self._detectors, detectors[is_photon]))
+        self._nanotimes = np.concatenate((self._nanotimes, nanotimes[is_photon]))
+        return self._search(final=False)
+
+    def flush(self) -> np.ndarray:
+        """Complete the search at the end of an acquisition, returns the last bursts"""
+        return self._search(final=True)
+
+    def _search(self, final: bool) -> np.ndarray:
+        timestamps = self._timestamps
+        Nwindows = timestamps.size - self.m + 1
+        if Nwindows <= 0:
+            if final:
+                self._keep(timestamps.size)
+            return np.zeros((0,), dtype=BURST_DTYPE)
+
+        in_burst = np.zeros((Nwindows + 2,), dtype=np.int8)
+        in_burst[1:-1] = (timestamps[self.m - 1:] - timestamps[:Nwindows]) <= self.max_duration
+        edges = np.diff(in_burst)
+        starts = np.flatnonzero(edges == 1)
+        stops = np.flatnonzero(edges == -1)  # index of the first window out of the burst
+
+        stops = stops + self.m - 1  # the last photon of the last window is within the burst
+        # consecutive bursts may share up to m - 2 photons, they are given to the first one
+        if starts.size != 0:
+            starts[0] = max(starts[0], self._last_stop)
+            starts[1:] = np.maximum(starts[1:], stops[:-1])
+
+        if in_burst[-2] and not final:  # the last burst may continue in the next chunk
+            keep_from = starts[-1]
+            starts, stops = starts[:-1], stops[:-1]
+        else:
+            keep_from = Nwindows if not final else timestamps.size
+        last_stop = stops[-1] if stops.size != 0 else self._last_stop
+
+        valid = stops - starts >= self.min_size
+        bursts = self._burst_table(starts[valid], stops[valid])
+        self._keep(keep_from)
+        self._last_stop = max(0, last_stop - keep_from)
+        self.Nbursts += bursts.size
+        return bursts
+
+    def _keep(self, index: int):
+        self._timestamps = self._timestamps[index:]
+        self._detectors = self._detectors[index:]
+        self._nanotimes = self._nanotimes[index:]
+        self._last_stop = 0
+
+    def _burst_table(self, starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+        bursts = np.zeros((starts.size,), dtype=BURST_DTYPE)
+        if starts.size == 0:
+            return bursts
+        is_donor = self._detectors == self.donor_channel
+        is_acceptor = ~is_donor
+        if self.pie_split > 0:
+            donor_excitation = self._nanotimes < self.pie_split
+        else:
+            donor_excitation = np.ones(is_donor.shape, dtype=bool)
+
+        indexes = np.stack((starts, stops), axis=1).ravel()
+
+        def burst_sum(values: np.ndarray) -> np.ndarray:
+            # trailing zero so that a burst may end on the last photon
+            return np.add.reduceat(np.append(values, 0), indexes)[::2]
+
+        bursts['start'] = self._timestamps[starts]
+        bursts['stop'] = self._timestamps[stops - 1]
+        bursts['duration'] = (bursts['stop'] - bursts['start']) * self.sync_period
+        bursts['size'] = stops - starts
+        bursts['n_dd'] = burst_sum((is_donor & donor_excitation).astype(np.uint32))
+        bursts['n_da'] = burst_sum((is_acceptor & donor_excitation).astype(np.uint32))
+        bursts['n_aa'] = burst_sum((is_acceptor & ~donor_excitation).astype(np.uint32))
+        n_donor = burst_sum(is_donor.astype(np.uint32))
+        n_acceptor = bursts['size'] - n_donor
+        nanotimes = self._nanotimes.astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            n_dex = bursts['n_dd'].astype(np.float64) + bursts['n_da']
+            bursts['E'] = bursts['n_da'] / n_dex
+            bursts['S'] = n_dex / (n_dex + bursts['n_aa'])
+            bursts['nanotime_donor'] = burst_sum(np.where(is_donor, nanotimes, 0.)) / n_donor
+            bursts['nanotime_acceptor'] = burst_sum(np.where(is_acceptor, nanotimes, 0.)) / n_acceptor
+        return bursts
@@ -0,0 +1,177 @@
+"""
+Decoded TTTR records exchanged between the decoder, the filters, the histograms and the writers
+
+A PhotonChunk holds the three arrays of a FIFO read (detectors, overflow corrected macrotimes and nanotimes) with
+fixed integer dtypes. The arrays of the decoded chunks are views into blocks taken from a pool, so that no memory is
+allocated per chunk once the acquisition runs: a chunk is given back to its pool with release once every consumer is
+done with it (the consumers copying what they need to keep).
+
+The decoding follows the phconvert convention for the detectors (see processing.filters), with the overflow
+correction carried from one chunk to the next.
+"""
+from collections import deque
+from functools import partial
+from threading import Lock
+from typing import Callable, Iterable, Union
+
+import numpy as np
+
+from pymodaq_plugins_picoquant.processing.filters import OVERFLOW_DETECTOR
+from pymodaq_plugins_picoquant.processing.photons import nanotime_histograms
+from pymodaq_plugins_picoquant.processing.sharing import pack_photons
+
+
+T3_WRAPAROUND = 1024  # the sync counter of the T3 records has 10 bits
+T3_DTIME_SHIFT = 10
+T3_CHANNEL_SHIFT = 25  # the special bit is the MSB of the 7 bits detector code
+
+
+class PhotonChunk:
+    """Detector, macrotime and nanotime of consecutive records
+
+    Parameters
+    ----------
+    detectors: (ndarray of uint8)
+    timestamps: (ndarray of int64) overflow corrected macrotimes
+    nanotimes: (ndarray of uint16)
+    release: (Callable) called by release to give the backing memory back to its pool, None if not pooled
+    """
+    __slots__ = ('detectors', 'timestamps', 'nanotimes', '_release')
+
+    def __init__(self, detectors: np.ndarray, timestamps: np.ndarray, nanotimes: np.ndarray,
+                 release: Callable = None):
+        self.detectors = detectors
+        self.timestamps = timestamps
+        self.nanotimes = nanotimes
+        self._release = release
+
+    @classmethod
+    def empty(cls, size: int = 0) -> 'PhotonChunk':
+        return cls(np.zeros((size,), dtype=np.uint8), np.zeros((size,), dtype=np.int64),
+                   np.zeros((size,), dtype=np.uint16))
+
+    @classmethod
+    def concatenate(cls, chunks: Iterable['PhotonChunk']) -> 'PhotonChunk':
+        chunks = list(chunks)
+        if len(chunks) == 0:
+            return cls.empty()
+        return cls(np.concatenate([chunk.detectors for chunk in chunks]),
+                   np.concatenate([chunk.timestamps for chunk in chunks]),
+                   np.concatenate([chunk.nanotimes for chunk in chunks]))
+
+    def __len__(self) -> int:
+        return self.detectors.size
+
+    def __getitem__(self, item: Union[slice, np.ndarray]) -> 'PhotonChunk':
+        """A slice gives views on the same memory (valid until release), a mask or indexes give a copy"""
+        return PhotonChunk(self.detectors[item], self.timestamps[item], self.nanotimes[item])
+
+    def copy(self) -> 'PhotonChunk':
+        return PhotonChunk(self.detectors.copy(), self.timestamps.copy(), self.nanotimes.copy())
+
+    def histograms(self, nbins: int, Nchannels: int = 2) -> np.ndarray:
+        """Nanotime histogram of each channel, shape (Nchannels, nbins), see nanotime_histograms"""
+        return nanotime_histograms(self.detectors, self.nanotimes, nbins, Nchannels)
+
+    def to_records(self) -> np.ndarray:
+        """The chunk as a single structured array, see processing.sharing.PHOTON_DTYPE"""
+        return pack_photons(self.detectors, self.timestamps, self.nanotimes)
+
+    def release(self):
+        """Give the backing memory back to its pool, the chunk (and its slices) should not be used anymore"""
+        if self._release is not None:
+            self._release()
+            self._release = None
+
+
+class BufferPool:
+    """Thread safe pool of preallocated buffers, a new one is allocated only if all of them are in use
+
+    Parameters
+    ----------
+    factory: (Callable) creates a new buffer
+    size: (int) number of buffers created at once
+    """
+    def __init__(self, factory: Callable, size: int = 4):
+        self._factory = factory
+        self._free = deque([factory() for _ in range(size)])
+        self._lock = Lock()
+        self.Nallocated = size
+
+    def acquire(self):
+        with self._lock:
+            if len(self._free) != 0:
+                return self._free.pop()
+            self.Nallocated += 1
+        return self._factory()
+
+    def release(self, buffer):
+        with self._lock:
+            self._free.append(buffer)
+
+
+def count_overflows(records: np.ndarray) -> int:
+    """Number of sync counter wraparounds signaled by the overflow records of a chunk"""
+    overflows = (records >> T3_CHANNEL_SHIFT) & 0x7F == OVERFLOW_DETECTOR
+    return int(np.sum(records[overflows] & (T3_WRAPAROUND - 1), dtype=np.int64))
+
+
+class T3Decoder:
+    """Decode the T3 records of a TimeHarp 260 into pooled PhotonChunk
+
+    The results are the same as the ones of phconvert.pqreader.process_t3records (with the _correct_overflow_nsync
+    correction) but for the macrotimes that keep increasing from one chunk to the next.
+
+    Parameters
+    ----------
+    capacity: (int) maximum number of records decoded at once without allocation
+    pool_size: (int) number of chunks that can be in use at the same time without allocation
+    """
+    def __init__(self, capacity: int = 2 ** 14, pool_size: int = 4):
+        self.capacity = capacity
+        self.macrotime_offset = 0  # overflow correction carried from one chunk to the next
+        self.pool = BufferPool(partial(PhotonChunk.empty, capacity), pool_size)
+        self._fields = np.zeros((capacity,), dtype=np.uint32)
+        self._overflows = np.zeros((capacity,), dtype=np.int64)
+
+    def decode(self, records: np.ndarray, out: PhotonChunk = None) -> PhotonChunk:
+        """Decode a chunk of records, the returned chunk should be released once processed
+
+        Parameters
+        ----------
+        records: (ndarray of uint32) the T3 records
+        out: (PhotonChunk) chunk of the same length as records in which the records are decoded (memory mapped
+             arrays...), default to a chunk of the pool
+        """
+        size = records.size
+        if size > self.capacity:  # not expected from the FIFO reads, decoded in new memory
+            fields = np.zeros((size,), dtype=np.uint32)
+            overflows = np.zeros((size,), dtype=np.int64)
+        else:
+            fields = self._fields[:size]
+            overflows = self._overflows[:size]
+        if out is not None:
+            chunk = out
+        elif size > self.capacity:
+            chunk = PhotonChunk.empty(size)
+        else:
+            block = self.pool.acquire()
+            chunk = PhotonChunk(block.detectors[:size], block.timestamps[:size], block.nanotimes[:size],
+                                release=partial(self.pool.release, block))
+
+        np.right_shift(records, T3_CHANNEL_SHIFT, out=fields)
+        np.bitwise_and(fields, 0x7F, out=fields)
+        chunk.detectors[:] = fields
+        np.right_shift(records, T3_DTIME_SHIFT, out=fields)
+        np.bitwise_and(fields, 0x7FFF, out=fields)
+        chunk.nanotimes[:] = fields
+        np.bitwise_and(records, T3_WRAPAROUND - 1, out=fields)
+        # the sync counter of an overflow record holds the number of overflows
+        np.multiply(fields, chunk.detectors == OVERFLOW_DETECTOR, out=overflows)
+        np.cumsum(overflows, out=overflows)
+        overflows *= T3_WRAPAROUND
+        overflows += self.macrotime_offset
+        np.add(fields, overflows, out=chunk.timestamps)
+        if size != 0:
+            self.macrotime_offset = int(overflows[-1])
+        return chunk
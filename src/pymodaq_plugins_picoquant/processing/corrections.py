@@ -0,0 +1,80 @@
+"""
+Pile-up and dead-time corrections of TCSPC histograms
+
+At high count rates, a photon detected within a sync period hides the later photons of the same period for the dead
+time of the channel, the histogram is then biased towards short times. Knowing the number of excitation cycles N_E
+(sync rate times the acquisition time), the probability to detect a photon in bin i is corrected by the number of
+cycles during which the channel was live at bin i (Coates, J. Phys. E 1, 878 (1968)):
+
+    n_i = -N_E * ln(1 - N_i / L_i)
+
+* classic Coates correction (dead time longer than the sync period): L_i = N_E - sum_{j<i} N_j
+* dead-time aware correction (Isbaner et al., Opt. Express 24, 9429 (2016)): only the photons detected within the
+  dead time before bin i, possibly at the end of the previous sync period, are removed from the live cycles
+"""
+import numpy as np
+
+
+PILEUP_METHODS = ['Coates', 'Dead-time']
+
+
+def live_cycles(histogram: np.ndarray, n_excitations: float, period_bins: int, dead_bins: int = None) \
+        -> np.ndarray:
+    """Number of excitation cycles during which the channel could detect a photon in each bin
+
+    Parameters
+    ----------
+    histogram: (ndarray) measured counts, bin 0 at the sync
+    n_excitations: (float) number of excitation cycles of the acquisition
+    period_bins: (int) number of bins within one sync period
+    dead_bins: (int) dead time in number of bins, None (or longer than the period) for the classic Coates correction
+
+    Returns
+    -------
+    ndarray: the live cycles, same shape as histogram
+    """
+    histogram = np.asarray(histogram, dtype=np.float64)
+    period_bins = max(1, int(period_bins))
+    if dead_bins is None or dead_bins >= period_bins:
+        blocked = np.concatenate(([0.], np.cumsum(histogram)[:-1]))
+    else:
+        dead_bins = max(0, int(dead_bins))
+        # one sync period, repeated so that the dead time of the previous period wraps around
+        period = np.zeros((period_bins,))
+        period[:min(period_bins, histogram.size)] = histogram[:period_bins]
+        cumulated = np.concatenate(([0.], np.cumsum(np.tile(period, 2))))
+        indexes = np.arange(histogram.size) % period_bins + period_bins
+        blocked = cumulated[indexes] - cumulated[indexes - dead_bins]
+    return n_excitations - blocked
+
+
+def correct_pileup(histogram: np.ndarray, n_excitations: float, resolution: float, sync_period: float,
+                   deadtime: float = None) -> np.ndarray:
+    """Pile-up (and dead-time) corrected histogram
+
+    Parameters
+    ----------
+    histogram: (ndarray) measured counts, bin 0 at the sync
+    n_excitations: (float) number of excitation cycles of the acquisition (sync rate times acquisition time)
+    resolution: (float) bin width in s
+    sync_period: (float) sync period in s
+    deadtime: (float) dead time of the channel in s, None for the classic Coates correction
+
+    Returns
+    -------
+    ndarray: the expected counts without pile-up, in the same units as histogram
+    """
+    if n_excitations <= 0:
+        return np.asarray(histogram, dtype=np.float64)
+    dead_bins = int(np.ceil(deadtime / resolution)) if deadtime is not None else None
+    live = live_cycles(histogram, n_excitations, int(round(sync_period / resolution)), dead_bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        probability = np.where(live > 0, np.asarray(histogram, dtype=np.float64) / live, 0.)
+    # a bin detected at each live cycle holds no information on the true rate, keep it finite
+    probability = np.clip(probability, 0., 1. - 1. / n_excitations)
+    return -n_excitations * np.log1p(-probability)
+
+
+def pileup_ratio(channel_rate: float, sync_rate: float) -> float:
+    """Mean number of detected photons per sync period, pile-up is usually neglected below a few %"""
+    return channel_rate / sync_rate if sync_rate > 0 else 0.
@@ -0,0 +1,93 @@
+"""
+Selection of the decoded TTTR records before they are stored or processed
+
+The detectors array returned by the T3 decoding follows the phconvert convention:
+
+* 0 <= detector < 64: a photon on the corresponding input channel
+* 65 <= detector <= 79: a marker event (65 => Marker 1...)
+* 127: an overflow record, only needed for the macrotime correction which is already applied once decoded
+"""
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+
+OVERFLOW_DETECTOR = 127
+MARKER_OFFSET = 64
+NANOTIME_BITS = 15
+MAX_CHANNELS = 2  # number of input channels of a Timeharp 260
+
+
+def parse_gates(gates: str) -> List[Tuple[float, float]]:
+    """Parse a string of time windows such as '0-10, 20.5-30' into a list of (start, stop) tuples"""
+    windows = []
+    for window in gates.replace(';', ',').split(','):
+        if window.strip() != '':
+            start, stop = window.split('-')
+            windows.append((float(start), float(stop)))
+    return windows
+
+
+class PhotonFilter:
+    """Vectorized selection of decoded T3 records
+
+    The selection is done using two lookup tables, one over the detector code and one over the nanotime bins, so
+    that its cost is two gathers and a few boolean operations per record whatever the number of gates.
+
+    Parameters
+    ----------
+    channels: (Iterable[int]) indexes of the input channels whose photons are kept
+    gates: (Iterable[tuple]) list of (start, stop) nanotime windows (in nanotime bins, stop excluded) in which photons
+           are kept. If empty, all nanotimes are kept
+    pass_markers: (bool) if True marker records are kept
+    drop_overflows: (bool) if True overflow records are removed (overflow correction must have been applied)
+    """
+    def __init__(self, channels: Iterable[int] = (0, 1), gates: Iterable[Tuple[int, int]] = (),
+                 pass_markers: bool = True, drop_overflows: bool = True):
+        self.channels = list(channels)
+        self.gates = list(gates)
+        self.pass_markers = pass_markers
+        self.drop_overflows = drop_overflows
+
+        self._detector_lut = np.zeros((2 * MARKER_OFFSET,), dtype=bool)
+        self._detector_lut[self.channels] = True
+        if pass_markers:
+            self._detector_lut[MARKER_OFFSET + 1:OVERFLOW_DETECTOR] = True
+        self._detector_lut[OVERFLOW_DETECTOR] = not drop_overflows
+        self._photon_lut = np.zeros((2 * MARKER_OFFSET,), dtype=bool)
+        self._photon_lut[:MARKER_OFFSET] = True
+
+        self._gate_lut: np.ndarray = None
+        if len(self.gates) != 0:
+            self._gate_lut = np.zeros((2 ** NANOTIME_BITS,), dtype=bool)
+            for start, stop in self.gates:
+                self._gate_lut[max(0, int(start)):max(0, int(stop))] = True
+
+    @classmethod
+    def from_nanoseconds(cls, resolution: float, channels: Iterable[int] = (0, 1),
+                         gates: Iterable[Tuple[float, float]] = (), **kwargs) -> 'PhotonFilter':
+        """Create a filter whose gates are given in ns, resolution is the nanotime bin width in ns"""
+        return cls(channels, [(int(np.floor(start / resolution)), int(np.ceil(stop / resolution)))
+                              for start, stop in gates], **kwargs)
+
+    @property
+    def active(self) -> bool:
+        """False if the filter would keep every record"""
+        return (self._gate_lut is not None or not self.pass_markers or self.drop_overflows
+                or not set(range(MAX_CHANNELS)).issubset(self.channels))
+
+    def mask(self, detectors: np.ndarray, nanotimes: np.ndarray) -> np.ndarray:
+        """Boolean mask of the records to keep"""
+        keep = self._detector_lut[detectors]
+        if self._gate_lut is not None:
+            keep &= self._gate_lut[nanotimes] | ~self._photon_lut[detectors]
+        return keep
+
+    def __call__(self, detectors: np.ndarray, timestamps: np.ndarray, nanotimes: np.ndarray) \
+            -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        keep = self.mask(detectors, nanotimes)
+        return detectors[keep], timestamps[keep], nanotimes[keep]
+
+    def apply(self, chunk):
+        """Selected records of a PhotonChunk, as a new (not pooled) chunk"""
+        return chunk[self.mask(chunk.detectors, chunk.nanotimes)]
@@ -0,0 +1,353 @@
+"""
+FLIM cubes built from decoded T3 records, a marker record separating the pixels
+
+The convention is the one of DAQ_1DViewer_TH260.extract_TTTR_histo_every_pixels: the photons detected between the
+n-th and (n+1)-th markers belong to the pixel ix = (n // Ny) % Nx, iy = n % Ny, the photons before the first marker
+are ignored. The pixel index is carried from one chunk to the next so that the records can be processed in any chunks.
+
+FlimAccumulator holds the whole cube in memory, TiledFlimAccumulator holds only the band of lines being scanned and
+saves the cube tile by tile into a chunked FlimStore (HDF5 or zarr) so that large mosaics may exceed the memory.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock
+from typing import Tuple, Union
+
+import h5py
+import numpy as np
+
+try:
+    import zarr
+except ImportError:  # zarr stores are optional, HDF5 is always available
+    zarr = None
+
+
+class FlimAccumulator:
+    """Nanotime histogram of each pixel, shape (Nx, Ny, nbins)
+
+    Parameters
+    ----------
+    Nx: (int) number of pixels along x
+    Ny: (int) number of pixels along y (the fast axis)
+    nbins: (int) number of nanotime bins, larger nanotimes are ignored
+    marker: (int) detector code of the marker starting a new pixel (65 for Marker 1)
+    channel: (int) index of the input channel whose photons are histogrammed
+    """
+    def __init__(self, Nx: int, Ny: int, nbins: int, marker: int = 65, channel: int = 0):
+        self.Nx = Nx
+        self.Ny = Ny
+        self.nbins = nbins
+        self.marker = marker
+        self.channel = channel
+        self.cube = np.zeros((Nx, Ny, nbins), dtype=np.uint32)
+        self.ind_pixel = -1  # index (not wrapped) of the current pixel, -1 before the first marker
+
+    @property
+    def Nmarkers(self) -> int:
+        return self.ind_pixel + 1
+
+    @property
+    def intensity(self) -> np.ndarray:
+        """Number of photons of each pixel, shape (Nx, Ny)"""
+        return self.cube.sum(axis=-1, dtype=np.int64)
+
+    def _photon_pixels(self, detectors: np.ndarray, nanotimes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Pixel index (not wrapped) and nanotime of the histogrammed photons of a chunk, updates ind_pixel"""
+        pixels = np.cumsum(detectors == self.marker, dtype=np.int64)
+        pixels += self.ind_pixel
+        self.ind_pixel = int(pixels[-1])
+        keep = (detectors == self.channel) & (nanotimes < self.nbins) & (pixels >= 0)
+        return pixels[keep], nanotimes[keep]
+
+    def add(self, detectors: np.ndarray, nanotimes: np.ndarray):
+        if detectors.size == 0:
+            return
+        pixels, nanotimes = self._photon_pixels(detectors, nanotimes)
+        indexes, counts = np.unique(pixels % (self.Nx * self.Ny) * self.nbins + nanotimes, return_counts=True)
+        self.cube.reshape((-1,))[indexes] += counts.astype(np.uint32)
+
+
+class FlimStore:
+    """FLIM cube (Nx, Ny, nbins) of integer counts saved on disk by tiles, written concurrently by worker threads
+
+    The cube is a zarr array (directory store) if the path ends with .zarr (zarr is an optional dependency), else a
+    chunked HDF5 dataset (h5py serializes the writes of the workers). Each tile (tile_x, tile_y, nbins) is a chunk of
+    the array so that viewers can load the tiles lazily.
+
+    Parameters
+    ----------
+    path: (str or Path) the .zarr directory or the h5 file (created, or opened in append mode)
+    Nx: (int) number of pixels along x
+    Ny: (int) number of pixels along y (the fast axis)
+    nbins: (int) number of nanotime bins
+    tile: (tuple) number of pixels of a tile along x and y, default to 16 lines of Ny pixels
+    dtype: (numpy dtype) uint16 or uint32 counts
+    dataset: (str) name of the dataset within the h5 file
+    Nworkers: (int) number of threads writing the tiles
+    """
+    def __init__(self, path: Union[str, Path], Nx: int, Ny: int, nbins: int, tile: Tuple[int, int] = (16, None),
+                 dtype=np.uint32, dataset: str = 'flim', Nworkers: int = 4):
+        self.path = Path(path)
+        self.shape = (Nx, Ny, nbins)
+        self.tile = (min(Nx, tile[0] if tile[0] is not None else 16), min(Ny, tile[1] if tile[1] is not None else Ny))
+        self.dtype = np.dtype(dtype)
+        self._file: h5py.File = None
+        self._lock = Lock()
+        if self.path.suffix == '.zarr':
+            if zarr is None:
+                raise ImportError('zarr is needed to save FLIM cubes as .zarr')
+            self.array = zarr.open_array(store=str(self.path), mode='w', shape=self.shape,
+                                         chunks=self.tile + (nbins,), dtype=self.dtype, fill_value=0)
+        else:
+            self._file = h5py.File(self.path, 'a')
+            if dataset in self._file:
+                del self._file[dataset]
+            self.array = self._file.create_dataset(dataset, shape=self.shape, chunks=self.tile + (nbins,),
+                                                   dtype=self.dtype, fillvalue=0, compression='gzip',
+                                                   compression_opts=1)
+        self._executor = ThreadPoolExecutor(Nworkers)
+        self._pending = {}  # the last write of each tile, the next write of a tile waits for it
+
+    def _write(self, x0: int, y0: int, tile: np.ndarray, add: bool):
+        region = (slice(x0, x0 + tile.shape[0]), slice(y0, y0 + tile.shape[1]))
+        if self._file is not None:
+            with self._lock:
+                self._write_region(region, tile, add)
+        else:  # each tile is a separate chunk file, written without lock
+            self._write_region(region, tile, add)
+
+    def _write_region(self, region: Tuple[slice, slice], tile: np.ndarray, add: bool):
+        if add:
+            tile = tile + self.array[region]
+        self.array[region] = np.minimum(tile, np.iinfo(self.dtype).max).astype(self.dtype)
+
+    def write_tile(self, x0: int, y0: int, tile: np.ndarray, add: bool = False) -> Future:
+        """Write (or add to the saved counts if add is True) a tile whose first pixel is (x0, y0), asynchronously
+
+        Counts above the maximum of the dtype are saturated.
+        """
+        previous = self._pending.get((x0, y0), None)
+        if previous is not None:
+            previous.result()
+        future = self._executor.submit(self._write, x0, y0, tile, add)
+        self._pending[(x0, y0)] = future
+        return future
+
+    def read(self, x: slice = slice(None), y: slice = slice(None)) -> np.ndarray:
+        """Read a region of the cube, only the tiles it overlaps are loaded"""
+        self.flush()
+        return self.array[x, y]
+
+    def flush(self):
+        """Wait for the pending writes (the exceptions of the workers are raised here)"""
+        for future in list(self._pending.values()):
+            future.result()
+        self._pending = {}
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class TiledFlimAccumulator(FlimAccumulator):
+    """FlimAccumulator keeping in memory only the band of tile_x lines being scanned
+
+    A band is written into the store (its tiles concurrently) as soon as the markers reach the next one, so that the
+    cube may be larger than the memory. If the scan is repeated (more than Nx * Ny markers), the counts of the next
+    frames are added to the saved ones.
+
+    Parameters
+    ----------
+    store: (FlimStore) where the cube is saved, its shape gives Nx, Ny and nbins
+    marker: (int) detector code of the marker starting a new pixel (65 for Marker 1)
+    channel: (int) index of the input channel whose photons are histogrammed
+    """
+    def __init__(self, store: FlimStore, marker: int = 65, channel: int = 0):
+        self.store = store
+        self.Nx, self.Ny, self.nbins = store.shape
+        self.marker = marker
+        self.channel = channel
+        self.tile_x = store.tile[0]
+        self.Nbands = -(-self.Nx // self.tile_x)
+        self.ind_pixel = -1
+        self.band: np.ndarray = None
+        self.ind_band = -1  # index (frame * Nbands + band) of the band in memory
+        self._intensity = np.zeros((self.Nx, self.Ny), dtype=np.int64)
+
+    @property
+    def cube(self) -> np.ndarray:
+        """The whole cube read back from the store (see FlimStore.read to load only a region)"""
+        return self.store.read()
+
+    @property
+    def intensity(self) -> np.ndarray:
+        return self._intensity.copy()
+
+    def _band_indexes(self, pixels: np.ndarray) -> np.ndarray:
+        frames, wrapped = np.divmod(pixels, self.Nx * self.Ny)
+        return frames * self.Nbands + wrapped // (self.tile_x * self.Ny)
+
+    def _flush_band(self):
+        if self.band is None:
+            return
+        frame, band = divmod(self.ind_band, self.Nbands)
+        x0 = band * self.tile_x
+        self._intensity[x0:x0 + self.band.shape[0]] += self.band.sum(axis=-1, dtype=np.int64)
+        for y0 in range(0, self.Ny, self.store.tile[1]):
+            self.store.write_tile(x0, y0, self.band[:, y0:y0 + self.store.tile[1]], add=frame > 0)
+        self.band = None
+
+    def add(self, detectors: np.ndarray, nanotimes: np.ndarray):
+        if detectors.size == 0:
+            return
+        pixels, nanotimes = self._photon_pixels(detectors, nanotimes)
+        bands = self._band_indexes(pixels)
+        starts = np.flatnonzero(np.diff(bands, prepend=-1))  # photons are ordered, so are their bands
+        for start, stop in zip(starts, np.append(starts[1:], bands.size)):
+            if bands[start] != self.ind_band:
+                self._flush_band()
+                self.ind_band = int(bands[start])
+                x0 = self.ind_band % self.Nbands * self.tile_x
+                self.band = np.zeros((min(self.tile_x, self.Nx - x0), self.Ny, self.nbins), dtype=np.uint32)
+            indexes = (pixels[start:stop] % (self.Nx * self.Ny) - self.ind_band % self.Nbands * self.tile_x * self.Ny) \
+                * self.nbins + nanotimes[start:stop]
+            indexes, counts = np.unique(indexes, return_counts=True)
+            self.band.reshape((-1,))[indexes] += counts.astype(np.uint32)
+        if self.ind_pixel >= 0 and self._band_indexes(np.array([self.ind_pixel]))[0] > self.ind_band:
+            self._flush_band()  # the scan moved to the next band
+
+    def close(self):
+        """Write the last band and wait for all the writes"""
+        self._flush_band()
+        self.store.flush()
+
+
+class SparseFlimAccumulator(FlimAccumulator):
+    """FlimAccumulator keeping only the non empty (pixel, nanotime) bins
+
+    The counts are held as sorted linear indexes (pixel * nbins + nanotime, the pixel being ix * Ny + iy) with their
+    counts, the indexes of the chunks being merged once they outnumber the non empty bins. Memory and file sizes then
+    scale with the number of photons instead of the volume of the cube. to_csr gives the CSR arrays over
+    pixel x nanotime and tile a dense region on demand.
+
+    Parameters
+    ----------
+    Nx: (int) number of pixels along x
+    Ny: (int) number of pixels along y (the fast axis)
+    nbins: (int) number of nanotime bins, larger nanotimes are ignored
+    marker: (int) detector code of the marker starting a new pixel (65 for Marker 1)
+    channel: (int) index of the input channel whose photons are histogrammed
+    """
+    def __init__(self, Nx: int, Ny: int, nbins: int, marker: int = 65, channel: int = 0):
+        self.Nx = Nx
+        self.Ny = Ny
+        self.nbins = nbins
+        self.marker = marker
+        self.channel = channel
+        self.ind_pixel = -1
+        self._indexes = np.zeros((0,), dtype=np.int64)
+        self._counts = np.zeros((0,), dtype=np.uint32)
+        self._pending = []  # (indexes, counts) of the chunks not merged yet
+        self._Npending = 0
+
+    @staticmethod
+    def _merge(indexes: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if indexes.size == 0:
+            return indexes, counts
+        order = np.argsort(indexes, kind='stable')
+        indexes, counts = indexes[order], counts[order]
+        starts = np.flatnonzero(np.diff(indexes, prepend=-1))
+        return indexes[starts], np.add.reduceat(counts, starts).astype(np.uint32)
+
+    def compact(self):
+        """Merge the pending chunks into the sorted non empty bins"""
+        if len(self._pending) == 0:
+            return
+        self._indexes, self._counts = self._merge(
+            np.concatenate([self._indexes] + [indexes for indexes, _ in self._pending]),
+            np.concatenate([self._counts] + [counts for _, counts in self._pending]))
+        self._pending = []
+        self._Npending = 0
+
+    def add(self, detectors: np.ndarray, nanotimes: np.ndarray):
+        if detectors.size == 0:
+            return
+        pixels, nanotimes = self._photon_pixels(detectors, nanotimes)
+        indexes, counts = np.unique(pixels % (self.Nx * self.Ny) * self.nbins + nanotimes, return_counts=True)
+        self._pending.append((indexes, counts.astype(np.uint32)))
+        self._Npending += indexes.size
+        if self._Npending > max(self._indexes.size, 2 ** 20):
+            self.compact()
+
+    @property
+    def nnz(self) -> int:
+        """Number of non empty bins"""
+        self.compact()
+        return self._indexes.size
+
+    def coo(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The non empty bins as (pixels, nanotimes, counts), sorted by pixel then nanotime"""
+        self.compact()
+        pixels, nanotimes = np.divmod(self._indexes, self.nbins)
+        return pixels, nanotimes.astype(np.uint16), self._counts
+
+    def to_csr(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """CSR arrays over pixel x nanotime: indptr (Nx * Ny + 1), nanotimes and counts of the non empty bins"""
+        pixels, nanotimes, counts = self.coo()
+        return np.searchsorted(pixels, np.arange(self.Nx * self.Ny + 1)), nanotimes, counts
+
+    @property
+    def intensity(self) -> np.ndarray:
+        pixels, _, counts = self.coo()
+        return np.bincount(pixels, weights=counts, minlength=self.Nx * self.Ny).astype(np.int64).reshape(
+            (self.Nx, self.Ny))
+
+    def tile(self, x: slice = slice(None), y: slice = slice(None)) -> np.ndarray:
+        """Dense counts of a region of the cube, shape (len(x), len(y), nbins)"""
+        pixels, nanotimes, counts = self.coo()
+        xs, ys = np.arange(self.Nx)[x], np.arange(self.Ny)[y]
+        positions = np.full((self.Ny,), -1)  # position of each y within the tile, -1 if not in the tile
+        positions[ys] = np.arange(ys.size)
+        dense = np.zeros((xs.size, ys.size, self.nbins), dtype=np.uint32)
+        for ind_x, ix in enumerate(xs):  # the bins of a line are contiguous
+            start, stop = np.searchsorted(pixels, [ix * self.Ny, (ix + 1) * self.Ny])
+            line_positions = positions[pixels[start:stop] - ix * self.Ny]
+            keep = line_positions >= 0
+            dense[ind_x, line_positions[keep], nanotimes[start:stop][keep]] = counts[start:stop][keep]
+        return dense
+
+    @property
+    def cube(self) -> np.ndarray:
+        """The whole dense cube (see tile to convert only a region)"""
+        return self.tile()
+
+    def save(self, path: Union[str, Path], group: str = 'flim_sparse'):
+        """Save the CSR arrays (indptr, nanotimes, counts) and the shape in a group of an h5 file"""
+        indptr, nanotimes, counts = self.to_csr()
+        with h5py.File(path, 'a') as h5file:
+            if group in h5file:
+                del h5file[group]
+            h5group = h5file.create_group(group)
+            h5group.attrs['shape'] = (self.Nx, self.Ny, self.nbins)
+            h5group.attrs['marker'] = self.marker
+            h5group.attrs['channel'] = self.channel
+            h5group.create_dataset('indptr', data=indptr, compression='gzip', compression_opts=1)
+            h5group.create_dataset('nanotimes', data=nanotimes, compression='gzip', compression_opts=1)
+            h5group.create_dataset('counts', data=counts, compression='gzip', compression_opts=1)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], group: str = 'flim_sparse') -> 'SparseFlimAccumulator':
+        with h5py.File(path, 'r') as h5file:
+            h5group = h5file[group]
+            Nx, Ny, nbins = (int(size) for size in h5group.attrs['shape'])
+            flim = cls(Nx, Ny, nbins, int(h5group.attrs['marker']), int(h5group.attrs['channel']))
+            indptr = h5group['indptr'][:]
+            flim._indexes = np.repeat(np.arange(Nx * Ny, dtype=np.int64), np.diff(indptr)) * nbins + \
+                h5group['nanotimes'][:]
+            flim._counts = h5group['counts'][:]
+        return flim
@@ -0,0 +1,197 @@
+"""
+Lightweight instrumentation of the acquisition pipeline (FIFO reading, decoding, saving, histograms)
+
+Every stage of the pipeline reports its latency and a few counters into an AcquisitionMetrics object. The
+collected values can be displayed in the plugin settings or dumped as JSON or as a Prometheus text file.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Union
+
+import numpy as np
+
+
+class Log2Histogram:
+    """Histogram with logarithmic (power of 2) buckets
+
+    Adding a value is a couple of integer operations so that it can be used within the hot loops
+
+    Parameters
+    ----------
+    unit: (float) value of the first bucket upper bound, default to 1µs for latencies in seconds
+    """
+    Nbuckets = 32  # 1µs up to ~35 min for latencies
+
+    def __init__(self, unit: float = 1e-6):
+        self.unit = unit
+        self.buckets = np.zeros((self.Nbuckets,), dtype=np.uint64)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, value: float):
+        self.buckets[min(int(value / self.unit).bit_length(), self.Nbuckets - 1)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count != 0 else 0.
+
+    def upper_bounds(self) -> np.ndarray:
+        """Upper bound of each bucket"""
+        return 2. ** np.arange(self.Nbuckets) * self.unit
+
+    def percentile(self, perc: float) -> float:
+        """Approximated percentile (upper bound of the bucket holding it)"""
+        if self.count == 0:
+            return 0.
+        ind = int(np.searchsorted(np.cumsum(self.buckets), perc / 100 * self.count))
+        return min(float(self.upper_bounds()[min(ind, self.Nbuckets - 1)]), self.max)
+
+    def to_dict(self) -> dict:
+        return dict(count=self.count, total=self.total, mean=self.mean, max=self.max,
+                    p50=self.percentile(50), p99=self.percentile(99),
+                    buckets=self.buckets.tolist())
+
+
+class GilProbe(threading.Thread):
+    """Estimate of the time other threads wait for the GIL (or for the OS scheduler)
+
+    The probe thread sleeps for a fixed interval and records how late it wakes up. When the decoding or saving stages
+    hold the GIL for long periods, this lateness grows and so will the latency of the FIFO reading loop.
+    """
+    def __init__(self, metrics: 'AcquisitionMetrics', interval: float = 0.005):
+        super().__init__(daemon=True, name='gil_probe')
+        self.metrics = metrics
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            tstart = time.perf_counter()
+            time.sleep(self.interval)
+            self.metrics.add_latency('gil_wait', max(0., time.perf_counter() - tstart - self.interval))
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class AcquisitionMetrics:
+    """Thread safe collection of per stage latencies, counters and gauges of one acquisition
+
+    Parameters
+    ----------
+    gil_probe: (bool) if True, start a GilProbe thread while the acquisition is running
+    """
+    def __init__(self, gil_probe: bool = False):
+        self._lock = threading.Lock()
+        self.use_gil_probe = gil_probe
+        self._gil_probe: GilProbe = None
+        self.latencies: Dict[str, Log2Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, float] = {}
+        self.fifo_reads = Log2Histogram(unit=1)  # number of records returned by each ReadFiFo
+        self.tstart = time.perf_counter()
+        self.tstop: float = None
+
+    def start(self):
+        """Reset all values and start a new run"""
+        self.stop()
+        with self._lock:
+            self.latencies = {}
+            self.counters = {}
+            self.gauges = {}
+            self.fifo_reads = Log2Histogram(unit=1)
+            self.tstart = time.perf_counter()
+            self.tstop = None
+        if self.use_gil_probe:
+            self._gil_probe = GilProbe(self)
+            self._gil_probe.start()
+
+    def stop(self):
+        if self._gil_probe is not None:
+            self._gil_probe.stop()
+            self._gil_probe = None
+        self.tstop = time.perf_counter()
+
+    @property
+    def duration(self) -> float:
+        tstop = self.tstop if self.tstop is not None else time.perf_counter()
+        return tstop - self.tstart
+
+    @contextmanager
+    def time(self, stage: str):
+        """Context manager recording the latency of the enclosed block under the name stage"""
+        tstart = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_latency(stage, time.perf_counter() - tstart)
+
+    def add_latency(self, stage: str, seconds: float):
+        with self._lock:
+            if stage not in self.latencies:
+                self.latencies[stage] = Log2Histogram()
+            self.latencies[stage].add(seconds)
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe_fifo_read(self, nrecords: int):
+        """Register the number of records returned by one TH260_ReadFiFo call"""
+        with self._lock:
+            self.fifo_reads.add(nrecords)
+            self.counters['fifo_reads'] = self.counters.get('fifo_reads', 0) + 1
+            self.counters['records'] = self.counters.get('records', 0) + int(nrecords)
+
+    def rate(self, counter: str) -> float:
+        """Mean rate per second of a given counter since the start of the run"""
+        duration = self.duration
+        return self.counters.get(counter, 0) / duration if duration > 0 else 0.
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return dict(duration=self.duration,
+                        records_per_s=self.counters.get('records', 0) / self.duration if self.duration > 0 else 0.,
+                        counters=dict(self.counters),
+                        gauges=dict(self.gauges),
+                        fifo_read_sizes=self.fifo_reads.to_dict(),
+                        latencies={stage: hist.to_dict() for stage, hist in self.latencies.items()})
+
+    def to_json(self, path: Union[str, Path], **metadata):
+        """Dump all metrics (and optional extra metadata) as a json file"""
+        metrics = self.to_dict()
+        metrics['metadata'] = metadata
+        Path(path).write_text(json.dumps(metrics, indent=2))
+
+    def to_prometheus(self, path: Union[str, Path], prefix: str = 'th260'):
+        """Dump all metrics in the Prometheus text exposition format (for instance for a node exporter textfile
+        collector)"""
+        metrics = self.to_dict()
+        lines = [f'# TYPE {prefix}_records_per_second gauge',
+                 f'{prefix}_records_per_second {metrics["records_per_s"]}']
+        for name, value in metrics['counters'].items():
+            lines += [f'# TYPE {prefix}_{name}_total counter', f'{prefix}_{name}_total {value}']
+        for name, value in metrics['gauges'].items():
+            lines += [f'# TYPE {prefix}_{name} gauge', f'{prefix}_{name} {value}']
+        bounds = Log2Histogram().upper_bounds()
+        lines.append(f'# TYPE {prefix}_stage_latency_seconds histogram')
+        for stage, hist in metrics['latencies'].items():
+            cumulated = np.cumsum(hist['buckets'])
+            for bound, count in zip(bounds, cumulated):
+                lines.append(f'{prefix}_stage_latency_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {count}')
+            lines.append(f'{prefix}_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist["count"]}')
+            lines.append(f'{prefix}_stage_latency_seconds_sum{{stage="{stage}"}} {hist["total"]}')
+            lines.append(f'{prefix}_stage_latency_seconds_count{{stage="{stage}"}} {hist["count"]}')
+        Path(path).write_text('\n'.join(lines) + '\n')
@@ -0,0 +1,110 @@
+"""
+Parallel decoding of large raw T3 captures (records.bin of a FIFO capture, see hardware.picoquant.replay)
+
+The overflow correction makes the macrotime of a record depend on all the records before it. The file is then split
+into chunks processed in two parallel passes:
+
+* the number of sync counter wraparounds of each chunk is counted, the macrotime offset of a chunk being the prefix
+  sum of the counts of the previous ones
+* each chunk is decoded with its offset by a worker process, directly into memory mapped .npy outputs
+
+Only the chunk bounds and offsets are exchanged between the processes, the records and the decoded photons go through
+the page cache. On windows, the functions of this module should be called under an if __name__ == '__main__' guard.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from pymodaq_plugins_picoquant.processing.chunks import PhotonChunk, T3Decoder, T3_WRAPAROUND, count_overflows
+
+
+RAW_RECORDS = 'records.bin'
+OUTPUT_FIELDS = ('detectors', 'timestamps', 'nanotimes')
+OUTPUT_DTYPES = (np.uint8, np.int64, np.uint16)
+
+
+def records_path(path: Union[str, Path]) -> Path:
+    """The raw records file of a capture folder, or path itself if it is a file"""
+    path = Path(path)
+    return path.joinpath(RAW_RECORDS) if path.is_dir() else path
+
+
+def open_records(path: Union[str, Path], offset: int = 0) -> np.ndarray:
+    """Read only memory map of the uint32 records of a file, offset being the size in bytes of its header"""
+    return np.memmap(path, dtype='<u4', mode='r', offset=offset)
+
+
+def chunk_bounds(Nrecords: int, chunk_size: int) -> List[Tuple[int, int]]:
+    return [(start, min(start + chunk_size, Nrecords)) for start in range(0, Nrecords, chunk_size)]
+
+
+def _count_chunk(path: str, offset: int, bounds: Tuple[int, int], block_size: int) -> int:
+    records = open_records(path, offset)
+    start, stop = bounds
+    return sum([count_overflows(records[ind:min(ind + block_size, stop)])
+                for ind in range(start, stop, block_size)])
+
+
+def _decode_chunk(path: str, offset: int, output_paths: List[str], bounds: Tuple[int, int],
+                  macrotime_offset: int, block_size: int) -> int:
+    records = open_records(path, offset)
+    outputs = PhotonChunk(*[np.load(output_path, mmap_mode='r+') for output_path in output_paths])
+    decoder = T3Decoder(block_size, pool_size=0)
+    decoder.macrotime_offset = macrotime_offset
+    start, stop = bounds
+    for ind in range(start, stop, block_size):
+        end = min(ind + block_size, stop)
+        decoder.decode(records[ind:end], out=outputs[ind:end])
+    for array in (outputs.detectors, outputs.timestamps, outputs.nanotimes):
+        array.flush()
+    return stop - start
+
+
+def decode_file(path: Union[str, Path], output_folder: Union[str, Path] = None, Nworkers: int = None,
+                chunk_size: int = 2 ** 22, offset: int = 0, block_size: int = 2 ** 16) -> PhotonChunk:
+    """Decode a raw T3 records file in parallel
+
+    Parameters
+    ----------
+    path: (str or Path) the records file or a capture folder
+    output_folder: (str or Path) where the decoded arrays are saved as detectors.npy, timestamps.npy and
+                   nanotimes.npy, default to a {file name}_decoded folder next to the records
+    Nworkers: (int) number of worker processes, default to the number of cores, 1 to decode in this process
+    chunk_size: (int) number of records processed by a worker at once
+    offset: (int) size in bytes of the header preceding the records
+    block_size: (int) number of records decoded at once by a worker (bounds its memory use)
+
+    Returns
+    -------
+    PhotonChunk: the read only memory mapped outputs, the same as the decoding of the whole file by a T3Decoder
+    """
+    path = records_path(path)
+    output_folder = Path(output_folder) if output_folder is not None else \
+        path.parent.joinpath(f'{path.stem}_decoded')
+    output_folder.mkdir(parents=True, exist_ok=True)
+    Nrecords = max(0, path.stat().st_size - offset) // 4
+    if Nrecords == 0:
+        return PhotonChunk.empty()
+
+    output_paths = [str(output_folder.joinpath(f'{field}.npy')) for field in OUTPUT_FIELDS]
+    for output_path, dtype in zip(output_paths, OUTPUT_DTYPES):
+        output = np.lib.format.open_memmap(output_path, mode='w+', dtype=dtype, shape=(Nrecords,))
+        del output  # the file is created with its final size, filled by the workers
+
+    bounds = chunk_bounds(Nrecords, chunk_size)
+    Nworkers = os.cpu_count() if Nworkers is None else Nworkers
+    executor = ProcessPoolExecutor(min(Nworkers, len(bounds))) if Nworkers > 1 and len(bounds) > 1 else None
+    mapper = executor.map if executor is not None else map
+    try:
+        counts = list(mapper(_count_chunk, repeat(str(path)), repeat(offset), bounds, repeat(block_size)))
+        offsets = np.concatenate(([0], np.cumsum(counts, dtype=np.int64)[:-1])) * T3_WRAPAROUND
+        list(mapper(_decode_chunk, repeat(str(path)), repeat(offset), repeat(output_paths), bounds,
+                    [int(macrotime_offset) for macrotime_offset in offsets], repeat(block_size)))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return PhotonChunk(*[np.load(output_path, mmap_mode='r') for output_path in output_paths])
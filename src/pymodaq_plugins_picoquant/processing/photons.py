@@ -0,0 +1,164 @@
+"""
+Lazy access to the photons saved during a T3 acquisition
+
+The photons are appended chunk after chunk in the temporary h5 file of the plugin, already ordered in time (the
+overflow correction is carried from one chunk to the next), so that they never have to be loaded (or sorted) at once.
+At the end of an acquisition the file is kept on disk and T3PhotonFile gives a read-only view of its content, reading
+only the requested slices.
+
+A file may hold the photons of several consecutive acquisitions (the steps of a scan), stored one after the other. The
+steps table gives for each of them its first photon, number of photons, first and last macrotimes and the scan
+coordinates, so that the photons of a step (or of a range of consecutive steps) are read with a single slice.
+"""
+from pathlib import Path
+from typing import Iterator, Tuple, Union
+
+import h5py
+import numpy as np
+
+
+PHOTONS_GROUP = '/RawData/myphotons/DataND/CH00'
+STEPS_GROUP = '/RawData/mysteps/Data0D'
+STEP_FIELDS = ('first_photon', 'Nphotons', 'start_macrotime', 'stop_macrotime')
+MAX_POSITIONS = 4  # number of scan coordinates saved for each step
+STEP_DTYPE = np.dtype([(field, '<i8') for field in STEP_FIELDS] + [('positions', '<f8', (MAX_POSITIONS,))])
+
+
+class T3PhotonFile:
+    """Read-only handle on the photons of an h5 file saved by the TH260 plugin in T3 mode
+
+    Parameters
+    ----------
+    path: (str or Path) the h5 file
+    group: (str) the h5 group holding the photons
+    """
+    def __init__(self, path: Union[str, Path], group: str = PHOTONS_GROUP):
+        self.path = Path(path)
+        self.group = group
+        self._file: h5py.File = None
+        self._steps: np.ndarray = None
+
+    def open(self) -> 'T3PhotonFile':
+        if self._file is None:
+            self._file = h5py.File(self.path, 'r')
+        return self
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._steps = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _dataset(self, label: str, group: str = None) -> h5py.Dataset:
+        self.open()
+        group = self.group if group is None else group
+        if group not in self._file:
+            raise KeyError(f'No {group} saved in {self.path}')
+        if label == 'timestamps':
+            return self._file[group]['Axis00']
+        for name, dataset in self._file[group].items():
+            # attributes are serialized by pymodaq, the label is within the string
+            if name.startswith('EnlData') and f"'{label}'" in str(dataset.attrs.get('label', '')):
+                return dataset
+        raise KeyError(f'No {label} saved in {self.path}')
+
+    def __len__(self) -> int:
+        try:
+            return self._dataset('timestamps').shape[0]
+        except KeyError:
+            return 0
+
+    def read(self, start: int = 0, stop: int = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Read a slice of photons
+
+        Returns
+        -------
+        ndarray: detectors
+        ndarray: timestamps (macrotimes)
+        ndarray: nanotimes
+        """
+        return (self._dataset('detectors')[start:stop, 0],
+                self._dataset('timestamps')[start:stop].astype(np.int64),
+                self._dataset('nanotimes')[start:stop, 0])
+
+    def iter_chunks(self, chunk_size: int = 1000000) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Iterate over the photons by chunks of chunk_size photons, see read"""
+        for start in range(0, len(self), chunk_size):
+            yield self.read(start, start + chunk_size)
+
+    def searchsorted(self, timestamp: int) -> int:
+        """Index of the first photon detected at or after timestamp (bisection reading a single element per step)
+
+        Overflow records, if they were not dropped by the photon filter, do not hold a valid macrotime and may make
+        the result off by a few records.
+        """
+        timestamps = self._dataset('timestamps')
+        low, high = 0, timestamps.shape[0]
+        while low < high:
+            middle = (low + high) // 2
+            if timestamps[middle] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def histogram(self, nbins: int, Nchannels: int = 2, chunk_size: int = 1000000) -> np.ndarray:
+        """Nanotime histogram of each channel computed chunk by chunk, shape (Nchannels, nbins)"""
+        histograms = np.zeros((Nchannels, nbins), dtype=np.int64)
+        for detectors, _, nanotimes in self.iter_chunks(chunk_size):
+            histograms += nanotime_histograms(detectors, nanotimes, nbins, Nchannels)
+        return histograms
+
+    def steps(self) -> np.ndarray:
+        """The steps table (read once), a structured array of dtype STEP_DTYPE"""
+        if self._steps is None:
+            group = f'{STEPS_GROUP}/CH00'
+            Nsteps = self._dataset(STEP_FIELDS[0], group).shape[0]
+            steps = np.zeros((Nsteps,), dtype=STEP_DTYPE)
+            for field in STEP_FIELDS:
+                steps[field] = self._dataset(field, group)[:].reshape((Nsteps,))
+            steps['positions'] = np.nan
+            if f'{STEPS_GROUP}/CH01' in self._file:
+                for ind in range(MAX_POSITIONS):
+                    steps['positions'][:, ind] = self._dataset(f'position_{ind}',
+                                                               f'{STEPS_GROUP}/CH01')[:].reshape((Nsteps,))
+            self._steps = steps
+        return self._steps
+
+    def step_slice(self, start_step: int, stop_step: int = None) -> slice:
+        """Photon indexes of the steps from start_step to stop_step (excluded, default to start_step + 1)"""
+        steps = self.steps()
+        stop_step = start_step + 1 if stop_step is None else stop_step
+        if not 0 <= start_step < stop_step <= steps.size:
+            raise IndexError(f'No steps {start_step} to {stop_step} in {self.path} ({steps.size} steps)')
+        return slice(int(steps['first_photon'][start_step]),
+                     int(steps['first_photon'][stop_step - 1] + steps['Nphotons'][stop_step - 1]))
+
+    def read_steps(self, start_step: int, stop_step: int = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Read the photons of a step or of a range of consecutive steps, see read and step_slice"""
+        indexes = self.step_slice(start_step, stop_step)
+        return self.read(indexes.start, indexes.stop)
+
+    def step_histogram(self, nbins: int, start_step: int, stop_step: int = None, Nchannels: int = 2,
+                       chunk_size: int = 1000000) -> np.ndarray:
+        """Nanotime histogram of each channel of a step or range of steps, shape (Nchannels, nbins)"""
+        indexes = self.step_slice(start_step, stop_step)
+        histograms = np.zeros((Nchannels, nbins), dtype=np.int64)
+        for start in range(indexes.start, indexes.stop, chunk_size):
+            detectors, _, nanotimes = self.read(start, min(start + chunk_size, indexes.stop))
+            histograms += nanotime_histograms(detectors, nanotimes, nbins, Nchannels)
+        return histograms
+
+
+def nanotime_histograms(detectors: np.ndarray, nanotimes: np.ndarray, nbins: int, Nchannels: int = 2) -> np.ndarray:
+    """Nanotime histogram of each channel from decoded records (markers, overflows and nanotimes out of the nbins
+    range are ignored), shape (Nchannels, nbins)"""
+    keep = (detectors < Nchannels) & (nanotimes < nbins)
+    return np.bincount(detectors[keep].astype(np.int64) * nbins + nanotimes[keep],
+                       minlength=Nchannels * nbins).reshape((Nchannels, nbins))
@@ -0,0 +1,144 @@
+"""
+Optional profiling of the acquisition stages (FIFO reading thread, decoding, saving, data emission)
+
+Two profilers can be used:
+
+* cProfile: standard library, one profile per stage. Nested stages are profiled exclusively (the outer stage is paused
+  while an inner one runs). Since Python 3.12 only one cProfile profiler can be active at a time in the whole process,
+  stages running concurrently in another thread are then skipped (see StageProfiler.skipped).
+* yappi: thread-aware profiler (optional dependency), the whole run is profiled and each stage is tagged so that its
+  statistics can be extracted afterwards.
+
+Each run is saved in its own folder containing one pstats file per stage (readable with pstats or snakeviz), a text
+summary and a json file with the acquisition parameters.
+"""
+import cProfile
+import datetime
+import io
+import json
+import pstats
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Union
+
+
+PROFILERS = ['cProfile', 'yappi']
+
+
+class StageProfiler:
+    """Profile the different stages of an acquisition
+
+    Parameters
+    ----------
+    profiler: (str) one of PROFILERS
+    """
+    def __init__(self, profiler: str = 'cProfile'):
+        self.profiler = profiler
+        self.enabled = False
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._tags: Dict[str, int] = {}
+        self._yappi = None
+
+    def start(self):
+        """Clear previous statistics and start profiling a new run"""
+        if self.profiler not in PROFILERS:
+            raise ValueError(f'Unknown profiler {self.profiler}, should be in {PROFILERS}')
+        self._profiles = {}
+        self._tags = {}
+        self.skipped = 0
+        if self.profiler == 'yappi':
+            try:
+                import yappi
+            except ImportError:
+                raise ImportError('yappi should be installed to use it as a profiler')
+            self._yappi = yappi
+            yappi.stop()
+            yappi.clear_stats()
+            yappi.set_clock_type('wall')
+            yappi.set_tag_callback(self._get_tag)
+            yappi.start()
+        self.enabled = True
+
+    def _get_tag(self) -> int:
+        return getattr(self._local, 'tag', 0)
+
+    def _get_stack(self) -> List[cProfile.Profile]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name: str):
+        """Context manager profiling the enclosed block as the stage called name (no-op if not enabled)"""
+        if not self.enabled:
+            yield
+        elif self.profiler == 'yappi':
+            with self._lock:
+                tag = self._tags.setdefault(name, len(self._tags) + 1)
+            previous_tag = self._get_tag()
+            self._local.tag = tag
+            try:
+                yield
+            finally:
+                self._local.tag = previous_tag
+        else:
+            with self._lock:
+                profile = self._profiles.setdefault(name, cProfile.Profile())
+            stack = self._get_stack()
+            if stack:
+                stack[-1].disable()
+            try:
+                profile.enable()
+            except ValueError:  # another profiler is active in another thread (python >= 3.12)
+                self.skipped += 1
+                profile = None
+            if profile is not None:
+                stack.append(profile)
+            try:
+                yield
+            finally:
+                if profile is not None:
+                    stack.pop().disable()
+                if stack:
+                    stack[-1].enable()
+
+    def stop(self, folder: Union[str, Path], **metadata) -> Path:
+        """Stop profiling and save the statistics of each stage
+
+        Parameters
+        ----------
+        folder: (str or Path) parent folder where the run folder is created
+        metadata: acquisition parameters (mode, resolution, rates...) saved along the profiles and used to tag the name
+                  of the run folder
+
+        Returns
+        -------
+        Path: the folder of this run
+        """
+        self.enabled = False
+        tag = '_'.join([f'{value}' for key, value in metadata.items() if key in ('mode', 'resolution')])
+        run_folder = Path(folder).joinpath(f"profile_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{tag}")
+        run_folder.mkdir(parents=True, exist_ok=True)
+
+        summary = io.StringIO()
+        if self.profiler == 'yappi':
+            self._yappi.stop()
+            for name, tag_id in self._tags.items():
+                stats = self._yappi.get_func_stats(filter=dict(tag=tag_id))
+                stats.save(str(run_folder.joinpath(f'{name}.pstats')), type='pstat')
+            self._yappi.get_thread_stats().print_all(out=summary)
+            self._yappi.get_func_stats().sort('ttot').print_all(out=summary)
+        else:
+            for name, profile in self._profiles.items():
+                profile.dump_stats(run_folder.joinpath(f'{name}.pstats'))
+                summary.write(f'\n######## {name} ########\n')
+                pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(20)
+        run_folder.joinpath('summary.txt').write_text(summary.getvalue())
+        run_folder.joinpath('run.json').write_text(json.dumps(dict(metadata, profiler=self.profiler,
+                                                                   skipped_stages=self.skipped),
+                                                              indent=2, default=str))
+        return run_folder
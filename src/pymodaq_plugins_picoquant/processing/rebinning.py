@@ -0,0 +1,112 @@
+"""
+Rebinning of histograms and FLIM cubes along their time axis
+
+All functions work on the last axis of an array of any shape (channels, pixels...) so that a single numpy call
+rebins every channel or every pixel at once.
+"""
+from typing import Tuple
+
+import numpy as np
+
+
+def crop(data: np.ndarray, start: int = 0, stop: int = None) -> np.ndarray:
+    """Region of interest along the last axis (a view, no copy)"""
+    return data[..., start:stop]
+
+
+def rebin(data: np.ndarray, factor: int) -> np.ndarray:
+    """Sum groups of factor consecutive bins along the last axis, the remaining bins (if the length is not a
+    multiple of factor) are dropped"""
+    factor = max(1, int(factor))
+    if factor == 1:
+        return data
+    length = data.shape[-1] // factor
+    return data[..., :length * factor].reshape(data.shape[:-1] + (length, factor)).sum(axis=-1)
+
+
+def log_bin_edges(length: int, nbins: int, first_width: int = 1) -> np.ndarray:
+    """Edges (bin indexes) of approximately geometric bins covering length bins
+
+    The first bins are as narrow as first_width and the edges are rounded to integers, duplicated edges are removed so
+    that the actual number of bins may be lower than nbins.
+    """
+    first_width = max(1, int(first_width))
+    if length <= first_width or nbins <= 1:
+        return np.array([0, length], dtype=np.int64)
+    edges = np.geomspace(first_width, length, nbins)
+    return np.unique(np.concatenate(([0], np.round(edges).astype(np.int64))))
+
+
+def rebin_edges(data: np.ndarray, edges: np.ndarray, density: bool = False) -> np.ndarray:
+    """Sum the bins between consecutive edges along the last axis
+
+    Parameters
+    ----------
+    data: (ndarray) the histograms, time along the last axis
+    edges: (ndarray of int) increasing bin indexes, the first one is usually 0 and the last one data.shape[-1]
+    density: (bool) if True, the sums are divided by the number of original bins in each new bin (counts per original
+             bin, so that the shape of a decay is kept with bins of different widths)
+    """
+    edges = np.asarray(edges, dtype=np.int64)
+    summed = np.add.reduceat(data, edges[:-1], axis=-1)
+    if density:
+        return summed / np.diff(edges)
+    return summed
+
+
+class Rebinner:
+    """Region of interest, integer factor and optional logarithmic rebinning of histograms
+
+    Parameters
+    ----------
+    start: (int) first bin of the region of interest
+    stop: (int) last bin (excluded) of the region of interest, None for the end of the histograms
+    factor: (int) number of bins summed together (linear rebinning)
+    log_bins: (int) if not 0, number of logarithmic bins (applied after the linear rebinning)
+    density: (bool) see rebin_edges, only used for logarithmic bins
+    """
+    def __init__(self, start: int = 0, stop: int = None, factor: int = 1, log_bins: int = 0, density: bool = True):
+        self.start = max(0, int(start))
+        self.stop = stop
+        self.factor = max(1, int(factor))
+        self.log_bins = log_bins
+        self.density = density
+
+    @property
+    def active(self) -> bool:
+        return self.start != 0 or self.stop is not None or self.factor != 1 or self.log_bins > 0
+
+    def bounds(self, length: int) -> Tuple[int, int]:
+        """The region of interest clipped to histograms of length bins"""
+        stop = length if self.stop is None else min(max(0, int(self.stop)), length)
+        return min(self.start, length), stop
+
+    def valid(self, length: int) -> bool:
+        """True if the region of interest of histograms of length bins holds at least one rebinned bin"""
+        start, stop = self.bounds(length)
+        return (stop - start) // self.factor > 0
+
+    def __call__(self, data: np.ndarray, axis: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Rebin data along its last axis
+
+        Parameters
+        ----------
+        data: (ndarray) the histograms
+        axis: (ndarray) the time of each bin (same length as the last axis of data), default to the bin indexes
+
+        Returns
+        -------
+        ndarray: the rebinned data, data itself if the region of interest is empty (see valid)
+        ndarray: the time of each new bin (mean time of the summed bins)
+        """
+        axis = np.arange(data.shape[-1]) if axis is None else np.asarray(axis, dtype=np.float64)
+        if not self.valid(data.shape[-1]):
+            return data, axis
+        start, stop = self.bounds(data.shape[-1])
+        data = rebin(crop(data, start, stop), self.factor)
+        axis = rebin(crop(axis, start, stop), self.factor) / self.factor
+        if self.log_bins > 0:
+            edges = log_bin_edges(data.shape[-1], self.log_bins)
+            data = rebin_edges(data, edges, self.density)
+            axis = rebin_edges(axis, edges, density=True)
+        return data, axis
@@ -0,0 +1,196 @@
+"""
+Publication of live data to other processes through named shared memory segments
+
+Each segment holds a single array (the last published one) behind a small header. The header holds a sequence
+number incremented before and after each update (odd while the data is being written), so that a consumer can map
+the segment once and follow the updates without any lock nor file access:
+
+* read the sequence number, skip if odd
+* copy (or use in place) the data
+* check that the sequence number did not change, else the copy may be torn and is read again
+
+Segment layout: HEADER_DTYPE at offset 0, then the array data at DATA_OFFSET. The dtype of the array is saved within
+the header (numpy descr) so that structured arrays (such as photon chunks) can be shared too.
+"""
+import ast
+import sys
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+MAX_NDIM = 4
+HEADER_DTYPE = np.dtype([('seq', '<u8'), ('timestamp', '<f8'), ('nbytes', '<u8'), ('ndim', '<u4'), ('closed', '<u4'),
+                         ('shape', '<u8', (MAX_NDIM,)), ('descr', 'S136')])
+DATA_OFFSET = 256
+PHOTON_DTYPE = np.dtype([('timestamp', '<i8'), ('detector', '<u1'), ('nanotime', '<u2')])
+
+_owned_segments = set()  # names of the segments created by this process
+
+
+def pack_photons(detectors: np.ndarray, timestamps: np.ndarray, nanotimes: np.ndarray) -> np.ndarray:
+    """Decoded records as a single structured array of dtype PHOTON_DTYPE"""
+    photons = np.empty((detectors.size,), dtype=PHOTON_DTYPE)
+    photons['timestamp'] = timestamps
+    photons['detector'] = detectors
+    photons['nanotime'] = nanotimes
+    return photons
+
+
+class SharedArrayWriter:
+    """Owner of a shared memory segment in which arrays of at most capacity bytes are published
+
+    Parameters
+    ----------
+    name: (str) the name of the segment
+    capacity: (int) maximum size of the published arrays in bytes
+    """
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = int(capacity)
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=DATA_OFFSET + self.capacity)
+        except FileExistsError:  # left by a previous session that did not close it
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=DATA_OFFSET + self.capacity)
+        _owned_segments.add(name)
+        self.header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=self._shm.buf)
+        self.header[0] = np.zeros((), dtype=HEADER_DTYPE)
+
+    @property
+    def seq(self) -> int:
+        return int(self.header['seq'][0])
+
+    def publish(self, array: np.ndarray) -> int:
+        """Copy array within the segment
+
+        Returns
+        -------
+        int: the new sequence number
+        """
+        array = np.ascontiguousarray(array)
+        if array.nbytes > self.capacity:
+            raise ValueError(f'{array.nbytes} bytes cannot be published in the {self.capacity} bytes of '
+                             f'{self.name}')
+        if array.ndim > MAX_NDIM:
+            raise ValueError(f'Only arrays of at most {MAX_NDIM} dimensions can be published')
+        header = self.header[0]
+        header['seq'] += 1  # odd: being written
+        shape = np.zeros((MAX_NDIM,), dtype=np.uint64)
+        shape[:array.ndim] = array.shape
+        header['shape'] = shape
+        header['ndim'] = array.ndim
+        header['nbytes'] = array.nbytes
+        header['descr'] = repr(np.lib.format.dtype_to_descr(array.dtype)).encode()
+        header['timestamp'] = time.time()
+        self._shm.buf[DATA_OFFSET:DATA_OFFSET + array.nbytes] = array.reshape(-1).view(np.uint8)
+        header['seq'] += 1
+        return int(header['seq'])
+
+    def close(self):
+        """Flag the segment as closed for the consumers and release it"""
+        if self._shm is None:
+            return
+        self.header['closed'] = 1
+        del self.header
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+        _owned_segments.discard(self.name)
+
+
+class SharedArrayReader:
+    """Consumer of a segment published by a SharedArrayWriter, usually in another process
+
+    Parameters
+    ----------
+    name: (str) the name of the segment
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._shm = shared_memory.SharedMemory(name=name)
+        if sys.platform != 'win32' and name not in _owned_segments:
+            # the segment belongs to the writer, it should not be unlinked when this process exits
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+        self.header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=self._shm.buf)
+
+    @property
+    def seq(self) -> int:
+        return int(self.header['seq'][0])
+
+    @property
+    def closed(self) -> bool:
+        """True if the writer released the segment, a new reader should then be opened"""
+        return bool(self.header['closed'][0])
+
+    def view(self) -> Tuple[int, np.ndarray]:
+        """The published array in place (no copy), with the sequence number it is valid for
+
+        The array may be overwritten at any time by the writer: the data are consistent only if seq is even and
+        still equal to the seq property after their use.
+        """
+        header = self.header[0].copy()
+        dtype = np.lib.format.descr_to_dtype(ast.literal_eval(header['descr'].decode())) \
+            if header['descr'] != b'' else np.dtype(np.uint8)
+        shape = tuple(int(size) for size in header['shape'][:header['ndim']])
+        data = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf, offset=DATA_OFFSET)
+        return int(header['seq']), data
+
+    def read(self, retries: int = 100) -> Tuple[int, np.ndarray]:
+        """A consistent copy of the published array with its sequence number, (0, None) if nothing published yet
+
+        Raises
+        ------
+        TimeoutError: if no consistent copy could be made within retries attempts
+        """
+        for _ in range(retries):
+            seq, data = self.view()
+            if seq == 0:
+                return 0, None
+            if seq % 2 == 0:
+                data = data.copy()
+                if self.seq == seq:
+                    return seq, data
+            time.sleep(0)
+        raise TimeoutError(f'No consistent data could be read from {self.name}')
+
+    def close(self):
+        """Release the mapping, the arrays returned by view should not be used anymore"""
+        if self._shm is None:
+            return
+        del self.header
+        self._shm.close()
+        self._shm = None
+
+
+class SharedPublisher:
+    """Set of segments named {prefix}_{key} created at their first publication
+
+    Parameters
+    ----------
+    prefix: (str) common prefix of the segment names
+    capacities: (dict) capacity in bytes of the segment of each key, default to the size of the first published array
+    """
+    def __init__(self, prefix: str, capacities: Dict[str, int] = None):
+        self.prefix = prefix
+        self.capacities = capacities if capacities is not None else {}
+        self.writers: Dict[str, SharedArrayWriter] = {}
+
+    def segment_name(self, key: str) -> str:
+        return f'{self.prefix}_{key}'
+
+    def publish(self, key: str, array: np.ndarray) -> int:
+        if key not in self.writers:
+            self.writers[key] = SharedArrayWriter(self.segment_name(key),
+                                                  max(self.capacities.get(key, 0), np.asarray(array).nbytes))
+        return self.writers[key].publish(array)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
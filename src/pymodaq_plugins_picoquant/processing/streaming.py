@@ -0,0 +1,211 @@
+"""
+Streaming of live data to network clients with a compact binary framing
+
+Each frame is a fixed header followed by the shape, the topic, the numpy dtype descr and the raw data of an array
+(no pickling, a client in any language can decode it):
+
+    magic (4s) | topic length (H) | descr length (H) | ndim (B) | padding (3x) | seq (Q) | timestamp (d) | nbytes (Q)
+    shape (ndim Q) | topic (utf-8) | descr (ascii, repr of numpy.lib.format.dtype_to_descr) | data (nbytes)
+
+all numbers being little endian. The server never blocks the acquisition: each client has a bounded queue of frames
+sent by its own thread, the oldest frames are dropped if a client is too slow to receive them.
+"""
+import ast
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from typing import List, Tuple
+
+import numpy as np
+
+
+MAGIC = b'TH26'
+FRAME_HEADER = struct.Struct('<4sHHB3xQdQ')
+
+
+def encode_frame(topic: str, array: np.ndarray, seq: int = 0, timestamp: float = None) -> bytes:
+    """Binary frame of an array (the data are copied, the array may be reused afterwards)"""
+    array = np.ascontiguousarray(array)
+    topic_bytes = topic.encode()
+    descr = repr(np.lib.format.dtype_to_descr(array.dtype)).encode()
+    header = FRAME_HEADER.pack(MAGIC, len(topic_bytes), len(descr), array.ndim, seq,
+                               time.time() if timestamp is None else timestamp, array.nbytes)
+    return b''.join((header, struct.pack(f'<{array.ndim}Q', *array.shape), topic_bytes, descr, array.tobytes()))
+
+
+def _receive_exactly(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        nbytes = sock.recv_into(view[received:], size - received)
+        if nbytes == 0:
+            raise ConnectionError('Connection closed by the server')
+        received += nbytes
+    return bytes(buffer)
+
+
+def receive_frame(sock: socket.socket) -> Tuple[str, int, float, np.ndarray]:
+    """Read a frame from a connected socket
+
+    Returns
+    -------
+    str: the topic
+    int: the sequence number of the frame within its topic
+    float: the time (time.time of the server) of the publication
+    ndarray: the data
+    """
+    magic, topic_length, descr_length, ndim, seq, timestamp, nbytes = FRAME_HEADER.unpack(
+        _receive_exactly(sock, FRAME_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError('Not a TH260 stream')
+    shape = struct.unpack(f'<{ndim}Q', _receive_exactly(sock, 8 * ndim))
+    topic = _receive_exactly(sock, topic_length).decode()
+    dtype = np.lib.format.descr_to_dtype(ast.literal_eval(_receive_exactly(sock, descr_length).decode()))
+    data = np.frombuffer(_receive_exactly(sock, nbytes), dtype=dtype).reshape(shape)
+    return topic, seq, timestamp, data
+
+
+class _ClientSender:
+    """Bounded queue of frames sent to a single client by a dedicated thread"""
+    def __init__(self, sock: socket.socket, max_queue: int):
+        self.sock = sock
+        self.frames = deque(maxlen=max_queue)
+        self.dropped = 0
+        self.alive = True
+        self._event = threading.Event()
+        self._thread = threading.Thread(target=self._send_loop, daemon=True)
+        self._thread.start()
+
+    def put(self, frame: bytes):
+        if len(self.frames) == self.frames.maxlen:
+            self.dropped += 1  # the oldest frame is discarded by the deque
+        self.frames.append(frame)
+        self._event.set()
+
+    def _send_loop(self):
+        while self.alive:
+            self._event.wait()
+            self._event.clear()
+            while self.alive:
+                try:
+                    frame = self.frames.popleft()
+                except IndexError:
+                    break
+                try:
+                    self.sock.sendall(frame)
+                except OSError:
+                    self.alive = False
+        self.sock.close()
+
+    def close(self):
+        self.alive = False
+        self._event.set()
+        self._thread.join(1)
+
+
+class StreamServer:
+    """TCP server publishing frames to all the connected clients
+
+    Parameters
+    ----------
+    host: (str) interface to listen on, 127.0.0.1 for local clients only
+    port: (int) TCP port, 0 for any free port (see the port attribute)
+    max_queue: (int) maximum number of frames waiting to be sent to a client
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, max_queue: int = 16):
+        self.max_queue = max(1, int(max_queue))
+        self._clients: List[_ClientSender] = []
+        self._lock = threading.Lock()
+        self._seqs = {}
+        self._dropped_closed = 0  # frames dropped for clients already disconnected
+        self._socket = socket.create_server((host, port))
+        self._socket.settimeout(0.2)
+        self.host, self.port = self._socket.getsockname()[:2]
+        self.running = True
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._thread.start()
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                sock, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                self._clients.append(_ClientSender(sock, self.max_queue))
+
+    @property
+    def Nclients(self) -> int:
+        return len(self._clients)
+
+    @property
+    def dropped(self) -> int:
+        """Number of frames dropped because of slow clients"""
+        return self._dropped_closed + sum([client.dropped for client in self._clients])
+
+    def publish(self, topic: str, array: np.ndarray) -> int:
+        """Queue a frame for every connected client (nothing is encoded if no client is connected)
+
+        Returns
+        -------
+        int: the sequence number of the frame within its topic
+        """
+        seq = self._seqs.get(topic, 0) + 1
+        self._seqs[topic] = seq
+        with self._lock:
+            for client in [client for client in self._clients if not client.alive]:
+                self._dropped_closed += client.dropped
+                self._clients.remove(client)
+            if len(self._clients) != 0:
+                frame = encode_frame(topic, array, seq)
+                for client in self._clients:
+                    client.put(frame)
+        return seq
+
+    def close(self):
+        self.running = False
+        self._socket.close()
+        self._thread.join(1)
+        with self._lock:
+            for client in self._clients:
+                client.close()
+            self._clients = []
+
+
+class StreamClient:
+    """Client of a StreamServer
+
+    Parameters
+    ----------
+    host: (str) address of the server
+    port: (int) port of the server
+    timeout: (float) timeout in s of the connection and of each reception, None to wait forever
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, timeout: float = None):
+        self._socket = socket.create_connection((host, port), timeout=timeout)
+
+    def receive(self) -> Tuple[str, int, float, np.ndarray]:
+        """The next frame, see receive_frame"""
+        return receive_frame(self._socket)
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.receive()
+            except ConnectionError:
+                return
+
+    def close(self):
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,97 @@
+"""
+Multichannel scaler like intensity trace computed on the fly from decoded TTTR chunks
+"""
+from typing import Tuple
+
+import numpy as np
+
+
+class IntensityTrace:
+    """Counts per macrotime bin and per channel, accumulated chunk after chunk
+
+    Only completed bins are returned by add (the last bin of a chunk may still receive photons from the next chunk),
+    they are also kept in a circular buffer of fixed length for display.
+
+    Parameters
+    ----------
+    bin_width: (int) width of a bin in macrotime units (sync periods in T3 mode, base resolution in T2 mode)
+    Nchannels: (int) number of input channels
+    length: (int) number of bins kept in the circular buffer
+    """
+    def __init__(self, bin_width: int, Nchannels: int = 2, length: int = 1000):
+        self.bin_width = max(1, int(bin_width))
+        self.Nchannels = Nchannels
+        self.length = length
+        self.buffer = np.zeros((Nchannels, length), dtype=np.uint32)
+        self.bin_indexes = np.zeros((length,), dtype=np.int64)
+        self.Nbins = 0  # total number of completed bins
+        self._current_bin: int = None
+        self._current_counts = np.zeros((Nchannels,), dtype=np.uint32)
+
+    def add(self, detectors: np.ndarray, timestamps: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Accumulate the photons of a time ordered chunk
+
+        Parameters
+        ----------
+        detectors: (ndarray of uint8) detector of each record, records other than photons are ignored
+        timestamps: (ndarray of int64) overflow corrected macrotimes
+
+        Returns
+        -------
+        ndarray: indexes of the bins completed by this chunk
+        ndarray: counts of the completed bins, shape (Nchannels, Nbins)
+        """
+        is_photon = detectors < self.Nchannels
+        bins = timestamps[is_photon] // self.bin_width
+        if bins.size == 0:
+            return np.zeros((0,), dtype=np.int64), np.zeros((self.Nchannels, 0), dtype=np.uint32)
+        if self._current_bin is None:
+            self._current_bin = int(bins[0])
+        bins -= self._current_bin
+        Nbins = int(bins[-1]) + 1
+        counts = np.bincount(detectors[is_photon].astype(np.int64) * Nbins + bins,
+                             minlength=self.Nchannels * Nbins).astype(np.uint32).reshape((self.Nchannels, Nbins))
+        counts[:, 0] += self._current_counts
+        self._current_counts = counts[:, -1].copy()
+
+        indexes = np.arange(self._current_bin, self._current_bin + Nbins - 1, dtype=np.int64)
+        self._current_bin += Nbins - 1
+        self._push(indexes, counts[:, :-1])
+        return indexes, counts[:, :-1]
+
+    def flush(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Close the current bin (at the end of an acquisition) and return it as add does"""
+        if self._current_bin is None:
+            return np.zeros((0,), dtype=np.int64), np.zeros((self.Nchannels, 0), dtype=np.uint32)
+        indexes = np.array([self._current_bin], dtype=np.int64)
+        counts = self._current_counts[:, None].copy()
+        self._push(indexes, counts)
+        self._current_bin = None
+        self._current_counts[:] = 0
+        return indexes, counts
+
+    def _push(self, indexes: np.ndarray, counts: np.ndarray):
+        if indexes.size > self.length:
+            indexes = indexes[-self.length:]
+            counts = counts[:, -self.length:]
+        start = self.Nbins % self.length
+        stop = min(self.length, start + indexes.size)
+        self.buffer[:, start:stop] = counts[:, :stop - start]
+        self.bin_indexes[start:stop] = indexes[:stop - start]
+        remaining = indexes.size - (stop - start)
+        self.buffer[:, :remaining] = counts[:, stop - start:]
+        self.bin_indexes[:remaining] = indexes[stop - start:]
+        self.Nbins += indexes.size
+
+    def trace(self) -> Tuple[np.ndarray, np.ndarray]:
+        """The content of the circular buffer in chronological order
+
+        Returns
+        -------
+        ndarray: bin indexes (multiply by bin_width to get macrotimes)
+        ndarray: counts, shape (Nchannels, N)
+        """
+        if self.Nbins < self.length:
+            return self.bin_indexes[:self.Nbins].copy(), self.buffer[:, :self.Nbins].copy()
+        start = self.Nbins % self.length
+        return np.roll(self.bin_indexes, -start), np.roll(self.buffer, -start, axis=1)
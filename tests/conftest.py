@@ -0,0 +1,178 @@
+"""
+Synthetic T3 records and a fake Th260 controller serving them, so that the acquisition and processing code can be
+tested without the hardware (the TH260 library is only available on windows)
+"""
+import ctypes
+import time
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.hardware.picoquant.replay import FifoRecorder
+
+
+OVERFLOW_RECORD = (1 << 31) | (63 << 25)  # special bit and detector code 127, the sync field holds the count
+MARKER_RECORD = (1 << 31)  # special bit, the channel field holds the marker bits
+
+
+def make_t3_records(Nphotons: int, Nchannels: int = 2, seed: int = 0, marker_every: int = 0, nbins: int = 1024,
+                    max_sync_step: int = 300) -> dict:
+    """T3 records of photons detected at random sync counts, with the overflow records of the sync counter
+
+    Parameters
+    ----------
+    Nphotons: (int) number of photon records
+    Nchannels: (int) photons are spread over the channels 0..Nchannels-1
+    seed: (int) seed of the random generator
+    marker_every: (int) if not 0, a marker 1 record follows every marker_every photons
+    nbins: (int) the nanotimes are drawn in 0..nbins-1
+    max_sync_step: (int) maximum number of sync periods between two photons (below 1024)
+
+    Returns
+    -------
+    dict: records (uint32), the expected detectors, timestamps (overflow corrected) and nanotimes of every record
+    """
+    rng = np.random.default_rng(seed)
+    syncs = np.cumsum(rng.integers(0, max_sync_step, Nphotons))
+    channels = rng.integers(0, Nchannels, Nphotons)
+    nanotimes = np.clip(rng.normal(nbins / 3, nbins / 10, Nphotons), 0, nbins - 1).astype(np.int64)
+    wraps = syncs // 1024
+
+    records, detectors, timestamps, dtimes = [], [], [], []
+    previous_wraps = 0
+    for ind in range(Nphotons):
+        if wraps[ind] != previous_wraps:
+            records.append(OVERFLOW_RECORD | int(wraps[ind] - previous_wraps))
+            detectors.append(127)
+            timestamps.append(int(wraps[ind]) * 1024 + int(wraps[ind] - previous_wraps))
+            dtimes.append(0)
+            previous_wraps = wraps[ind]
+        records.append((int(channels[ind]) << 25) | (int(nanotimes[ind]) << 10) | int(syncs[ind] % 1024))
+        detectors.append(channels[ind])
+        timestamps.append(syncs[ind])
+        dtimes.append(nanotimes[ind])
+        if marker_every and ind % marker_every == 0:
+            records.append(MARKER_RECORD | (1 << 25) | int(syncs[ind] % 1024))
+            detectors.append(65)
+            timestamps.append(syncs[ind])
+            dtimes.append(0)
+    return dict(records=np.array(records, dtype=np.uint32), detectors=np.array(detectors, dtype=np.uint8),
+                timestamps=np.array(timestamps, dtype=np.int64), nanotimes=np.array(dtimes, dtype=np.uint16))
+
+
+class FakeTh260:
+    """Th260 controller serving given T3 records through TH260_ReadFiFo, chunk by chunk
+
+    In Histo mode, a measurement ends once its acquisition time is elapsed and the histograms hold the number of
+    started measurements in each bin.
+    """
+    histogram_length = 1024
+
+    def __init__(self, records: np.ndarray = None, chunk: int = 2000, period: float = 0.001):
+        self.records = records if records is not None else np.zeros((0,), dtype=np.uint32)
+        self.chunk = chunk
+        self.period = period
+        self.mode = 3
+        self.position = 0
+        self.tacq = 0
+        self.Nstarts = 0
+        self.Nstatus = 0
+        self.binning = 0
+        self._t0 = time.perf_counter()
+
+    def __getattr__(self, item):
+        if item.startswith('TH260_Set') or item in ('TH260_OpenDevice', 'TH260_CloseDevice', 'TH260_ClearHistMem'):
+            return lambda *args, **kwargs: None
+        raise AttributeError(item)
+
+    def TH260_Initialize(self, device=0, mode=0):
+        self.mode = mode
+
+    def TH260_SetBinning(self, device=0, binning=0):
+        self.binning = binning
+
+    def TH260_SetHistoLen(self, device=0, lencode=0):
+        self.histogram_length = 1024 * 2 ** lencode
+        return self.histogram_length
+
+    def TH260_GetBaseResolution(self, device=0):
+        return 25., 22
+
+    def TH260_GetResolution(self, device=0):
+        return 25. * 2 ** self.binning
+
+    def TH260_GetHardwareInfo(self, device=0):
+        return 'TimeHarp 260 P', '930021', '1.1'
+
+    def TH260_GetSerialNumber(self, device=0):
+        return '1234567'
+
+    def TH260_GetNumOfInputChannels(self, device=0):
+        return 2
+
+    def TH260_StartMeas(self, device=0, tacq=1000):
+        self._t0 = time.perf_counter()
+        self.tacq = tacq
+        self.position = 0
+        self.Nstarts += 1
+
+    def TH260_StopMeas(self, device=0):
+        pass
+
+    def TH260_GetFlags(self, device=0):
+        return []
+
+    def TH260_GetSyncRate(self, device=0):
+        return 40000000
+
+    def TH260_GetCountRate(self, device=0, channel=0):
+        return 100000 + channel
+
+    def TH260_GetElapsedMeasTime(self, device=0):
+        if self.mode == 0:
+            return min(float(self.tacq), (time.perf_counter() - self._t0) * 1000)
+        return self.position / 10
+
+    def TH260_CTCStatus(self, device=0):
+        self.Nstatus += 1
+        if self.mode == 0:
+            return (time.perf_counter() - self._t0) * 1000 >= self.tacq
+        return self.position >= self.records.size
+
+    def TH260_GetHistogram(self, device=0, data_pointer=None, channel=0, clear=False):
+        np.ctypeslib.as_array(data_pointer, shape=(self.histogram_length,))[:] = self.Nstarts + channel
+
+    def TH260_ReadFiFo(self, device=0, count=0, buffer_ptr=None):
+        time.sleep(self.period)
+        nrecords = min(count, self.chunk, self.records.size - self.position)
+        if nrecords <= 0:
+            return 0
+        np.ctypeslib.as_array(buffer_ptr, shape=(count,))[:nrecords] = \
+            self.records[self.position:self.position + nrecords]
+        self.position += nrecords
+        return nrecords
+
+
+@pytest.fixture
+def t3_data() -> dict:
+    return make_t3_records(20000, marker_every=100)
+
+
+@pytest.fixture
+def fake_th260(t3_data) -> FakeTh260:
+    return FakeTh260(t3_data['records'])
+
+
+@pytest.fixture
+def capture(tmp_path, t3_data):
+    """Folder of a FIFO capture of t3_data recorded by a FifoRecorder"""
+    recorder = FifoRecorder(FakeTh260(t3_data['records'], chunk=3000, period=0.), tmp_path, mode='T3')
+    buffer = np.zeros((2 ** 14,), dtype=np.uint32)
+    recorder.TH260_StartMeas(0, 1000)
+    recorder.TH260_GetSyncRate(0)
+    while not recorder.TH260_CTCStatus(0):
+        recorder.TH260_ReadFiFo(0, buffer.size, buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32)))
+        recorder.TH260_GetFlags(0)
+        recorder.TH260_GetElapsedMeasTime(0)
+    recorder.TH260_StopMeas(0)
+    return recorder.close()
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.processing.chunks import PhotonChunk
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+from pymodaq_plugins_picoquant.processing.arrow import ParquetPhotonWriter, photon_schema, to_record_batch  # noqa
+
+
+@pytest.fixture
+def chunk(t3_data) -> PhotonChunk:
+    return PhotonChunk(t3_data['detectors'], t3_data['timestamps'], t3_data['nanotimes'])
+
+
+def test_record_batch(chunk):
+    batch = to_record_batch(chunk, step=3)
+    keep = chunk.detectors != 127
+    assert batch.num_rows == keep.sum()
+    assert np.array_equal(batch.column('macrotime').to_numpy(), chunk.timestamps[keep])
+    assert np.array_equal(batch.column('nanotime').to_numpy(), chunk.nanotimes[keep])
+    channels = batch.column('channel').to_pylist()
+    markers = batch.column('marker').to_numpy()
+    detectors = chunk.detectors[keep]
+    is_marker = detectors >= 64
+    assert all(channel is None for channel, marker in zip(channels, is_marker) if marker)
+    assert np.array_equal(np.array([channel for channel in channels if channel is not None]), detectors[~is_marker])
+    assert np.array_equal(markers[is_marker], detectors[is_marker] - 64)
+    assert np.all(markers[~is_marker] == 0)
+    assert np.all(batch.column('step').to_numpy() == 3)
+
+
+def test_parquet_round_trip(tmp_path, chunk):
+    path = tmp_path.joinpath('photons.parquet')
+    writer = ParquetPhotonWriter(path, metadata=dict(resolution=0.025))
+    half = len(chunk) // 2
+    writer.write_chunk(chunk[:half], step=0)
+    writer.write_chunk(chunk[half:], step=1)
+    writer.write_chunk(PhotonChunk.empty(), step=2)
+    assert writer.close() == path
+
+    parquet = pq.ParquetFile(path)
+    assert parquet.metadata.num_row_groups == 2
+    assert parquet.schema_arrow.metadata[b'resolution'] == b'0.025'
+    table = parquet.read()
+    assert table.num_rows == writer.Nrows == np.sum(chunk.detectors != 127)
+    assert np.array_equal(table.column('macrotime').to_numpy(), chunk.timestamps[chunk.detectors != 127])
+    steps = table.column('step').to_numpy()
+    assert np.all(np.diff(steps) >= 0) and set(steps) == {0, 1}
+
+
+def test_schema_types():
+    schema = photon_schema()
+    assert schema.field('macrotime').type == pa.int64()
+    assert schema.field('nanotime').type == pa.uint16()
+    assert pa.types.is_dictionary(schema.field('channel').type)
@@ -0,0 +1,89 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.hardware.picoquant.async_engine import AsyncTH260Engine
+from pymodaq_plugins_picoquant.processing.chunks import PhotonChunk
+
+from conftest import FakeTh260
+
+
+def test_t3_chunks(fake_th260, t3_data):
+    async def main():
+        async with AsyncTH260Engine(fake_th260) as engine:
+            await engine.configure('T3')
+            assert await engine.TH260_GetSerialNumber(0) == '1234567'
+            await engine.start(1000)
+            chunks = [chunk.copy() async for chunk in engine.chunks(timeout=5)]
+            assert await engine.wait(5)
+            return PhotonChunk.concatenate(chunks), await engine.histogram()
+
+    photons, histograms = asyncio.run(main())
+    assert np.array_equal(photons.timestamps, t3_data['timestamps'])
+    assert np.array_equal(photons.detectors, t3_data['detectors'])
+    assert histograms.sum() == np.sum(t3_data['detectors'] < 2)
+
+
+def test_concurrent_with_other_tasks(fake_th260, t3_data):
+    """The event loop keeps running other tasks while the chunks are awaited"""
+    async def main():
+        async with AsyncTH260Engine(fake_th260) as engine:
+            await engine.configure('T3')
+            await engine.start(1000)
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.001)
+
+            task = asyncio.create_task(ticker())
+            Nrecords = sum([len(chunk) async for chunk in engine.chunks(timeout=5)])
+            task.cancel()
+            return Nrecords, ticks
+
+    Nrecords, ticks = asyncio.run(main())
+    assert Nrecords == t3_data['records'].size
+    assert ticks > 1
+
+
+def test_histogram_wait():
+    controller = FakeTh260()
+
+    async def main():
+        async with AsyncTH260Engine(controller) as engine:
+            await engine.configure('Histo')
+            await engine.start(50)
+            controller.Nstatus = 0
+            assert not await engine.wait(0.01)
+            assert await engine.wait(5)
+            return await engine.histogram()
+
+    histograms = asyncio.run(main())
+    assert histograms.shape == (2, 1024)
+    assert controller.Nstatus < 10  # sleeps until the expected end instead of polling
+
+
+def test_chunks_timeout():
+    controller = FakeTh260(period=0.01)
+
+    async def main():
+        async with AsyncTH260Engine(controller) as engine:
+            await engine.configure('T3')
+            controller.TH260_CTCStatus = lambda device=0: False  # never ends, never sends records
+            await engine.start(1000)
+            with pytest.raises(TimeoutError):
+                async for _ in engine.chunks(timeout=0.1):
+                    pass
+            await engine.stop()
+
+    asyncio.run(main())
+
+
+def test_unknown_attribute(fake_th260):
+    engine = AsyncTH260Engine(fake_th260)
+    with pytest.raises(AttributeError):
+        engine.configure_all
+    engine.executor.shutdown()
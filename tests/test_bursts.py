@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.processing.bursts import BurstSearch, BURST_DTYPE
+
+
+BURST_STARTS = [20000, 50000, 90000]
+BURST_SIZE = 50
+BURST_ACCEPTORS = [10, 25, 40]
+
+
+def make_stream(seed: int = 0, pie: bool = False):
+    """Background photons every 1000 macrotimes with bursts of BURST_SIZE photons 2 macrotimes apart
+
+    Within each burst, the last BURST_ACCEPTORS photons are on the acceptor channel (1), with an acceptor excitation
+    nanotime (>= 500) for one in five of them if pie is True.
+    """
+    rng = np.random.default_rng(seed)
+    timestamps = [np.arange(0, 120000, 1000)]
+    detectors = [rng.integers(0, 2, timestamps[0].size)]
+    nanotimes = [rng.integers(0, 500, timestamps[0].size)]
+    for start, Nacceptor in zip(BURST_STARTS, BURST_ACCEPTORS):
+        timestamps.append(start + 300 + 2 * np.arange(BURST_SIZE))
+        detectors.append(np.r_[np.zeros(BURST_SIZE - Nacceptor), np.ones(Nacceptor)])
+        burst_nanotimes = np.full((BURST_SIZE,), 100)
+        if pie:
+            burst_nanotimes[BURST_SIZE - Nacceptor::5] = 600
+        nanotimes.append(burst_nanotimes)
+    timestamps = np.concatenate(timestamps)
+    order = np.argsort(timestamps, kind='stable')
+    return (np.concatenate(detectors)[order].astype(np.uint8), timestamps[order].astype(np.int64),
+            np.concatenate(nanotimes)[order].astype(np.uint16))
+
+
+def search(detectors, timestamps, nanotimes, chunk_size: int, **kwargs) -> np.ndarray:
+    burst_search = BurstSearch(m=10, rate_threshold=0.05, min_size=30, **kwargs)
+    bursts = [burst_search.add(detectors[start:start + chunk_size], timestamps[start:start + chunk_size],
+                               nanotimes[start:start + chunk_size])
+              for start in range(0, detectors.size, chunk_size)]
+    bursts = np.concatenate(bursts + [burst_search.flush()])
+    assert burst_search.Nbursts == bursts.size
+    return bursts
+
+
+def test_bursts_found():
+    bursts = search(*make_stream(), chunk_size=10 ** 6, sync_period=25e-9)
+    assert bursts.dtype == BURST_DTYPE
+    assert bursts.size == len(BURST_STARTS)
+    assert np.array_equal(bursts['start'], np.array(BURST_STARTS) + 300)
+    assert np.array_equal(bursts['stop'], np.array(BURST_STARTS) + 300 + 2 * (BURST_SIZE - 1))
+    assert np.all(bursts['size'] == BURST_SIZE)
+    assert np.allclose(bursts['duration'], 2 * (BURST_SIZE - 1) * 25e-9)
+    assert np.allclose(bursts['E'], np.array(BURST_ACCEPTORS) / BURST_SIZE)
+    assert np.all(bursts['S'] == 1)
+    assert np.all(bursts['nanotime_donor'] == 100)
+
+
+@pytest.mark.parametrize('chunk_size', [7, 64, 1000])
+def test_bursts_by_chunks(chunk_size):
+    stream = make_stream()
+    assert np.array_equal(search(*stream, chunk_size=chunk_size), search(*stream, chunk_size=10 ** 6))
+
+
+def test_pie_stoichiometry():
+    bursts = search(*make_stream(pie=True), chunk_size=100, pie_split=500)
+    n_aa = np.array([len(range(0, Nacceptor, 5)) for Nacceptor in BURST_ACCEPTORS])
+    assert np.array_equal(bursts['n_aa'], n_aa)
+    assert np.array_equal(bursts['n_da'], np.array(BURST_ACCEPTORS) - n_aa)
+    assert np.array_equal(bursts['n_dd'], BURST_SIZE - np.array(BURST_ACCEPTORS))
+    assert np.allclose(bursts['S'], (BURST_SIZE - n_aa) / BURST_SIZE)
+
+
+def test_small_bursts_discarded():
+    burst_search = BurstSearch(m=10, rate_threshold=0.05, min_size=BURST_SIZE + 1)
+    detectors, timestamps, nanotimes = make_stream()
+    assert burst_search.add(detectors, timestamps, nanotimes).size + burst_search.flush().size == 0
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.processing.chunks import (PhotonChunk, BufferPool, T3Decoder, count_overflows,
+                                                         T3_WRAPAROUND)
+
+
+def decode_by_chunks(records: np.ndarray, chunk_size: int, capacity: int = 2 ** 14) -> PhotonChunk:
+    decoder = T3Decoder(capacity)
+    chunks = []
+    for start in range(0, records.size, chunk_size):
+        chunk = decoder.decode(records[start:start + chunk_size])
+        chunks.append(chunk.copy())
+        chunk.release()
+    return PhotonChunk.concatenate(chunks)
+
+
+def test_decode(t3_data):
+    chunk = T3Decoder(t3_data['records'].size).decode(t3_data['records'])
+    assert chunk.detectors.dtype == np.uint8
+    assert chunk.timestamps.dtype == np.int64
+    assert chunk.nanotimes.dtype == np.uint16
+    assert np.array_equal(chunk.detectors, t3_data['detectors'])
+    assert np.array_equal(chunk.timestamps, t3_data['timestamps'])
+    assert np.array_equal(chunk.nanotimes, t3_data['nanotimes'])
+
+
+def test_decode_as_phconvert(t3_data):
+    pqreader = pytest.importorskip('phconvert.pqreader')
+    detectors, timestamps, nanotimes, _ = pqreader.process_t3records(
+        t3_data['records'], time_bit=10, dtime_bit=15, ch_bit=6, special_bit=True,
+        ovcfunc=pqreader._correct_overflow_nsync)
+    chunk = decode_by_chunks(t3_data['records'], 3000)
+    assert np.array_equal(chunk.detectors, detectors)
+    assert np.array_equal(chunk.timestamps, timestamps)
+    assert np.array_equal(chunk.nanotimes, nanotimes)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 999, 2 ** 14, 50000])
+def test_overflow_carried_between_chunks(t3_data, chunk_size):
+    chunk = decode_by_chunks(t3_data['records'], chunk_size)
+    assert np.array_equal(chunk.timestamps, t3_data['timestamps'])
+    photons = chunk.detectors < 64
+    assert np.all(np.diff(chunk.timestamps[photons]) >= 0)
+
+
+def test_count_overflows(t3_data):
+    records = t3_data['records']
+    last_photon = t3_data['timestamps'][t3_data['detectors'] < 64][-1]
+    assert count_overflows(records) == last_photon // T3_WRAPAROUND
+    half = records.size // 2
+    assert count_overflows(records[:half]) + count_overflows(records[half:]) == count_overflows(records)
+
+
+def test_pool_reuse():
+    decoder = T3Decoder(100, pool_size=2)
+    records = np.zeros((50,), dtype=np.uint32)
+    first = decoder.decode(records)
+    second = decoder.decode(records)
+    assert decoder.pool.Nallocated == 2
+    third = decoder.decode(records)
+    assert decoder.pool.Nallocated == 3  # all the chunks are in use
+    first.release()
+    first.release()  # released once only
+    fourth = decoder.decode(records)
+    assert decoder.pool.Nallocated == 3
+    assert np.shares_memory(fourth.detectors, first.detectors)
+    for chunk in (second, third, fourth):
+        chunk.release()
+
+
+def test_decode_into(t3_data):
+    records = t3_data['records']
+    out = PhotonChunk.empty(records.size)
+    decoder = T3Decoder(1000)
+    chunk = decoder.decode(records, out=out)
+    assert chunk is out
+    assert np.array_equal(out.timestamps, t3_data['timestamps'])
+    assert decoder.pool.Nallocated == 4  # larger than the capacity, nothing taken from the pool
+
+
+def test_chunk_indexing_and_histograms(t3_data):
+    chunk = PhotonChunk(t3_data['detectors'], t3_data['timestamps'], t3_data['nanotimes'])
+    assert len(chunk[10:20]) == 10
+    assert np.shares_memory(chunk[10:20].timestamps, chunk.timestamps)
+    photons = chunk[chunk.detectors < 2]
+    assert not np.shares_memory(photons.timestamps, chunk.timestamps)
+    histograms = chunk.histograms(1024)
+    assert histograms.shape == (2, 1024)
+    for channel in range(2):
+        assert np.array_equal(histograms[channel], np.bincount(photons.nanotimes[photons.detectors == channel],
+                                                               minlength=1024))
+    assert len(PhotonChunk.concatenate([])) == 0
+
+
+def test_buffer_pool():
+    pool = BufferPool(lambda: np.zeros((4,)), size=1)
+    buffer = pool.acquire()
+    other = pool.acquire()
+    assert pool.Nallocated == 2 and buffer is not other
+    pool.release(buffer)
+    assert pool.acquire() is buffer
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.processing.corrections import correct_pileup, live_cycles, pileup_ratio
+
+
+N_EXCITATIONS = 1e6
+RESOLUTION = 25e-12
+SYNC_PERIOD = 1024 * RESOLUTION
+
+
+def true_rates(nbins: int = 1024, total: float = 0.5) -> np.ndarray:
+    """Mean number of photons per excitation cycle in each bin, for an exponential decay"""
+    decay = np.exp(-np.arange(nbins) / 100)
+    return total * decay / decay.sum()
+
+
+def piled_up(rates: np.ndarray) -> np.ndarray:
+    """Expected histogram of a channel detecting at most one photon per excitation cycle"""
+    detected = 1 - np.exp(-rates)  # probability of at least one photon in a bin
+    live = np.concatenate(([1.], np.cumprod(1 - detected)[:-1]))
+    return N_EXCITATIONS * live * detected
+
+
+@pytest.mark.parametrize('deadtime', [None, 2 * SYNC_PERIOD])
+def test_coates(deadtime):
+    rates = true_rates()
+    histogram = piled_up(rates)
+    assert histogram[-1] / histogram[0] < 0.9 * rates[-1] / rates[0]  # pile-up biases towards short times
+    corrected = correct_pileup(histogram, N_EXCITATIONS, RESOLUTION, SYNC_PERIOD, deadtime)
+    assert np.allclose(corrected, N_EXCITATIONS * rates)
+
+
+def test_no_deadtime():
+    histogram = piled_up(true_rates())
+    corrected = correct_pileup(histogram, N_EXCITATIONS, RESOLUTION, SYNC_PERIOD, deadtime=0.)
+    assert np.allclose(corrected, -N_EXCITATIONS * np.log1p(-histogram / N_EXCITATIONS))
+
+
+def test_deadtime_wraps_around():
+    histogram = np.zeros((100,))
+    histogram[95] = 10.
+    live = live_cycles(histogram, 1000, period_bins=100, dead_bins=10)
+    assert np.all(live[:6] == 990)  # dead time of the photons at the end of the previous period
+    assert np.all(live[6:96] == 1000)
+    assert np.all(live[96:] == 990)
+
+
+def test_saturated_and_empty():
+    histogram = np.array([1000., 0., 5.])
+    corrected = correct_pileup(histogram, 1000, RESOLUTION, SYNC_PERIOD)
+    assert np.all(np.isfinite(corrected))
+    assert np.array_equal(correct_pileup(histogram, 0, RESOLUTION, SYNC_PERIOD), histogram)
+
+
+def test_pileup_ratio():
+    assert pileup_ratio(1e5, 4e7) == pytest.approx(2.5e-3)
+    assert pileup_ratio(1e5, 0) == 0
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.hardware.picoquant.engine import TH260Engine
+from pymodaq_plugins_picoquant.hardware.picoquant.replay import Th260Replay
+from pymodaq_plugins_picoquant.processing.chunks import PhotonChunk
+from pymodaq_plugins_picoquant.processing.filters import PhotonFilter
+from pymodaq_plugins_picoquant.processing.photons import nanotime_histograms
+
+from conftest import FakeTh260
+
+
+@pytest.fixture
+def engine(fake_th260):
+    engine = TH260Engine(fake_th260)
+    engine.open()
+    yield engine
+    engine.close()
+
+
+def acquire(engine: TH260Engine) -> PhotonChunk:
+    chunks = [chunk.copy() for chunk in engine.iter_chunks(timeout=5)]
+    assert engine.wait(5)
+    return PhotonChunk.concatenate(chunks)
+
+
+def test_t3_acquisition(engine, t3_data):
+    settings = engine.configure('T3', resolution=0.025)
+    assert settings == dict(mode='T3', resolution=0.025, nbins=1024, Nchannels=2)
+    engine.start(1000)
+    photons = acquire(engine)
+    assert np.array_equal(photons.detectors, t3_data['detectors'])
+    assert np.array_equal(photons.timestamps, t3_data['timestamps'])
+    assert np.array_equal(photons.nanotimes, t3_data['nanotimes'])
+    assert np.array_equal(engine.histogram(), nanotime_histograms(t3_data['detectors'], t3_data['nanotimes'], 1024))
+    assert not engine.running
+    assert engine.metrics.counters['decoded_records'] == t3_data['records'].size
+    with pytest.raises(StopIteration):
+        engine.next_chunk()
+
+
+def test_restart(engine, t3_data):
+    engine.configure('T3')
+    for _ in range(2):
+        engine.start(1000)
+        assert len(acquire(engine)) == t3_data['records'].size
+        assert engine.histogram().sum() == np.sum(t3_data['detectors'] < 2)
+
+
+def test_photon_filter(engine, t3_data):
+    photon_filter = PhotonFilter(channels=[1], gates=[(200, 400)], pass_markers=False)
+    engine.configure('T3', photon_filter=photon_filter)
+    engine.start(1000)
+    photons = acquire(engine)
+    keep = photon_filter.mask(t3_data['detectors'], t3_data['nanotimes'])
+    assert np.array_equal(photons.timestamps, t3_data['timestamps'][keep])
+    assert engine.histogram()[0].sum() == 0
+
+
+def test_stop(t3_data):
+    engine = TH260Engine(FakeTh260(t3_data['records'], chunk=100, period=0.005))
+    engine.open()
+    engine.configure('T3')
+    engine.start(1000)
+    assert engine.next_chunk(timeout=5) is not None
+    engine.stop()
+    assert not engine.running
+    chunks = list(engine.iter_chunks(timeout=1))  # the queued chunks can still be iterated
+    assert sum(len(chunk) for chunk in chunks) < t3_data['records'].size
+    engine.close()
+
+
+def test_configure_keeps_unset_settings(engine, fake_th260):
+    assert engine.configure('Histo', resolution=0.1, nbins=2048)['resolution'] == 0.1
+    assert fake_th260.binning == 2
+    settings = engine.configure('Histo')
+    assert settings['resolution'] == 0.1 and settings['nbins'] == 2048
+    assert fake_th260.binning == 2 and fake_th260.histogram_length == 2048
+    assert engine.configure('T3', resolution=0.06)['resolution'] == 0.05
+
+
+def test_histogram_mode(engine, fake_th260):
+    engine.configure('Histo', nbins=1024)
+    engine.start(50)
+    assert engine.running
+    assert 0 < engine.remaining_time() <= 50
+    assert engine.wait(5)
+    assert engine.remaining_time() == 0
+    histograms = engine.histogram()
+    assert histograms.shape == (2, 1024) and histograms.dtype == np.uint32
+    assert np.all(histograms[0] == 1) and np.all(histograms[1] == 2)
+    out = [np.zeros((1024,), dtype=np.uint32)]
+    assert engine.histogram(out=out, channels=[1]) is out
+    assert np.all(out[0] == 2)
+    with pytest.raises(RuntimeError):
+        engine.next_chunk()
+
+
+def test_wait_timeout(engine):
+    engine.configure('Histo')
+    engine.start(10000)
+    assert not engine.wait(0.05)
+    engine.stop()
+
+
+def test_errors(engine):
+    with pytest.raises(RuntimeError):
+        engine.start(100)  # not configured
+    with pytest.raises(ValueError):
+        engine.configure('T2')
+    with pytest.raises(ValueError):
+        engine.set_sync(level=-50)
+
+
+def test_replay(capture, t3_data):
+    engine = TH260Engine(Th260Replay(capture, speed=0))
+    engine.open()
+    engine.configure('T3')
+    engine.start(1000)
+    assert np.array_equal(acquire(engine).timestamps, t3_data['timestamps'])
+    engine.configure('Histo')
+    engine.start(20)
+    assert engine.wait(5)
+    engine.close()
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.processing.chunks import PhotonChunk
+from pymodaq_plugins_picoquant.processing.filters import PhotonFilter, parse_gates, OVERFLOW_DETECTOR
+
+
+@pytest.fixture
+def chunk(t3_data) -> PhotonChunk:
+    return PhotonChunk(t3_data['detectors'], t3_data['timestamps'], t3_data['nanotimes'])
+
+
+def test_parse_gates():
+    assert parse_gates('0-10, 20.5-30') == [(0., 10.), (20.5, 30.)]
+    assert parse_gates('1-2; 3-4,') == [(1., 2.), (3., 4.)]
+    assert parse_gates('') == []
+
+
+def test_default_filter_drops_overflows_only(chunk):
+    photon_filter = PhotonFilter()
+    kept = photon_filter.apply(chunk)
+    assert np.array_equal(kept.detectors, chunk.detectors[chunk.detectors != OVERFLOW_DETECTOR])
+    assert np.array_equal(kept.timestamps, chunk.timestamps[chunk.detectors != OVERFLOW_DETECTOR])
+    assert photon_filter.active
+    assert not PhotonFilter(drop_overflows=False).active
+
+
+def test_channels_and_markers(chunk):
+    kept = PhotonFilter(channels=[1], pass_markers=False).apply(chunk)
+    assert np.all(kept.detectors == 1)
+    assert len(kept) == np.sum(chunk.detectors == 1)
+    kept = PhotonFilter(channels=[0], pass_markers=True).apply(chunk)
+    assert set(np.unique(kept.detectors)) == {0, 65}
+
+
+def test_gates(chunk):
+    gates = [(100, 200), (300, 350)]
+    kept = PhotonFilter(gates=gates).apply(chunk)
+    is_photon = kept.detectors < 64
+    nanotimes = kept.nanotimes[is_photon]
+    assert np.all(((nanotimes >= 100) & (nanotimes < 200)) | ((nanotimes >= 300) & (nanotimes < 350)))
+    photons = chunk.detectors < 64
+    in_gates = ((chunk.nanotimes >= 100) & (chunk.nanotimes < 200)) | \
+        ((chunk.nanotimes >= 300) & (chunk.nanotimes < 350))
+    assert is_photon.sum() == np.sum(photons & in_gates)
+    assert np.sum(kept.detectors == 65) == np.sum(chunk.detectors == 65)  # markers are not gated
+
+
+def test_from_nanoseconds():
+    photon_filter = PhotonFilter.from_nanoseconds(0.025, gates=[(1., 2.01)])
+    assert photon_filter.gates == [(40, 81)]
+
+
+def test_call_matches_apply(chunk):
+    photon_filter = PhotonFilter(channels=[0], gates=[(0, 300)])
+    detectors, timestamps, nanotimes = photon_filter(chunk.detectors, chunk.timestamps, chunk.nanotimes)
+    kept = photon_filter.apply(chunk)
+    assert np.array_equal(detectors, kept.detectors)
+    assert np.array_equal(timestamps, kept.timestamps)
+    assert np.array_equal(nanotimes, kept.nanotimes)
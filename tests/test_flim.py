@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.processing.flim import (FlimAccumulator, FlimStore, TiledFlimAccumulator,
+                                                       SparseFlimAccumulator)
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+
+NX, NY, NBINS = 5, 8, 512
+
+
+def reference_cube(t3_data, Nx: int = NX, Ny: int = NY, nbins: int = NBINS, channel: int = 0) -> np.ndarray:
+    """FLIM cube computed record by record"""
+    cube = np.zeros((Nx, Ny, nbins), dtype=np.uint32)
+    pixel = -1
+    for detector, nanotime in zip(t3_data['detectors'], t3_data['nanotimes']):
+        if detector == 65:
+            pixel += 1
+        elif detector == channel and nanotime < nbins and pixel >= 0:
+            cube[pixel // Ny % Nx, pixel % Ny, nanotime] += 1
+    return cube
+
+
+def add_by_chunks(flim: FlimAccumulator, t3_data, chunk_size: int):
+    for start in range(0, t3_data['detectors'].size, chunk_size):
+        flim.add(t3_data['detectors'][start:start + chunk_size], t3_data['nanotimes'][start:start + chunk_size])
+
+
+@pytest.mark.parametrize('chunk_size', [77, 3000, 10 ** 6])
+def test_accumulator(t3_data, chunk_size):
+    flim = FlimAccumulator(NX, NY, NBINS)
+    add_by_chunks(flim, t3_data, chunk_size)
+    cube = reference_cube(t3_data)
+    assert flim.Nmarkers == np.sum(t3_data['detectors'] == 65)
+    assert flim.Nmarkers > NX * NY  # the scan is repeated
+    assert np.array_equal(flim.cube, cube)
+    assert np.array_equal(flim.intensity, cube.sum(axis=-1))
+
+
+@pytest.mark.parametrize('suffix', ['.h5', '.zarr'])
+@pytest.mark.parametrize('tile', [(2, None), (16, 3)])
+def test_tiled_accumulator(tmp_path, t3_data, suffix, tile):
+    if suffix == '.zarr' and zarr is None:
+        pytest.skip('zarr is not installed')
+    store = FlimStore(tmp_path.joinpath(f'flim{suffix}'), NX, NY, NBINS, tile=tile, Nworkers=2)
+    flim = TiledFlimAccumulator(store)
+    add_by_chunks(flim, t3_data, 1000)
+    flim.close()
+    cube = reference_cube(t3_data)
+    assert np.array_equal(flim.cube, cube)
+    assert np.array_equal(flim.intensity, cube.sum(axis=-1))
+    assert np.array_equal(store.read(slice(1, 3), slice(2, 5)), cube[1:3, 2:5])
+    store.close()
+
+
+def test_store_saturation(tmp_path):
+    store = FlimStore(tmp_path.joinpath('flim.h5'), 2, 2, 4, dtype=np.uint16)
+    store.write_tile(0, 0, np.full((2, 2, 4), 60000, dtype=np.uint32))
+    store.write_tile(0, 0, np.full((2, 2, 4), 10000, dtype=np.uint32), add=True)
+    assert np.all(store.read() == np.iinfo(np.uint16).max)
+    store.close()
+
+
+def test_zarr_missing(tmp_path, monkeypatch):
+    from pymodaq_plugins_picoquant.processing import flim
+    monkeypatch.setattr(flim, 'zarr', None)
+    with pytest.raises(ImportError):
+        FlimStore(tmp_path.joinpath('flim.zarr'), 2, 2, 4)
+
+
+def test_sparse_accumulator(tmp_path, t3_data):
+    flim = SparseFlimAccumulator(NX, NY, NBINS)
+    add_by_chunks(flim, t3_data, 1000)
+    cube = reference_cube(t3_data)
+    assert flim.nnz == np.count_nonzero(cube)
+    assert np.array_equal(flim.cube, cube)
+    assert np.array_equal(flim.intensity, cube.sum(axis=-1))
+    assert np.array_equal(flim.tile(slice(1, 4), slice(0, 8, 3)), cube[1:4, 0:8:3])
+
+    indptr, nanotimes, counts = flim.to_csr()
+    assert indptr.size == NX * NY + 1
+    pixels = np.repeat(np.arange(NX * NY), np.diff(indptr))
+    assert np.array_equal(cube.reshape((NX * NY, NBINS))[pixels, nanotimes], counts)
+
+    flim.save(tmp_path.joinpath('flim.h5'))
+    loaded = SparseFlimAccumulator.load(tmp_path.joinpath('flim.h5'))
+    assert (loaded.Nx, loaded.Ny, loaded.nbins) == (NX, NY, NBINS)
+    assert np.array_equal(loaded.cube, cube)
+
+
+def test_sparse_compaction(t3_data):
+    flim = SparseFlimAccumulator(NX, NY, NBINS)
+    half = t3_data['detectors'].size // 2
+    flim.add(t3_data['detectors'][:half], t3_data['nanotimes'][:half])
+    flim.compact()
+    for start in range(half, t3_data['detectors'].size, 500):  # merged with the compacted bins
+        flim.add(t3_data['detectors'][start:start + 500], t3_data['nanotimes'][start:start + 500])
+    cube = reference_cube(t3_data)
+    assert flim.nnz == np.count_nonzero(cube)
+    assert np.array_equal(flim.cube, cube)
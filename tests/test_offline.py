@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.processing.offline import decode_file, chunk_bounds
+
+
+def assert_decoded(chunk, t3_data):
+    assert np.array_equal(chunk.detectors, t3_data['detectors'])
+    assert np.array_equal(chunk.timestamps, t3_data['timestamps'])
+    assert np.array_equal(chunk.nanotimes, t3_data['nanotimes'])
+
+
+def test_chunk_bounds():
+    assert chunk_bounds(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert chunk_bounds(0, 4) == []
+
+
+def test_sequential(tmp_path, t3_data):
+    path = tmp_path.joinpath('records.bin')
+    t3_data['records'].tofile(path)
+    chunk = decode_file(path, tmp_path.joinpath('sequential'), Nworkers=1, chunk_size=3000, block_size=1000)
+    assert_decoded(chunk, t3_data)
+    assert tmp_path.joinpath('sequential', 'timestamps.npy').is_file()
+
+
+@pytest.mark.parametrize('chunk_size, block_size', [(3001, 1000), (2 ** 22, 2 ** 16), (5000, 5000)])
+def test_parallel_as_sequential(tmp_path, t3_data, chunk_size, block_size):
+    path = tmp_path.joinpath('records.bin')
+    t3_data['records'].tofile(path)
+    sequential = decode_file(path, tmp_path.joinpath('sequential'), Nworkers=1)
+    parallel = decode_file(path, tmp_path.joinpath('parallel'), Nworkers=2, chunk_size=chunk_size,
+                           block_size=block_size)
+    for field in ('detectors', 'timestamps', 'nanotimes'):
+        assert np.array_equal(getattr(parallel, field), getattr(sequential, field))
+    assert_decoded(parallel, t3_data)
+
+
+def test_header_offset(tmp_path, t3_data):
+    header = np.full((4,), 0xFFFFFFFF, dtype=np.uint32)
+    path = tmp_path.joinpath('raw.out')
+    np.concatenate((header, t3_data['records'])).tofile(path)
+    chunk = decode_file(path, Nworkers=2, chunk_size=4000, offset=header.nbytes)
+    assert_decoded(chunk, t3_data)
+    assert tmp_path.joinpath('raw_decoded', 'detectors.npy').is_file()
+
+
+def test_capture(capture, t3_data):
+    assert_decoded(decode_file(capture, Nworkers=2, chunk_size=5000), t3_data)
+
+
+def test_empty(tmp_path):
+    path = tmp_path.joinpath('records.bin')
+    path.write_bytes(b'')
+    assert len(decode_file(path)) == 0
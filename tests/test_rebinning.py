@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.processing.rebinning import Rebinner, crop, rebin, log_bin_edges, rebin_edges
+
+
+@pytest.fixture
+def histograms() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return rng.poisson(1000 * np.exp(-np.arange(1024) / 200), (2, 1024)).astype(np.int64)
+
+
+def test_rebin(histograms):
+    rebinned = rebin(histograms, 4)
+    assert rebinned.shape == (2, 256)
+    assert np.array_equal(rebinned.sum(axis=-1), histograms.sum(axis=-1))
+    assert np.array_equal(rebin(histograms[:, :1023], 4), rebinned[:, :255])  # remaining bins are dropped
+    assert rebin(histograms, 1) is histograms
+
+
+def test_log_bin_edges():
+    edges = log_bin_edges(1024, 50)
+    assert edges[0] == 0 and edges[-1] == 1024
+    assert np.all(np.diff(edges) > 0)
+    assert len(edges) <= 51
+    assert np.all(np.diff(np.diff(edges)) >= -1)  # widths increase (up to rounding)
+    assert np.array_equal(log_bin_edges(4, 10, first_width=8), [0, 4])
+
+
+def test_rebin_edges(histograms):
+    edges = log_bin_edges(1024, 50)
+    summed = rebin_edges(histograms, edges)
+    assert np.array_equal(summed.sum(axis=-1), histograms.sum(axis=-1))
+    density = rebin_edges(histograms, edges, density=True)
+    assert np.allclose(density * np.diff(edges), summed)
+
+
+@pytest.mark.parametrize('start, stop, factor', [(0, None, 1), (100, 612, 4), (10, 1000, 3), (0, 5000, 8)])
+def test_roi_counts(histograms, start, stop, factor):
+    rebinner = Rebinner(start, stop, factor, log_bins=0)
+    data, axis = rebinner(histograms)
+    roi = crop(histograms, start, stop)
+    length = roi.shape[-1] // factor * factor
+    assert np.array_equal(data.sum(axis=-1), roi[..., :length].sum(axis=-1))
+    assert axis.size == data.shape[-1]
+    assert axis[0] == pytest.approx(start + (factor - 1) / 2)
+
+
+def test_log_round_trip(histograms):
+    """Logarithmic bins keep the counts of the region of interest, and the mean time of their bins"""
+    rebinner = Rebinner(50, 950, factor=2, log_bins=40, density=False)
+    data, axis = rebinner(histograms, np.arange(1024) * 0.025)
+    assert np.array_equal(data.sum(axis=-1), histograms[:, 50:950].sum(axis=-1))
+    assert np.all(np.diff(axis) > 0)
+    assert axis[0] >= 50 * 0.025 and axis[-1] < 950 * 0.025
+    density, _ = Rebinner(50, 950, factor=2, log_bins=40, density=True)(histograms)
+    edges = log_bin_edges(450, 40)
+    assert np.allclose(density * np.diff(edges), data)
+
+
+def test_empty_roi(histograms):
+    rebinner = Rebinner(2000, None, factor=4)
+    assert rebinner.bounds(1024) == (1024, 1024)
+    assert not rebinner.valid(1024)
+    data, axis = rebinner(histograms)
+    assert data is histograms
+    assert axis.size == 1024
+    assert not Rebinner(0, 3, factor=4).valid(1024)
+    assert Rebinner(0, 4, factor=4).valid(1024)
+    assert not Rebinner().active
@@ -0,0 +1,94 @@
+import ctypes
+import json
+import time
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.hardware.picoquant.replay import (Th260Replay, ReplayCalls, REPLAY_DTYPE,
+                                                                 flags_to_int, int_to_flags, new_capture_folder)
+
+
+def read_all(replay: Th260Replay, count: int = 2 ** 14) -> np.ndarray:
+    """Read the FIFO of a started replay until the end of its measurement"""
+    buffer = np.zeros((count,), dtype=np.uint32)
+    pointer = buffer.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32))
+    chunks = []
+    while not replay.TH260_CTCStatus(0):
+        nrecords = replay.TH260_ReadFiFo(0, count, pointer)
+        chunks.append(buffer[:nrecords].copy())
+    return np.concatenate(chunks)
+
+
+def test_flags():
+    assert int_to_flags(flags_to_int(['OVERFLOW', 'SYNC_LOST'])) == ['OVERFLOW', 'SYNC_LOST']
+    assert int_to_flags(0) == []
+
+
+def test_new_capture_folder(tmp_path):
+    paths = [new_capture_folder(tmp_path) for _ in range(3)]
+    assert len(set(paths)) == 3
+    assert all(path.is_dir() for path in paths)
+
+
+def test_capture_content(capture, t3_data):
+    header = json.loads(capture.joinpath('header.json').read_text())
+    assert header['Nrecords'] == t3_data['records'].size
+    assert header['mode'] == 'T3'
+    assert header['Nchannels'] == 2
+    records = np.fromfile(capture.joinpath('records.bin'), dtype=np.uint32)
+    assert np.array_equal(records, t3_data['records'])
+    events = np.fromfile(capture.joinpath('events.bin'), dtype=REPLAY_DTYPE)
+    reads = events[(events['call'] == ReplayCalls.READFIFO) & (events['value'] > 0)]
+    assert reads['value'].sum() == t3_data['records'].size
+    assert np.array_equal(reads['offset'], np.concatenate(([0], np.cumsum(reads['value'])[:-1])))
+
+
+@pytest.mark.parametrize('count', [2 ** 14, 1000])
+def test_replay_as_fast_as_possible(capture, t3_data, count):
+    replay = Th260Replay(capture, speed=0)
+    replay.TH260_Initialize(0, 3)
+    replay.TH260_StartMeas(0, 1000)
+    assert np.array_equal(read_all(replay, count), t3_data['records'])
+    assert replay.TH260_GetSyncRate(0) == 40000000
+    assert replay.TH260_GetFlags(0) == []
+
+
+def test_replay_restart(capture, t3_data):
+    replay = Th260Replay(capture, speed=0)
+    for _ in range(2):
+        replay.TH260_StartMeas(0, 1000)
+        assert np.array_equal(read_all(replay), t3_data['records'])
+
+
+def test_replay_timing(capture):
+    replay = Th260Replay(capture, speed=2)
+    replay.TH260_StartMeas(0, 1000)
+    start = time.perf_counter()
+    read_all(replay)
+    duration = time.perf_counter() - start
+    assert duration >= replay.chunks['time'][-1] / 2
+
+
+def test_replay_setters_and_unknown_calls(capture):
+    replay = Th260Replay(capture, speed=0)
+    assert replay.TH260_SetSyncDiv(0, 2) is None
+    with pytest.raises(AttributeError):
+        replay.TH260_GetUnknown(0)
+
+
+@pytest.mark.parametrize('speed', [0, 1])
+def test_replay_histogram_mode(capture, speed):
+    """Histo measurements never read the FIFO, they end once their acquisition time is elapsed"""
+    replay = Th260Replay(capture, speed=speed)
+    replay.TH260_Initialize(0, 0)
+    replay.TH260_StartMeas(0, 50)
+    start = time.perf_counter()
+    while not replay.TH260_CTCStatus(0):
+        assert time.perf_counter() - start < 5
+        time.sleep(0.001)
+    assert time.perf_counter() - start >= (0.05 if speed > 0 else 0)
+    assert replay.TH260_GetElapsedMeasTime(0) == 50
+    histogram = np.ones((replay.histogram_length,), dtype=np.uint32)
+    replay.TH260_GetHistogram(0, histogram.ctypes.data_as(ctypes.POINTER(ctypes.c_uint32)), 0)
+    assert not histogram.any()
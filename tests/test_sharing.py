@@ -0,0 +1,101 @@
+import uuid
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.processing.chunks import PhotonChunk
+from pymodaq_plugins_picoquant.processing.sharing import (SharedArrayWriter, SharedArrayReader, SharedPublisher,
+                                                          PHOTON_DTYPE, pack_photons)
+
+
+@pytest.fixture
+def name() -> str:
+    return f'th260_test_{uuid.uuid4().hex[:8]}'
+
+
+def test_publish_and_read(name):
+    writer = SharedArrayWriter(name, 2 ** 16)
+    reader = SharedArrayReader(name)
+    try:
+        assert reader.read() == (0, None)
+        histograms = np.arange(2048, dtype=np.uint32).reshape((2, 1024))
+        seq = writer.publish(histograms)
+        assert seq == 2 and reader.seq == seq
+        read_seq, data = reader.read()
+        assert read_seq == seq
+        assert data.dtype == histograms.dtype
+        assert np.array_equal(data, histograms)
+
+        writer.publish(np.ones((10,), dtype=np.float64))
+        read_seq, data = reader.read()
+        assert read_seq == 4
+        assert np.array_equal(data, np.ones((10,)))
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_structured_photons(name, t3_data):
+    chunk = PhotonChunk(t3_data['detectors'], t3_data['timestamps'], t3_data['nanotimes'])
+    photons = chunk.to_records()
+    assert np.array_equal(photons, pack_photons(chunk.detectors, chunk.timestamps, chunk.nanotimes))
+    writer = SharedArrayWriter(name, photons.nbytes)
+    reader = SharedArrayReader(name)
+    try:
+        writer.publish(photons)
+        _, data = reader.read()
+        assert data.dtype == PHOTON_DTYPE
+        assert np.array_equal(data['timestamp'], t3_data['timestamps'])
+        assert np.array_equal(data['detector'], t3_data['detectors'])
+        assert np.array_equal(data['nanotime'], t3_data['nanotimes'])
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_capacity(name):
+    writer = SharedArrayWriter(name, 16)
+    try:
+        with pytest.raises(ValueError):
+            writer.publish(np.zeros((3,), dtype=np.float64))
+        with pytest.raises(ValueError):
+            writer.publish(np.zeros((1, 1, 1, 1, 1), dtype=np.uint8))
+    finally:
+        writer.close()
+
+
+def test_closed_flag(name):
+    writer = SharedArrayWriter(name, 64)
+    reader = SharedArrayReader(name)
+    try:
+        assert not reader.closed
+        writer.close()
+        assert reader.closed
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_stale_segment_replaced(name):
+    stale = SharedArrayWriter(name, 64)
+    stale.publish(np.ones((4,)))
+    writer = SharedArrayWriter(name, 64)  # a previous session did not close its segment
+    try:
+        assert writer.seq == 0
+    finally:
+        writer.close()
+
+
+def test_publisher(name):
+    publisher = SharedPublisher(name, capacities={'histograms': 2 ** 14})
+    try:
+        publisher.publish('histograms', np.zeros((2, 1024), dtype=np.uint32))
+        publisher.publish('photons', np.zeros((10,), dtype=PHOTON_DTYPE))
+        assert publisher.writers['histograms'].capacity == 2 ** 14
+        assert publisher.writers['photons'].capacity == 10 * PHOTON_DTYPE.itemsize
+        reader = SharedArrayReader(publisher.segment_name('photons'))
+        assert reader.read()[1].shape == (10,)
+        reader.close()
+    finally:
+        publisher.close()
+    assert publisher.writers == {}
@@ -0,0 +1,94 @@
+import socket
+import time
+
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.processing.sharing import PHOTON_DTYPE
+from pymodaq_plugins_picoquant.processing.streaming import (StreamServer, StreamClient, encode_frame,
+                                                            receive_frame)
+
+
+def wait_for(condition, timeout: float = 5.):
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize('array', [np.arange(2048, dtype=np.uint32).reshape((2, 1024)),
+                                   np.zeros((5,), dtype=PHOTON_DTYPE)])
+def test_frame_round_trip(array):
+    sender, receiver = socket.socketpair()
+    try:
+        sender.sendall(encode_frame('topic', array, seq=7, timestamp=1.5))
+        topic, seq, timestamp, data = receive_frame(receiver)
+    finally:
+        sender.close()
+        receiver.close()
+    assert (topic, seq, timestamp) == ('topic', 7, 1.5)
+    assert data.dtype == array.dtype
+    assert np.array_equal(data, array)
+
+
+def test_not_a_stream():
+    sender, receiver = socket.socketpair()
+    try:
+        sender.sendall(b'HTTP' + bytes(40))
+        with pytest.raises(ValueError):
+            receive_frame(receiver)
+    finally:
+        sender.close()
+        receiver.close()
+
+
+def test_server_to_clients():
+    server = StreamServer(port=0)
+    try:
+        clients = [StreamClient(server.host, server.port, timeout=5) for _ in range(2)]
+        wait_for(lambda: server.Nclients == 2)
+        histograms = np.arange(2048, dtype=np.uint32).reshape((2, 1024))
+        assert server.publish('histograms', histograms) == 1
+        assert server.publish('histograms', histograms + 1) == 2
+        assert server.publish('photons', np.zeros((3,), dtype=PHOTON_DTYPE)) == 1
+        for client in clients:
+            frames = [client.receive() for _ in range(3)]
+            assert [(topic, seq) for topic, seq, _, _ in frames] == [('histograms', 1), ('histograms', 2),
+                                                                     ('photons', 1)]
+            assert np.array_equal(frames[1][3], histograms + 1)
+            client.close()
+        assert server.dropped == 0
+    finally:
+        server.close()
+
+
+def test_slow_client_drops_oldest_frames():
+    server = StreamServer(port=0, max_queue=2)
+    try:
+        with StreamClient(server.host, server.port, timeout=5):  # never receives
+            wait_for(lambda: server.Nclients == 1)
+            frames = server._clients[0].frames
+            large = np.zeros((2 ** 22,))  # larger than the socket buffers, the sending thread blocks on it
+            server.publish('histograms', large)
+            wait_for(lambda: len(frames) == 0)
+            for ind in range(5):
+                server.publish('histograms', np.full((10,), ind))
+            assert server.dropped == 3
+            assert len(frames) == 2
+    finally:
+        server.close()
+
+
+def test_client_iteration_ends_with_server():
+    server = StreamServer(port=0)
+    client = StreamClient(server.host, server.port, timeout=5)
+    try:
+        wait_for(lambda: server.Nclients == 1)
+        server.publish('trace', np.ones((4,)))
+        time.sleep(0.1)
+        server.close()
+        frames = list(client)
+        assert [topic for topic, _, _, _ in frames] == ['trace']
+    finally:
+        client.close()
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from pymodaq_plugins_picoquant.processing.trace import IntensityTrace
+
+
+def expected_counts(t3_data, bin_width: int, Nchannels: int = 2):
+    is_photon = t3_data['detectors'] < Nchannels
+    bins = t3_data['timestamps'][is_photon] // bin_width
+    first = bins[0]
+    Nbins = bins[-1] - first + 1
+    counts = np.zeros((Nchannels, Nbins), dtype=np.int64)
+    np.add.at(counts, (t3_data['detectors'][is_photon], bins - first), 1)
+    return np.arange(first, first + Nbins), counts
+
+
+@pytest.mark.parametrize('chunk_size', [1000, 7777, 10 ** 6])
+def test_trace_by_chunks(t3_data, chunk_size):
+    bin_width = 5000
+    trace = IntensityTrace(bin_width, length=10 ** 6)
+    indexes, counts = [], []
+    for start in range(0, t3_data['detectors'].size, chunk_size):
+        chunk_indexes, chunk_counts = trace.add(t3_data['detectors'][start:start + chunk_size],
+                                                t3_data['timestamps'][start:start + chunk_size])
+        indexes.append(chunk_indexes)
+        counts.append(chunk_counts)
+    chunk_indexes, chunk_counts = trace.flush()
+    indexes = np.concatenate(indexes + [chunk_indexes])
+    counts = np.concatenate(counts + [chunk_counts], axis=1)
+
+    expected_indexes, expected = expected_counts(t3_data, bin_width)
+    assert np.array_equal(indexes, expected_indexes)
+    assert np.array_equal(counts, expected)
+    assert trace.Nbins == expected_indexes.size
+
+
+def test_circular_buffer(t3_data):
+    bin_width = 5000
+    trace = IntensityTrace(bin_width, length=100)
+    for start in range(0, t3_data['detectors'].size, 3000):
+        trace.add(t3_data['detectors'][start:start + 3000], t3_data['timestamps'][start:start + 3000])
+    trace.flush()
+    indexes, counts = trace.trace()
+    expected_indexes, expected = expected_counts(t3_data, bin_width)
+    assert np.array_equal(indexes, expected_indexes[-100:])
+    assert np.array_equal(counts, expected[:, -100:])
+
+
+def test_no_photons():
+    trace = IntensityTrace(10)
+    indexes, counts = trace.add(np.array([127], dtype=np.uint8), np.array([1024], dtype=np.int64))
+    assert indexes.size == 0
+    assert counts.shape == (2, 0)
+    assert trace.flush()[0].size == 0